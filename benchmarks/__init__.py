@@ -0,0 +1 @@
+"""Benchmarks for ionical (run from the repository root; see bench_*.py)."""
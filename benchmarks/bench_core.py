@@ -0,0 +1,172 @@
+"""Time ionical's core operations on synthetic workloads.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.bench_core --scales small medium
+    python -m benchmarks.bench_core --json results.json
+    python -m benchmarks.bench_core --baseline results.json
+
+With --baseline, the run fails (exit status 1) if any timing is more
+than --tolerance slower than the same timing in the baseline file.
+"""
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+import toml
+
+from ionical.__main__ import SAMPLE_CFG_TOML
+from ionical.ionical import Cal, Schedule, ScheduleHistory, ScheduleWriter
+from ionical.ionical import sub_cfg
+
+from tests.ics_generator import Workload, write_workload
+
+# Formatting and classification options, as in a freshly generated config
+CFG = toml.loads(SAMPLE_CFG_TOML)
+FMT_CFG = sub_cfg(CFG, "formatting")
+CLASSIFICATION_RULES = sub_cfg(CFG, "event_classifications")
+
+SCALES: Dict[str, Workload] = {
+    "tiny": Workload(num_cals=2, events_per_cal=40, num_versions=3),
+    "small": Workload(num_cals=5, events_per_cal=150, num_versions=5),
+    "medium": Workload(num_cals=20, events_per_cal=300, num_versions=10),
+    "large": Workload(num_cals=50, events_per_cal=500, num_versions=30),
+}
+DEF_SCALES = ["tiny", "small", "medium"]
+DEF_REPEAT = 3
+DEF_TOLERANCE = 0.25
+
+Timings = Dict[str, Dict[str, float]]  # {scale: {operation: seconds}}
+
+
+def best_of(repeat: int, setup: Callable, run: Callable) -> float:
+    """Best wall time of run(setup()) over repeat tries (setup untimed)."""
+    best = float("inf")
+    for _ in range(repeat):
+        arg = setup()
+        start = perf_counter()
+        run(arg)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def time_workload(workload: Workload, work_dir: Path, repeat: int) -> Dict[str, float]:
+    ics_dir = work_dir / "ics"
+    tuples = write_workload(workload, ics_dir)
+
+    def fresh_cals() -> List[Cal]:
+        return [Cal.from_tuple(t, ics_dir=ics_dir) for t in tuples]
+
+    def latest_icals():
+        cals = fresh_cals()
+        return [
+            (cal, cal.schedule_history.most_recent_version_date_and_ical()[1])
+            for cal in cals
+        ]
+
+    def warm_cals() -> List[Cal]:
+        cals = fresh_cals()
+        for cal in cals:
+            cal.current_schedule
+        return cals
+
+    timings = {}
+    timings["from_icalendar"] = best_of(
+        repeat,
+        latest_icals,
+        lambda icals: [Schedule.from_icalendar(ical, cal) for cal, ical in icals],
+    )
+    timings["change_log"] = best_of(
+        repeat,
+        fresh_cals,
+        lambda cals: [cal.schedule_history.change_log() for cal in cals],
+    )
+    timings["change_log_report_for_cals"] = best_of(
+        repeat,
+        fresh_cals,
+        lambda cals: ScheduleHistory.change_log_report_for_cals(
+            cals=cals, fmt_cfg=sub_cfg(FMT_CFG, "changelog")
+        ),
+    )
+    timings["display"] = best_of(
+        repeat,
+        warm_cals,
+        lambda cals: [
+            cal.current_schedule.display(
+                fmt_cfg=sub_cfg(FMT_CFG, "schedule_view"),
+                classification_rules=CLASSIFICATION_RULES,
+            )
+            for cal in cals
+        ],
+    )
+    csv_path = work_dir / "out.csv"
+    timings["csv_write"] = best_of(
+        repeat,
+        warm_cals,
+        lambda cals: ScheduleWriter(cals=cals).csv_write(
+            csv_file=csv_path,
+            classification_rules=CLASSIFICATION_RULES,
+            csv_cfg=sub_cfg(CFG, "csv"),
+        ),
+    )
+    return timings
+
+
+def run(scales: List[str], repeat: int = DEF_REPEAT) -> Timings:
+    results: Timings = {}
+    for scale in scales:
+        with tempfile.TemporaryDirectory() as tmp:
+            results[scale] = time_workload(SCALES[scale], Path(tmp), repeat)
+    return results
+
+
+def report(results: Timings, baseline: Optional[Timings] = None) -> str:
+    lines = [f"{'scale':<8} {'operation':<28} {'seconds':>10} {'vs base':>9}"]
+    for scale, timings in results.items():
+        for operation, seconds in timings.items():
+            base = (baseline or {}).get(scale, {}).get(operation)
+            ratio = f"{seconds / base:8.2f}x" if base else ""
+            lines.append(f"{scale:<8} {operation:<28} {seconds:>10.4f} {ratio:>9}")
+    return "\n".join(lines)
+
+
+def regressions(results: Timings, baseline: Timings, tolerance: float) -> List[str]:
+    return [
+        f"{scale}/{operation}"
+        for scale, timings in results.items()
+        for operation, seconds in timings.items()
+        if baseline.get(scale, {}).get(operation)
+        and seconds > baseline[scale][operation] * (1 + tolerance)
+    ]
+
+
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=DEF_SCALES)
+    parser.add_argument("--repeat", type=int, default=DEF_REPEAT)
+    parser.add_argument("--json", metavar="FILE", help="Save timings as JSON.")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare to saved JSON.")
+    parser.add_argument("--tolerance", type=float, default=DEF_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.repeat)
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+    print(report(results, baseline))
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if baseline:
+        slower = regressions(results, baseline, args.tolerance)
+        if slower:
+            print(f"\nSlower than baseline by over {args.tolerance:.0%}: {slower}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
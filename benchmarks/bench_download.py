@@ -0,0 +1,104 @@
+"""Time '-g' style downloads of many feeds from a local stand-in server.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.bench_download --feeds 300 --latency 0.05
+    python -m benchmarks.bench_download --gzip --etag --polls 2
+    python -m benchmarks.bench_download --failure-rate 0.05 --bandwidth 200000
+
+Each poll downloads every feed, as 'ionical -g' does, into a scratch
+ics directory.  With --polls greater than one, the same ScheduleFeeds
+poll again (as under '--watch'), so --etag shows the effect of
+conditional requests.
+"""
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List
+
+from ionical.ionical import Cal
+
+from tests.http_standin import StandInServer
+from tests.ics_generator import Workload, calendar_versions
+
+DEF_FEEDS = 200
+DEF_EVENTS_PER_FEED = 150
+
+
+def feed_bodies(num_feeds: int, events_per_feed: int) -> Dict[str, bytes]:
+    workload = Workload(
+        num_cals=num_feeds, events_per_cal=events_per_feed, num_versions=1
+    )
+    return {
+        f"synth{n}": calendar_versions(workload, n)[0][1].encode("utf-8")
+        for n in range(num_feeds)
+    }
+
+
+def download_all(cals: List[Cal]) -> int:
+    """Download every Cal's feed (as main() does for '-g'); count failures."""
+    failures = 0
+    for cal in cals:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                cal.download_latest_schedule_version()
+        except Exception:
+            failures += 1
+    return failures
+
+
+def run(args) -> List[str]:
+    bodies = feed_bodies(args.feeds, args.events)
+    total_bytes = sum(len(b) for b in bodies.values())
+    server = StandInServer(
+        bodies,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        gzip=args.gzip,
+        etag=args.etag,
+        failure_rate=args.failure_rate,
+    )
+    lines = [f"{args.feeds} feeds, {total_bytes / 1e6:.2f} MB of ics per poll"]
+    with server, tempfile.TemporaryDirectory() as tmp:
+        cals = [
+            Cal(name, name, server.url_for(name), ics_dir=Path(tmp)) for name in bodies
+        ]
+        for poll in range(1, args.polls + 1):
+            sent_before, start = server.bytes_sent, perf_counter()
+            failures = download_all(cals)
+            elapsed = perf_counter() - start
+            lines.append(
+                f"poll {poll}: {elapsed:8.3f}s  "
+                f"{args.feeds / elapsed:8.1f} feeds/s  "
+                f"{total_bytes / elapsed / 1e6:7.2f} MB/s of ics  "
+                f"{(server.bytes_sent - sent_before) / 1e6:6.2f} MB sent  "
+                f"{failures} failed"
+            )
+    lines.append(
+        f"server: {server.requests} requests, {server.not_modified} not modified, "
+        f"{server.failures} failures injected"
+    )
+    return lines
+
+
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--feeds", type=int, default=DEF_FEEDS)
+    parser.add_argument("--events", type=int, default=DEF_EVENTS_PER_FEED)
+    parser.add_argument("--polls", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds.")
+    parser.add_argument("--bandwidth", type=float, help="Bytes/second per response.")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--etag", action="store_true")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    print("\n".join(run(args)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -19,6 +19,8 @@ DEF_CFG_DIR = "./"
 DEF_ICS_DIR = "./"
 
 DEF_NUM_CHANGELOGS_TO_SHOW = 2
+DEF_WATCH_INTERVAL = 3600  # seconds
+DEF_SERVE_PORT = 8080
 MAX_VERBOSITY = 2
 # Default number of days in past for filtering out events
 DEF_FILTER_NUM_DAYS_AGO = 1
@@ -49,14 +51,81 @@ verbose = 1  # can be a number from 0 to 2. Higher numbers increase
     # show_changelog = true
     # num_changelogs = 2     
     # export_csv     = true   
+    # jsonl_file     = "ionical_export.jsonl"  # same as '--jsonl FILE'
+    # parquet_dir    = "ionical_parquet"       # same as '--parquet DIR'
+    # watch_interval = 3600     # same as '--watch 3600'
+    # serve_port     = 8080     # same as '--serve 8080'
+    # pack           = true     # same as '--pack'
+    # reindex        = true     # same as '--reindex'
+    # compact        = true     # same as '--compact'
+    # rebuild_manifest = true   # same as '--rebuild-manifest'
+    # verify_manifest  = true   # same as '--verify-manifest'
+    # migrate_layout   = true   # same as '--migrate-layout'
+    # profile        = true     # same as '--profile' (or a FILE name,
+                                # same as '--profile FILE')
+    # metrics_file   = "/var/lib/node_exporter/ionical.prom"
+                                # same as '--metrics FILE'
+    # memory_report  = true     # same as '--memory-report'
+    # workers        = 4        # same as '--workers 4'
 
 [filters]
     # earliest       = 2020-11-01
     # latest         = 2021-06-30
     # summary_text   = ["search text 1", "search text two"]
 
+[archive]
+    # codec             = "gzip"  # pack file codec: "gzip" or "zstd"
+                                  # (zstd requires 'pip install ionical[zstd]')
+    # keyframe_interval = 30      # store a full copy every 30 versions, and
+                                  # deltas against the prior version otherwise
+    # write_packs       = true    # '-g' appends to pack files instead of
+                                  # writing loose .ics files
+    # timestamped_versions = true # name versions by date and time (e.g.,
+                                  # 20200527T143000), so that '-g' keeps
+                                  # every download, not just one per day
+    # layout            = "sharded"
+                                  # keep .ics files in ICS_DIR/<cal_id>/YYYY/
+                                  # (default "flat"; after changing this,
+                                  # run 'ionical --migrate-layout')
+    # manifest          = true    # list .ics files in ICS_DIR's manifest
+                                  # (ionical_manifest.jsonl), and load
+                                  # histories from it instead of by
+                                  # listing ICS_DIR
+
+[retention]  # For '--compact' (plain numbers are days; or use "13w", "2y")
+    # all               = 0       # keep every version for this long,
+    # daily             = 90      # then the last version of each day,
+    # weekly            = "2y"    # then the last of each week,
+    # monthly           = "10y"   # then the last of each month (if
+                                  # unset, monthly versions are kept
+                                  # forever)
+
+[store]
+    # enabled           = true    # record events in an SQLite store, and
+                                  # answer '-s', '-l' and '-c' from it
+    # path              = "ionical_history.sqlite"  # (relative to ICS_DIR)
+
+[cache]  # Parsed schedules kept in memory (least recently used are dropped)
+    # max_schedules     = 500     # at most this many schedules
+    # max_mb            = 256     # about this much memory (default 256)
+
+[polling]  # For '--watch' (see also poll_interval in [calendars] below)
+    # backoff_base        = "1m"   # first retry delay after a failed download,
+    # max_backoff         = "6h"   # doubling on each failure up to this limit
+    # jitter              = 0.5    # randomize up to half of each retry delay
+    # max_per_host        = 2      # concurrent downloads from any one host
+    # per_host_per_minute = 30     # downloads started per minute, per host
+
+[serve]  # For '--serve'
+    # host              = "127.0.0.1"  # address to listen on
+    # rescan_interval   = 5       # seconds between checks of ICS_DIR for
+                                  # new versions of a queried calendar
+
 [calendars]
 
+  # Each calendar may set 'poll_interval' (e.g. "15m", "1h", "7d") to
+  # override the '--watch' interval for that calendar.
+
   # Obtained from http://www.trulycertifiable.com/calendars/Xbox_360.ics on 2020-12-17
   [calendars.XBOX]
     description = "XBOX Events Calendar"
@@ -317,6 +386,192 @@ def add_args_for_category(main_parser, cat, arg_groups=None):
             const="cfg",
             help="Export calendar events to csv.\n\n",
         )
+        parser.add_argument(
+            "--jsonl",
+            metavar="JSONL_FILE",
+            dest="jsonl_file",
+            help=dedent(
+                """\
+              Export each calendar's events (from its most recent
+              ics version) and its changes (between all versions)
+              to a JSON Lines file, one record per line.\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--parquet",
+            metavar="DIR",
+            dest="parquet_dir",
+            help=dedent(
+                """\
+              Export every event of every ics version to Parquet
+              files in DIR, partitioned by calendar and version
+              month.  (The date and text filters don't apply.)
+              Requires pyarrow ('pip install ionical[parquet]').\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--watch",
+            nargs="?",
+            metavar="SECONDS",
+            dest="watch_interval",
+            const=DEF_WATCH_INTERVAL,
+            type=valid_pos_integer,
+            help=dedent(
+                f"""\
+              After any other actions, keep running: download each
+              calendar's .ics file every SECONDS seconds (or its own
+              poll_interval from the config file), and print
+              changelog entries as soon as changes are found.
+              (If left unspecified, SECONDS default is
+              {DEF_WATCH_INTERVAL}.)  Press Ctrl-C to stop.\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--serve",
+            nargs="?",
+            metavar="PORT",
+            dest="serve_port",
+            const=DEF_SERVE_PORT,
+            type=valid_pos_integer,
+            help=dedent(
+                f"""\
+              After any other actions, keep running: answer JSON
+              queries over HTTP on PORT (by default, only from this
+              machine), e.g. /schedule/<cal_id>?from=&to=&q= or
+              /changes/<cal_id>?n=, from schedules kept in memory.
+              New versions saved to ICS_DIR are picked up as they
+              arrive.  (If left unspecified, PORT default is
+              {DEF_SERVE_PORT}.)  Press Ctrl-C to stop.\n\n"""
+            ),
+        )
+    if cat == "maintenance":
+        parser.add_argument(
+            "--pack",
+            action="store_true",
+            help=dedent(
+                """\
+              Move previously downloaded .ics files into compressed
+              per-calendar pack files (<cal_id>.icspack) in ICS_DIR.
+              Packed versions are read transparently by all other
+              actions, and loose .ics files continue to work.\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--reindex",
+            action="store_true",
+            help=dedent(
+                """\
+              (Re)build the SQLite event store from the .ics files in
+              ICS_DIR.  When the store is enabled in the config file
+              ([store] enabled = true), schedules and changelogs are
+              answered from it instead of by re-parsing .ics files.\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--compact",
+            action="store_true",
+            help=dedent(
+                """\
+              Thin previously downloaded versions according to the
+              [retention] policy in the config file (by default,
+              daily versions for 90 days, then weekly for 2 years,
+              then monthly).  Changes found in the pruned versions
+              are first appended to <cal_id>.compacted_changes.txt
+              in ICS_DIR.\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--rebuild-manifest",
+            action="store_true",
+            dest="rebuild_manifest",
+            help=dedent(
+                """\
+              (Re)write the manifest of .ics files in ICS_DIR from the
+              files on disk.  When the manifest is enabled in the
+              config file ([archive] manifest = true), downloads are
+              listed in it, and histories are loaded from it instead
+              of by listing ICS_DIR.\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--verify-manifest",
+            action="store_true",
+            dest="verify_manifest",
+            help=dedent(
+                """\
+              Check the manifest of .ics files in ICS_DIR against the
+              files on disk (names, sizes and contents), and print
+              any differences.\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--migrate-layout",
+            action="store_true",
+            dest="migrate_layout",
+            help=dedent(
+                """\
+              Move the .ics files in ICS_DIR into the layout set in
+              the config file: "flat" (<cal_id>__YYYYMMDD.ics, the
+              default) or "sharded" (<cal_id>/YYYY/YYYYMMDD.ics, so
+              that each calendar's files are kept in a directory of
+              their own).\n\n"""
+            ),
+        )
+    if cat == "diagnostics":
+        parser.add_argument(
+            "--profile",
+            nargs="?",
+            metavar="FILE",
+            const=True,
+            help=dedent(
+                """\
+              After the run, print (to stderr) the time spent in each
+              stage (downloading, scanning ICS_DIR, parsing, recurrence
+              expansion, diffing, rendering and export), per calendar.
+              If FILE is given, also save cProfile stats for the
+              slowest calendar to it (view with 'python -m pstats').\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--metrics",
+            metavar="FILE",
+            dest="metrics_file",
+            help=dedent(
+                """\
+              After the run, write metrics for it to FILE: per
+              calendar download size, latency and HTTP status, parse
+              time, event and version counts and changes found, plus
+              the run's wall time.  Written as JSON, or in Prometheus
+              text format if FILE ends with '.prom'.\n\n"""
+            ),
+        )
+        parser.add_argument(
+            "--memory-report",
+            action="store_true",
+            dest="memory_report",
+            help=dedent(
+                """\
+              After the run, print (to stderr) the peak and retained
+              memory of each stage, per calendar, and the allocation
+              sites holding the most memory at its high-water mark.
+              (Memory tracing slows the run considerably.)\n\n"""
+            ),
+        )
+    if cat == "performance":
+        parser.add_argument(
+            "--workers",
+            metavar="N",
+            type=valid_pos_integer,
+            help=dedent(
+                """\
+              Run each calendar's work (downloading, maintenance,
+              changelogs, schedule display and CSV export) in a pool
+              of N worker processes.  Output is the same as for a
+              serial run.  (--profile and --metrics include stage
+              times from workers, but cProfile stats and
+              --memory-report cover only the main process.)\n\n"""
+            ),
+        )
     if cat == "calendar":
         parser.add_argument(
             "-i",
@@ -395,6 +650,18 @@ def cli():
             "Actions",
             "One or more action options MUST be specified.",
         ],
+        "maintenance": [
+            "Maintenance",
+            "Manage previously downloaded .ics files.",
+        ],
+        "diagnostics": [
+            "Diagnostics",
+            "Report on how a run went, and where it spent its time.",
+        ],
+        "performance": [
+            "Performance",
+            "Spread a run's work across processes.",
+        ],
         "calendar": [
             "Calendar Filters",
             "Restrict all actions to a subset of calendars.",
@@ -461,6 +728,34 @@ def cli():
     verbose = args.verbose if args.verbose else sub_cfg(cfg, "verbose", 0)
     verbose = MAX_VERBOSITY if verbose and verbose > 2 else verbose
     get_cals = True if args.get_today else sub_cfg(act_cfg, "get_today", False)
+    pack_cals = True if args.pack else sub_cfg(act_cfg, "pack", False)
+    reindex = True if args.reindex else sub_cfg(act_cfg, "reindex", False)
+    compact = True if args.compact else sub_cfg(act_cfg, "compact", False)
+    rebuild_manifest = (
+        True if args.rebuild_manifest else sub_cfg(act_cfg, "rebuild_manifest", False)
+    )
+    verify_manifest = (
+        True if args.verify_manifest else sub_cfg(act_cfg, "verify_manifest", False)
+    )
+    migrate_layout = (
+        True if args.migrate_layout else sub_cfg(act_cfg, "migrate_layout", False)
+    )
+    profile = args.profile if args.profile else sub_cfg(act_cfg, "profile", False)
+    memory_report = (
+        True if args.memory_report else sub_cfg(act_cfg, "memory_report", False)
+    )
+    metrics_file = (
+        args.metrics_file
+        if args.metrics_file
+        else sub_cfg(act_cfg, "metrics_file", None)
+    )
+    workers = args.workers if args.workers else sub_cfg(act_cfg, "workers", 1)
+    watch_interval = (
+        args.watch_interval
+        if args.watch_interval
+        else sub_cfg(act_cfg, "watch_interval", None)
+    )
+    serve_port = args.serve_port if args.serve_port else sub_cfg(act_cfg, "serve_port")
     show_cals = True if args.show else sub_cfg(act_cfg, "show_schedule", False)
     c_subset = args.ids if args.ids else sub_cfg(act_cfg, "restrict_to", None)
     ics_dir = args.ics_dir if args.ics_dir else sub_cfg(cfg, "ics_dir", DEF_ICS_DIR)
@@ -493,7 +788,25 @@ def cli():
         if cfg_says_export:
             csv_export_file = sub_cfg(cfg["csv"], "file")
 
-    if not any([show_cals, show_changelog, get_cals, csv_export_file]):
+    jsonl_file = args.jsonl_file if args.jsonl_file else sub_cfg(act_cfg, "jsonl_file")
+    parquet_dir = (
+        args.parquet_dir if args.parquet_dir else sub_cfg(act_cfg, "parquet_dir")
+    )
+
+    maintenance = any(
+        [pack_cals, reindex, compact, rebuild_manifest, verify_manifest, migrate_layout]
+    )
+    actions = [
+        show_cals,
+        show_changelog,
+        get_cals,
+        csv_export_file,
+        jsonl_file,
+        parquet_dir,
+        watch_interval,
+        serve_port,
+    ]
+    if not any(actions + [maintenance]):
         print(
             dedent(
                 f"""
@@ -504,8 +817,14 @@ def cli():
              Command line options for ionical actions are:
                   '-g' to download today's ics files, 
                   '-l' to show changelogs, 
-                  '-s' to show schedules from most recent ics files, and
-                  '-c' to export schedules to csv.\n
+                  '-s' to show schedules from most recent ics files,
+                  '-c' to export schedules to csv,
+                  '--jsonl' to export events and changes as JSON Lines,
+                  '--parquet' to export all versions' events as Parquet,
+                  '--watch' to keep polling for changes, and
+                  '--serve' to answer queries over HTTP.\n
+             Maintenance options (e.g., '--pack', '--compact') also
+             count as actions.\n
              For further details, run 'ionical -h' or see README.
              """
             )
@@ -558,8 +877,21 @@ def cli():
                 f"Will use all calendars listed in {CFG_FN}."
             )
         print("\nPlanned ionical actions:")
+        if migrate_layout:
+            layout = sub_cfg(sub_cfg(cfg, "archive"), "layout", "flat")
+            print(f"  Move ics files into the {layout} layout in: {abspath(ics_dir)}")
+        if rebuild_manifest:
+            print(f"  Rebuild the manifest of ics files in: {abspath(ics_dir)}")
+        if verify_manifest:
+            print(f"  Check the manifest of ics files in: {abspath(ics_dir)}")
         if get_cals:
             print(f"  Download today's ics files to: {abspath(ics_dir)}")
+        if pack_cals:
+            print(f"  Move loose ics files into pack files in: {abspath(ics_dir)}")
+        if compact:
+            print("  Thin ics versions according to the retention policy.")
+        if reindex:
+            print("  Rebuild the event store from previously downloaded ics files.")
         if show_cals:
             print(
                 "  Print schedule events from the most recent ics version "
@@ -572,6 +904,19 @@ def cli():
             )
         if csv_export_file:
             print(f"  Export events to CSV file: {abspath(csv_export_file)}")
+        if jsonl_file:
+            print(f"  Export events and changes to JSON Lines: {abspath(jsonl_file)}")
+        if parquet_dir:
+            print(f"  Export events of all versions to Parquet: {abspath(parquet_dir)}")
+        if workers > 1:
+            print(f"  Run each calendar's work in {workers} worker processes.")
+        if watch_interval:
+            print(
+                f"  Keep downloading ics files every {watch_interval} seconds, "
+                "printing changes as they are found."
+            )
+        if serve_port:
+            print(f"  Answer JSON queries over HTTP on port {serve_port}.")
         print(
             "\nEvent filters to be applied:"
             f"\n  Earliest Date: {earliest_date}"
@@ -587,9 +932,24 @@ def cli():
         cals_filter=c_subset,
         ics_dir=ics_dir,
         download_option=get_cals,
+        pack_option=pack_cals,
+        reindex_option=reindex,
+        compact_option=compact,
+        profile_option=bool(profile),
+        profile_stats_file=profile if isinstance(profile, str) else None,
+        metrics_file=metrics_file,
+        memory_report_option=memory_report,
+        workers=workers,
+        rebuild_manifest_option=rebuild_manifest,
+        verify_manifest_option=verify_manifest,
+        migrate_layout_option=migrate_layout,
+        watch_interval=watch_interval,
+        serve_port=serve_port,
         show_schedule=show_cals,
         show_changelog=show_changelog,
         csv_export_file=csv_export_file,
+        jsonl_export_file=jsonl_file,
+        parquet_dir=parquet_dir,
         num_changelogs=num_changelogs,  # type: ignore
         earliest_date=earliest_date,
         latest_date=latest_date,
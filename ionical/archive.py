@@ -0,0 +1,407 @@
+"""Compressed pack-file archives for ics version history.
+
+Each calendar's archived versions live in a pair of files in ics_dir:
+
+    <cal_id>.icspack      compressed ics blobs, appended one after another
+                          (<cal_id>.<gen>.icspack once rewritten, see below)
+    <cal_id>.icspack.idx  one line per blob: version, offset, length, codec
+                          and (for deltas) the offset of the base blob,
+                          after a "#pack" line naming the pack file (if
+                          it's not <cal_id>.icspack)
+
+A blob is either a keyframe (the full ics text) or a delta against
+the version appended just before it.  Deltas are component-level:
+each top-level ics component (and each line outside of one) is a
+chunk, and a delta lists runs of chunks to copy from its base plus
+any new or edited chunks.  A keyframe is written every keyframe_interval
+versions, which bounds the work needed to rebuild any one version.
+
+Blobs are only ever appended, and a blob is written (and flushed)
+before its index line, so an interrupted write at worst leaves an
+unreferenced blob at the end of the pack.  Compaction (see
+IcsPack.rewrite) never changes a pack in place: it writes a thinned
+copy to a new pack file, under the next generation number, plus an
+index naming it, and replacing the old index with that one is its
+only commit point.  An interrupted rewrite thus leaves either the old
+pack and index in use or the new ones (with at worst an unreferenced
+pack file left behind).
+"""
+import difflib
+import gzip
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # zstd support is optional (pip install ionical[zstd])
+    zstandard = None
+
+from ionical.cache import LRUCache
+
+PACK_SUFFIX = ".icspack"
+INDEX_SUFFIX = ".icspack.idx"
+REWRITE_SUFFIX = ".new"  # for the index written during IcsPack.rewrite
+PACK_HEADER = "#pack\t"  # starts the index line naming its pack file
+
+CODECS = ("gzip", "zstd")
+DEF_CODEC = "zstd" if zstandard is not None else "gzip"
+DEF_KEYFRAME_INTERVAL = 30
+
+# Number of rebuilt versions kept in memory.  Two suffices for walking
+# a history in order, since each delta's base is the previous version.
+RECONSTRUCTION_CACHE_SIZE = 2
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd codec requested, but zstandard not installed.")
+        return zstandard.ZstdCompressor().compress(data)
+    raise ValueError(f"Unknown pack codec: {codec}")
+
+
+def decompress(blob: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(blob)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("Pack holds zstd data, but zstandard not installed.")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown pack codec: {codec}")
+
+
+def ics_chunks(data: bytes) -> List[bytes]:
+    """Split ics text into top-level components and loose lines.
+
+    Joining the returned chunks reproduces data exactly.
+    """
+    chunks: List[bytes] = []
+    depth, component_lines = 0, []  # type: int, List[bytes]
+    for line in data.splitlines(keepends=True):
+        content = line.strip()
+        if content.startswith(b"BEGIN:"):
+            depth += 1
+        if depth >= 2:
+            component_lines.append(line)
+        else:
+            chunks.append(line)
+        if content.startswith(b"END:"):
+            if depth == 2:
+                chunks.append(b"".join(component_lines))
+                component_lines = []
+            depth = max(depth - 1, 0)
+    if component_lines:  # unterminated component
+        chunks.append(b"".join(component_lines))
+    return chunks
+
+
+# A delta is a list of ops, each being one of:
+#   [start, count]              copy count chunks from the base,
+#                               beginning at chunk index start
+#   "text"                      new text (undecodable bytes are kept
+#                               via surrogateescape)
+#   {"edit": i, "ops": [...]}   base chunk i, edited by line-level ops
+#                               (in the same format, over its lines)
+# Components that changed only slightly (e.g., just their DTSTAMP) are
+# matched to their base component by UID and stored as line edits.
+DeltaOp = Union[List[int], str, Dict]
+
+uid_pattern = re.compile(rb"^UID:(.*?)\s*$", re.MULTILINE)
+
+
+def _append_text(ops: List[DeltaOp], text: bytes) -> None:
+    decoded = text.decode("utf-8", "surrogateescape")
+    if ops and isinstance(ops[-1], str):
+        ops[-1] += decoded
+    else:
+        ops.append(decoded)
+
+
+def _line_delta(base: bytes, data: bytes) -> List[DeltaOp]:
+    base_lines = base.splitlines(keepends=True)
+    new_lines = data.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, base_lines, new_lines, autojunk=False)
+    ops: List[DeltaOp] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2 - i1])
+        elif j2 > j1:
+            _append_text(ops, b"".join(new_lines[j1:j2]))
+    return ops
+
+
+def make_delta(base: bytes, data: bytes) -> List[DeltaOp]:
+    base_chunks = ics_chunks(base)
+    first_index: Dict[bytes, int] = {}
+    index_by_uid: Dict[bytes, int] = {}
+    for i, chunk in enumerate(base_chunks):
+        first_index.setdefault(chunk, i)
+        m = uid_pattern.search(chunk)
+        if m:
+            index_by_uid.setdefault(m.group(1), i)
+    ops: List[DeltaOp] = []
+    new_chunks = ics_chunks(data)
+    i = 0
+    while i < len(new_chunks):
+        chunk = new_chunks[i]
+        start = first_index.get(chunk)
+        if start is None:
+            m = uid_pattern.search(chunk)
+            if m and m.group(1) in index_by_uid:
+                edited = index_by_uid[m.group(1)]
+                line_ops = _line_delta(base_chunks[edited], chunk)
+                ops.append({"edit": edited, "ops": line_ops})
+            else:
+                _append_text(ops, chunk)
+            i += 1
+            continue
+        count = 1
+        while (
+            i + count < len(new_chunks)
+            and start + count < len(base_chunks)
+            and new_chunks[i + count] == base_chunks[start + count]
+        ):
+            count += 1
+        ops.append([start, count])
+        i += count
+    return ops
+
+
+def _apply_ops(base_parts: List[bytes], ops: List[DeltaOp]) -> bytes:
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op.encode("utf-8", "surrogateescape"))
+        elif isinstance(op, dict):
+            edited = base_parts[op["edit"]]
+            parts.append(_apply_ops(edited.splitlines(keepends=True), op["ops"]))
+        else:
+            start, count = op
+            parts.extend(base_parts[start : start + count])
+    return b"".join(parts)
+
+
+def apply_delta(base: bytes, ops: List[DeltaOp]) -> bytes:
+    return _apply_ops(ics_chunks(base), ops)
+
+
+class PackedVersion(NamedTuple):
+    """Location of one archived version within a pack file."""
+
+    pack_path: Path
+    version: str  # version stamp, e.g. "20200527"
+    offset: int
+    length: int
+    codec: str
+    base: Optional["PackedVersion"] = None  # None for keyframes
+
+    @property
+    def chain_length(self) -> int:
+        """Number of deltas that must be applied to rebuild this version."""
+        length, entry = 0, self
+        while entry.base is not None:
+            length, entry = length + 1, entry.base
+        return length
+
+    def read(self) -> bytes:
+        """Rebuild this version, from the newest cached version it's based on."""
+        # Keyed by the pack file itself (not just its path), so a pack
+        # replaced by another process is never read from the cache
+        stat = os.stat(self.pack_path)
+        key = (stat.st_dev, stat.st_ino)
+        chain: List[PackedVersion] = []
+        entry: Optional[PackedVersion] = self
+        data = None
+        while entry is not None:
+            data = _reconstructed.get(key + (entry.offset,))
+            if data is not None:
+                break
+            chain.append(entry)
+            entry = entry.base
+        with open(self.pack_path, "rb") as f:
+            for entry in reversed(chain):
+                f.seek(entry.offset)
+                blob = decompress(f.read(entry.length), entry.codec)
+                if entry.base is None:
+                    data = blob
+                else:
+                    data = apply_delta(data, json.loads(blob.decode("utf-8")))
+                _reconstructed.put(key + (entry.offset,), data)
+        return data
+
+
+_reconstructed = LRUCache(max_entries=RECONSTRUCTION_CACHE_SIZE, max_bytes=None)
+
+
+def clear_reconstruction_cache() -> None:
+    """Forget rebuilt versions (needed once a pack file is deleted)."""
+    _reconstructed.clear()
+
+
+def _inode_and_size(stat: os.stat_result) -> Tuple[int, int]:
+    return stat.st_ino, stat.st_size
+
+
+class IcsPack:
+    """Append-only archive of a single calendar's ics versions."""
+
+    def __init__(self, ics_dir, cal_id: str):
+        self.cal_id = cal_id
+        self.index_path = Path(ics_dir) / f"{cal_id}{INDEX_SUFFIX}"
+        # Last entry in the index, and the index's (inode, size) when it
+        # was last, so append() needn't re-read the index to find its base
+        self._last: Optional[Tuple[PackedVersion, Tuple[int, int]]] = None
+
+    def exists(self) -> bool:
+        return self.index_path.exists()
+
+    def pack_name(self, generation: int = 0) -> str:
+        """Return the name of the pack file for a generation."""
+        if generation == 0:
+            return f"{self.cal_id}{PACK_SUFFIX}"
+        return f"{self.cal_id}.{generation}{PACK_SUFFIX}"
+
+    @property
+    def path(self) -> Path:
+        """Path of the pack file, as named by the index."""
+        if self.index_path.exists():
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                first_line = f.readline()
+            if first_line.startswith(PACK_HEADER):
+                return self.index_path.with_name(first_line[len(PACK_HEADER) :].strip())
+        return self.index_path.with_name(self.pack_name())
+
+    @property
+    def generation(self) -> int:
+        """Number of times the pack has been rewritten."""
+        name = self.path.name
+        if name == self.pack_name():
+            return 0
+        return int(name[len(self.cal_id) + 1 : -len(PACK_SUFFIX)])
+
+    def entries(self) -> List[PackedVersion]:
+        """Return index entries, in the order they were appended."""
+        if not self.index_path.exists():
+            return []
+        pack_path = self.path
+        entries: List[PackedVersion] = []
+        by_offset: Dict[int, PackedVersion] = {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index_stat = _inode_and_size(os.fstat(f.fileno()))
+            for line in f:
+                if line.startswith(PACK_HEADER):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 4:  # written before deltas were supported
+                    fields.append("")
+                if len(fields) != 5:  # e.g., a partially written last line
+                    continue
+                version, offset, length, codec, base_offset = fields
+                entry = PackedVersion(
+                    pack_path=pack_path,
+                    version=version,
+                    offset=int(offset),
+                    length=int(length),
+                    codec=codec,
+                    base=by_offset[int(base_offset)] if base_offset else None,
+                )
+                by_offset[entry.offset] = entry
+                entries.append(entry)
+        self._last = (entries[-1], index_stat) if entries else None
+        return entries
+
+    def last_entry(self) -> Optional[PackedVersion]:
+        """Return the last index entry, re-reading the index only if needed."""
+        if not self.index_path.exists():
+            return None
+        index_stat = _inode_and_size(self.index_path.stat())
+        if self._last is not None and self._last[1] == index_stat:
+            return self._last[0]
+        entries = self.entries()
+        return entries[-1] if entries else None
+
+    def entries_by_version(self) -> Dict[str, PackedVersion]:
+        """Return the newest index entry for each version stamp."""
+        return {e.version: e for e in self.entries()}
+
+    def append(
+        self,
+        version: str,
+        data: bytes,
+        codec: Optional[str] = None,
+        keyframe_interval: Optional[int] = None,
+    ) -> PackedVersion:
+        """Compress data and append it to the pack as the given version.
+
+        If keyframe_interval is given (and greater than 1), the data
+        is stored as a delta against the last version in the pack,
+        unless that would make a chain of keyframe_interval or more.
+        """
+        codec = DEF_CODEC if codec is None else codec
+        base = self.last_entry() if keyframe_interval else None
+        if base is not None and base.chain_length + 1 < keyframe_interval:
+            delta = make_delta(base.read(), data)
+            blob = compress(json.dumps(delta).encode("utf-8"), codec)
+        else:
+            base, blob = None, compress(data, codec)
+        pack_path = self.path
+        with open(pack_path, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        base_offset = "" if base is None else str(base.offset)
+        with open(self.index_path, "a", encoding="utf-8", newline="\n") as f:
+            f.write(f"{version}\t{offset}\t{len(blob)}\t{codec}\t{base_offset}\n")
+            f.flush()
+            index_stat = _inode_and_size(os.fstat(f.fileno()))
+        entry = PackedVersion(pack_path, version, offset, len(blob), codec, base)
+        self._last = entry, index_stat
+        return entry
+
+    def rewrite(
+        self,
+        versions: Iterable[Tuple[str, bytes]],
+        codec: Optional[str] = None,
+        keyframe_interval: Optional[int] = None,
+    ) -> List[PackedVersion]:
+        """Replace the pack's contents with just the given versions.
+
+        The versions are written (and flushed) to a new pack file, for
+        the next generation, with a new index naming it.  Replacing the
+        current index with the new one then commits the rewrite, after
+        which the old pack file is deleted.
+        """
+        old_path = self.path
+        staged = IcsPack(old_path.parent, self.cal_id)
+        staged.index_path = self.index_path.with_name(
+            self.index_path.name + REWRITE_SUFFIX
+        )
+        new_path = old_path.with_name(self.pack_name(self.generation + 1))
+        for path in (new_path, staged.index_path):
+            if path.exists():  # left over from an interrupted rewrite
+                path.unlink()
+        with open(staged.index_path, "w", encoding="utf-8", newline="\n") as f:
+            f.write(f"{PACK_HEADER}{new_path.name}\n")
+        num_kept = 0
+        for version, data in versions:
+            staged.append(version, data, codec, keyframe_interval)
+            num_kept += 1
+        if num_kept == 0:
+            staged.index_path.unlink()
+            if self.index_path.exists():
+                self.index_path.unlink()
+        else:
+            with open(staged.index_path, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(staged.index_path, self.index_path)
+        if old_path.exists():
+            old_path.unlink()
+        clear_reconstruction_cache()
+        return self.entries()
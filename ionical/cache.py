@@ -0,0 +1,117 @@
+"""Process-wide LRU cache of parsed schedules.
+
+Parsing a version's .ics data is by far the costliest step of most
+runs.  Parsed Schedule objects are therefore kept in a single cache
+for the whole process, shared by every Cal and ScheduleHistory, so
+that a long-lived process (e.g., one embedding ionical, or watching
+feeds) reuses them without holding every version forever.
+
+The cache is bounded by a number of entries and/or an estimated
+memory budget, set in the config file:
+
+    [cache]
+        max_schedules = 500
+        max_mb        = 256
+
+When either is exceeded, the least recently used entries are evicted.
+Hits, misses and evictions are counted (see '--profile' and
+'--metrics').
+"""
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+MIB = 1024 * 1024
+DEF_MAX_ENTRIES = None  # (no limit)
+DEF_MAX_MB = 256
+
+
+class LRUCache:
+    """Values by key, evicting the least recently used beyond a budget."""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = DEF_MAX_ENTRIES,
+        max_bytes: Optional[int] = DEF_MAX_MB * MIB,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self.total_bytes = 0
+        self._lock = threading.RLock()
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def counters(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def configure(
+        self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        """Set new budgets (None for no limit), evicting entries beyond them."""
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for key (or None), counting a hit or miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._remove(key)
+            size = self.sizeof(value)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+            self._evict(keep=key)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        if key in self._entries:
+            del self._entries[key]
+            self.total_bytes -= self._sizes.pop(key)
+
+    def _over_budget(self) -> bool:
+        return (self.max_entries is not None and len(self) > self.max_entries) or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes
+        )
+
+    def _evict(self, keep: Optional[Hashable] = None) -> None:
+        # The entry just added (keep) stays, even if it alone is over budget
+        while self._over_budget():
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._remove(key)
+            self.evictions += 1
@@ -0,0 +1,131 @@
+"""Columnar export of schedule history to Parquet (see '--parquet').
+
+Every event of every version of a calendar becomes one row, in a
+dataset partitioned (Hive-style) by calendar and version month:
+
+    <parquet_dir>/cal_id=<cal_id>/version_month=<YYYY-MM>/part-0.parquet
+
+so that analytics tools (e.g., pyarrow.dataset, DuckDB or Spark) can
+read just the calendars and months they need.  Besides the partition
+columns, each row holds:
+
+    version     version stamp, e.g. 20200527 or 20200527T143000
+    start       start of the event, as a UTC timestamp (all-day and
+                floating events start in the calendar's timezone)
+    start_date  date of the event, as given in the ics data
+    all_day     true for events with a date but no time
+    summary
+
+Rows are gathered into Arrow record batches of batch_size rows, each
+written as a row group, so memory use stays flat however long the
+history is.  A calendar's partitions are written to a temporary
+directory, which then replaces any earlier export of that calendar.
+
+Requires pyarrow (pip install ionical[parquet]).
+"""
+
+import shutil
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+try:
+    import pyarrow  # type: ignore
+    import pyarrow.parquet  # type: ignore
+except ImportError:  # Parquet export is optional (pip install ionical[parquet])
+    pyarrow = None
+
+DEF_BATCH_SIZE = 65536  # rows per record batch (and row group)
+PART_FILENAME = "part-0.parquet"
+COLUMNS = ("version", "start", "start_date", "all_day", "summary")
+
+
+def history_schema() -> "pyarrow.Schema":
+    return pyarrow.schema(
+        [
+            ("version", pyarrow.string()),
+            ("start", pyarrow.timestamp("us", tz="UTC")),
+            ("start_date", pyarrow.date32()),
+            ("all_day", pyarrow.bool_()),
+            ("summary", pyarrow.string()),
+        ]
+    )
+
+
+def partition_dir_name(column: str, value: str) -> str:
+    return f"{column}={quote(value, safe='')}"
+
+
+class HistoryParquetWriter:
+    """Write the rows of one calendar's history, version month by month.
+
+    Use as a context manager; rows must be added in version order.
+    """
+
+    def __init__(self, parquet_dir, cal_id: str, batch_size: int = DEF_BATCH_SIZE):
+        if pyarrow is None:
+            raise ValueError("Parquet export requested, but pyarrow not installed.")
+        root = Path(parquet_dir)
+        self.cal_dir = root / partition_dir_name("cal_id", cal_id)
+        self.tmp_dir = root / f".{self.cal_dir.name}.tmp"
+        self.batch_size = batch_size
+        self.schema = history_schema()
+        self.num_rows = 0
+        self._month: Optional[str] = None
+        self._writer: Optional["pyarrow.parquet.ParquetWriter"] = None
+        self._columns: Dict[str, List] = {c: [] for c in COLUMNS}
+
+    def __enter__(self) -> "HistoryParquetWriter":
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.tmp_dir.mkdir(parents=True)
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self._close_month()
+        if exc_type is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            return
+        shutil.rmtree(self.cal_dir, ignore_errors=True)
+        self.tmp_dir.rename(self.cal_dir)
+
+    def add(
+        self,
+        version: str,
+        version_month: str,
+        start: datetime,
+        start_date: date,
+        all_day: bool,
+        summary: str,
+    ) -> None:
+        if version_month != self._month:
+            self._close_month()
+            self._month = version_month
+        row = (version, start, start_date, all_day, summary)
+        for column, value in zip(COLUMNS, row):
+            self._columns[column].append(value)
+        if len(self._columns["version"]) >= self.batch_size:
+            self._write_batch()
+
+    def _write_batch(self) -> None:
+        num_rows = len(self._columns["version"])
+        if not num_rows:
+            return
+        if self._writer is None:
+            month_dir = self.tmp_dir / partition_dir_name(
+                "version_month", self._month  # type: ignore
+            )
+            month_dir.mkdir()
+            self._writer = pyarrow.parquet.ParquetWriter(
+                str(month_dir / PART_FILENAME), self.schema
+            )
+        batch = pyarrow.RecordBatch.from_pydict(self._columns, schema=self.schema)
+        self._writer.write_batch(batch)
+        self.num_rows += num_rows
+        self._columns = {c: [] for c in COLUMNS}
+
+    def _close_month(self) -> None:
+        self._write_batch()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
@@ -0,0 +1,364 @@
+"""Optional timing instrumentation for ionical's pipeline stages.
+
+Code wraps each stage of work in a span, e.g.:
+
+    with span("parse", cal.cal_id):
+        ...
+
+or, where all of a function's work is one stage, decorates it:
+
+    @spanned("diff", "self.cal")
+    def get_changes_for_date(self, version_date):
+        ...
+
+Spans cost next to nothing unless instrumentation has been enabled
+(as by '--profile').  When enabled, the wall time of every span is
+totalled per stage and per calendar.  Stages may nest (e.g., "parse"
+includes the "expand_recurrences" within it), so the times reported
+for a stage are inclusive.
+
+If cProfile output is requested, each calendar's work is also
+profiled separately (in the main thread), so that the profile of
+the slowest calendar can be saved.
+
+Code may also record values (e.g., bytes downloaded) per calendar,
+via record() and count(); see ionical.metrics for their export.
+
+Span totals and values from worker processes (see '--workers') are
+added in with merge(); profiles and memory traces are not.
+
+If memory tracing is enabled (as by '--memory-report'), tracemalloc
+also measures each span (in the main thread): its peak memory use
+above what was in use when it began, and the memory still held when
+it ended.  A snapshot is taken whenever traced memory reaches a new
+high-water mark at the end of a span, to show the allocation sites
+that account for it.
+"""
+import functools
+import threading
+from collections import defaultdict
+from operator import attrgetter
+from time import perf_counter
+from typing import DefaultDict, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from ionical.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+else:  # only needed with '--profile FILE' or '--memory-report'
+    cProfile = lazy_import("cProfile")
+    tracemalloc = lazy_import("tracemalloc")
+
+ALL_CALS = "*"  # cal_id recorded for spans (e.g., reports) covering many cals
+
+StageKey = Tuple[str, str]  # (stage, cal_id)
+
+# New high-water snapshots are only taken once traced memory has grown
+# by this fraction, so that a slow climb doesn't snapshot every span
+SNAPSHOT_GROWTH = 0.1
+DEF_TOP_ALLOCATION_SITES = 10
+MIB = 1024 * 1024
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, instrumentation: "Instrumentation", stage: str, cal_id: str):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.cal_id = cal_id
+
+    def __enter__(self):
+        self.instrumentation._enter(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        self.instrumentation._exit(self, elapsed)
+        return False
+
+
+class Instrumentation:
+    """Totals of span times, by stage and calendar."""
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_cals = False
+        self.trace_memory = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        self.totals: DefaultDict[StageKey, float] = defaultdict(float)
+        self.calls: DefaultDict[StageKey, int] = defaultdict(int)
+        # Time in each calendar's outermost spans (i.e., without double
+        # counting nested stages), used to find the slowest calendar
+        self.cal_totals: DefaultDict[str, float] = defaultdict(float)
+        self.profilers: Dict[str, cProfile.Profile] = {}
+        self._profiling: Optional[str] = None
+        self.values: Dict[Tuple[str, str], float] = {}  # {(name, cal_id): value}
+        self.memory_peaks: DefaultDict[StageKey, int] = defaultdict(int)
+        self.memory_retained: DefaultDict[StageKey, int] = defaultdict(int)
+        self.high_water = 0
+        self.high_water_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._memory_spans: List[_Span] = []
+
+    def enable(self, profile_cals: bool = False, trace_memory: bool = False) -> None:
+        self.reset()
+        self.enabled = True
+        self.profile_cals = profile_cals
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self._profiling is not None:
+            self.profilers[self._profiling].disable()
+            self._profiling = None
+        if self.trace_memory:
+            self.trace_memory = False
+            tracemalloc.stop()
+
+    def span(self, stage: str, cal_id=None):
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, stage, ALL_CALS if cal_id is None else str(cal_id))
+
+    def record(self, name: str, value: float, cal_id=None) -> None:
+        """Set a value (e.g., a calendar's HTTP status) if enabled."""
+        if self.enabled:
+            with self._lock:
+                self.values[(name, ALL_CALS if cal_id is None else str(cal_id))] = value
+
+    def count(self, name: str, n: float = 1, cal_id=None) -> None:
+        """Add to a value (e.g., changes found for a calendar) if enabled."""
+        if self.enabled:
+            key = (name, ALL_CALS if cal_id is None else str(cal_id))
+            with self._lock:
+                self.values[key] = self.values.get(key, 0) + n
+
+    def copy_values(self, names, from_cal_id, to_cal_id) -> None:
+        """Give to_cal_id the values (of names) recorded for from_cal_id."""
+        if self.enabled:
+            with self._lock:
+                for name in names:
+                    key = (name, str(from_cal_id))
+                    if key in self.values:
+                        self.values[(name, str(to_cal_id))] = self.values[key]
+
+    def state(self) -> Dict:
+        """Return span totals and values, e.g. for merge() in another process."""
+        return {
+            "totals": dict(self.totals),
+            "calls": dict(self.calls),
+            "cal_totals": dict(self.cal_totals),
+            "values": dict(self.values),
+        }
+
+    def merge(self, state: Dict) -> None:
+        """Add in span totals and values from state() (if enabled)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            for key, seconds in state["totals"].items():
+                self.totals[key] += seconds
+            for key, n in state["calls"].items():
+                self.calls[key] += n
+            for cal_id, seconds in state["cal_totals"].items():
+                self.cal_totals[cal_id] += seconds
+            self.values.update(state["values"])
+
+    def _open_cal_ids(self) -> List[str]:
+        if not hasattr(self._local, "cal_ids"):
+            self._local.cal_ids = []
+        return self._local.cal_ids
+
+    def _enter(self, span: _Span) -> None:
+        open_cal_ids = self._open_cal_ids()
+        span.outermost = span.cal_id not in open_cal_ids
+        open_cal_ids.append(span.cal_id)
+        span.profiled = (
+            self.profile_cals
+            and span.outermost
+            and span.cal_id != ALL_CALS
+            and self._profiling is None
+            and threading.current_thread() is threading.main_thread()
+        )
+        if span.profiled:
+            self._profiling = span.cal_id
+            self.profilers.setdefault(span.cal_id, cProfile.Profile()).enable()
+        span.memory_start = None
+        if self.trace_memory and threading.current_thread() is threading.main_thread():
+            self._enter_memory(span)
+
+    def _enter_memory(self, span: _Span) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        if self._memory_spans:  # (before its peak is reset for this span)
+            parent = self._memory_spans[-1]
+            parent.memory_peak = max(parent.memory_peak, peak)
+        tracemalloc.reset_peak()
+        span.memory_start = span.memory_peak = current
+        self._memory_spans.append(span)
+
+    def _exit_memory(self, span: _Span) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        self._memory_spans.pop()
+        span_peak = max(span.memory_peak, peak)
+        if self._memory_spans:
+            parent = self._memory_spans[-1]
+            parent.memory_peak = max(parent.memory_peak, span_peak)
+        key = (span.stage, span.cal_id)
+        self.memory_peaks[key] = max(
+            self.memory_peaks[key], span_peak - span.memory_start
+        )
+        self.memory_retained[key] += current - span.memory_start
+        if current > self.high_water * (1 + SNAPSHOT_GROWTH):
+            self.high_water = current
+            self.high_water_snapshot = tracemalloc.take_snapshot()
+
+    def _exit(self, span: _Span, elapsed: float) -> None:
+        if span.profiled:
+            self.profilers[span.cal_id].disable()
+            self._profiling = None
+        if span.memory_start is not None and self.trace_memory:
+            self._exit_memory(span)
+        self._open_cal_ids().pop()
+        key = (span.stage, span.cal_id)
+        with self._lock:
+            self.totals[key] += elapsed
+            self.calls[key] += 1
+            if span.outermost and span.cal_id != ALL_CALS:
+                self.cal_totals[span.cal_id] += elapsed
+
+    def slowest_cal(self) -> Optional[str]:
+        return max(self.cal_totals, key=self.cal_totals.get, default=None)
+
+    def dump_slowest_profile(self, stats_file) -> Optional[str]:
+        """Save cProfile stats for the slowest calendar; return its cal_id."""
+        cal_id = self.slowest_cal()
+        if cal_id is None or cal_id not in self.profilers:
+            return None
+        self.profilers[cal_id].dump_stats(str(stats_file))
+        return cal_id
+
+    def report(self) -> str:
+        """Tabulate span times, by stage, then by calendar within each stage."""
+        stages: List[str] = []
+        for stage, _ in self.totals:
+            if stage not in stages:
+                stages.append(stage)
+        lines = [
+            "\nTime by stage (seconds; a stage includes any nested within it):",
+            f"  {'stage':<20} {'calendar':<20} {'calls':>7} {'total':>10}",
+        ]
+        for stage in stages:
+            keys = [k for k in self.totals if k[0] == stage]
+            keys.sort(key=lambda k: -self.totals[k])
+            stage_total = sum(self.totals[k] for k in keys)
+            stage_calls = sum(self.calls[k] for k in keys)
+            lines.append(
+                f"  {stage:<20} {'(all)':<20} {stage_calls:>7} {stage_total:>10.4f}"
+            )
+            if len(keys) > 1 or keys[0][1] != ALL_CALS:
+                for key in keys:
+                    lines.append(
+                        f"  {'':<20} {key[1]:<20} {self.calls[key]:>7}"
+                        f" {self.totals[key]:>10.4f}"
+                    )
+        slowest = self.slowest_cal()
+        if slowest is not None:
+            lines.append(
+                f"\nSlowest calendar: {slowest} "
+                f"({self.cal_totals[slowest]:.4f}s in its own stages)"
+            )
+        return "\n".join(lines) + "\n"
+
+    def memory_report(self, top: int = DEF_TOP_ALLOCATION_SITES) -> str:
+        """Tabulate peak and retained memory by stage and calendar."""
+        lines = [
+            "\nMemory by stage (MiB; peak is above the memory in use when the",
+            "stage began, and retained is what was still in use when it ended):",
+            f"  {'stage':<20} {'calendar':<20} {'peak':>10} {'retained':>10}",
+        ]
+        stages: List[str] = []
+        for stage, _ in self.memory_peaks:
+            if stage not in stages:
+                stages.append(stage)
+        for stage in stages:
+            keys = [k for k in self.memory_peaks if k[0] == stage]
+            keys.sort(key=lambda k: -self.memory_peaks[k])
+            lines.append(
+                f"  {stage:<20} {'(all)':<20}"
+                f" {max(self.memory_peaks[k] for k in keys) / MIB:>10.2f}"
+                f" {sum(self.memory_retained[k] for k in keys) / MIB:>10.2f}"
+            )
+            if len(keys) > 1 or keys[0][1] != ALL_CALS:
+                for key in keys:
+                    lines.append(
+                        f"  {'':<20} {key[1]:<20}"
+                        f" {self.memory_peaks[key] / MIB:>10.2f}"
+                        f" {self.memory_retained[key] / MIB:>10.2f}"
+                    )
+        if self.high_water_snapshot is not None:
+            lines.append(
+                "\nTop allocation sites when the most memory was in use at "
+                f"the end of a stage ({self.high_water / MIB:.2f} MiB traced):"
+            )
+            stats = self.high_water_snapshot.filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            ).statistics("lineno")
+            for stat in stats[:top]:
+                frame = stat.traceback[0]
+                lines.append(
+                    f"  {stat.size / MIB:>8.2f} MiB {stat.count:>9} blocks"
+                    f"  {frame.filename}:{frame.lineno}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+instrumentation = Instrumentation()
+
+
+def span(stage: str, cal_id=None):
+    """Time a stage of work (for a calendar) if instrumentation is enabled."""
+    return instrumentation.span(stage, cal_id)
+
+
+def spanned(stage: str, cal_arg: Optional[str] = None):
+    """Decorate a function whose work is all one stage, to run it in a span.
+
+    cal_arg names the argument holding the Cal the work is for (e.g.,
+    "cal"), or a path to it from an argument (e.g., "self.cal").
+    """
+
+    def decorate(func):
+        name, _, path = (cal_arg or "").partition(".")
+        position = func.__code__.co_varnames.index(name) if cal_arg else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return func(*args, **kwargs)
+            cal_id = None
+            if cal_arg is not None:
+                cal = kwargs[name] if name in kwargs else args[position]
+                cal_id = (attrgetter(path)(cal) if path else cal).cal_id
+            with instrumentation.span(stage, cal_id):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
@@ -1,24 +1,74 @@
 """Multipurpose ics util - changelogs, CSVs, schedule viewing."""
+from __future__ import annotations
+
 import csv
+import gzip
+import hashlib
+import itertools
+import json
+import mmap
+import os
 import re
+import shutil
 import sys
-import urllib.request
+import urllib.error
 from collections import OrderedDict, defaultdict
 from datetime import date, datetime, time, timedelta  # , tzinfo
 from pathlib import Path
-from typing import DefaultDict, Dict, List, NamedTuple, Optional
-from typing import Set, Tuple
+from typing import DefaultDict, Dict, Iterable, Iterator, List, NamedTuple
+from typing import Optional, Set, Tuple, Union, TYPE_CHECKING
 from textwrap import dedent
+from time import monotonic, sleep
+
+from ionical.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import concurrent.futures as concurrent_futures
+
+    import urllib.request as urllib_request
 
-import icalendar  # type: ignore
+    import icalendar  # type: ignore
 
-import pytz
+    import pytz
 
-import recurring_ical_events  # type: ignore
+    import recurring_ical_events  # type: ignore
+
+    from ionical import columnar, server
+else:  # loaded on first use, so that CLI startup stays fast
+    concurrent_futures = lazy_import("concurrent.futures")  # (for '--workers')
+    urllib_request = lazy_import("urllib.request")
+    icalendar = lazy_import("icalendar")
+    pytz = lazy_import("pytz")
+    recurring_ical_events = lazy_import("recurring_ical_events")
+    columnar = lazy_import("ionical.columnar")  # (which imports pyarrow)
+    server = lazy_import("ionical.server")
+
+from ionical.archive import DEF_KEYFRAME_INTERVAL, IcsPack, PackedVersion
+from ionical.cache import DEF_MAX_MB, MIB, LRUCache
+from ionical.instrument import instrumentation, span, spanned
+from ionical.manifest import FoundFile, Manifest, ManifestEntry, file_sha1
+from ionical.metrics import write_metrics
+from ionical.retention import RetentionPolicy
+from ionical.scheduler import PollScheduler, parse_duration
+from ionical.store import DEF_STORE_FN, EventRecord, EventStore
 
 
 DEF_ICS_DIR = "./"
 
+# How versions appear in .ics file and pack names: a date for daily
+# versions, or a date and time for sub-daily (timestamped) versions
+VERSION_STAMP_FMT = "%Y%m%d"
+TIMESTAMPED_VERSION_STAMP_FMT = "%Y%m%dT%H%M%S"
+
+COMPACTED_CHANGELOG_SUFFIX = ".compacted_changes.txt"  # ics_dir/<cal_id>...
+
+# Layouts of loose .ics files within ics_dir:
+#   flat     ics_dir/<cal_id>__<version stamp>.ics
+#   sharded  ics_dir/<cal_id>/<YYYY>/<version stamp>.ics
+FLAT_LAYOUT = "flat"
+SHARDED_LAYOUT = "sharded"
+LAYOUTS = (FLAT_LAYOUT, SHARDED_LAYOUT)
+
 DEF_TIME_FMT = "%H:%M:%S"
 DEF_DATE_FMT = "%Y-%m-%d"
 DEF_TIME_GROUP_FMT = ""
@@ -31,6 +81,18 @@ DEF_CHANGE_REPORT_FMT = (
     " {label:8} {name:17} {start_str} {summary}  [comp {compare_date}]\n"
 )
 
+# Properties marking a VEVENT as part of a recurring series
+RECURRENCE_PROPERTIES = ("RRULE", "RDATE", "RECURRENCE-ID")
+
+# Values recorded (per calendar) for each download of a feed
+DOWNLOAD_VALUES = ("http_status", "download_seconds", "download_bytes")
+
+# Estimated memory of a parsed Schedule (see Schedule.estimated_size):
+# each event's object, attribute dict and set slot take about EVENT_BYTES,
+# besides its summary and start
+SCHEDULE_BYTES = 512
+EVENT_BYTES = 150
+
 DEF_START_TIME_CAT_DICT = {
     "shift": {
         "All-Day": False,
@@ -40,6 +102,39 @@ DEF_START_TIME_CAT_DICT = {
 }
 
 
+# Where a version of a Cal's .ics file is stored:
+#   a loose file (Path), or an entry in the Cal's pack file
+IcsSource = Union[Path, PackedVersion]
+
+
+# Schedule versions are identified by a date (one version per day) or,
+# for sub-daily versions, a datetime.  Since datetime is a subclass of
+# date, "date" annotations below cover both.
+
+
+def version_stamp(version_date: date) -> str:
+    """Format a version date as it appears in .ics file and pack names."""
+    if isinstance(version_date, datetime):
+        return version_date.strftime(TIMESTAMPED_VERSION_STAMP_FMT)
+    return version_date.strftime(VERSION_STAMP_FMT)
+
+
+def version_from_stamp(stamp: str) -> date:
+    if "T" in stamp:
+        return datetime.strptime(stamp, TIMESTAMPED_VERSION_STAMP_FMT)
+    return datetime.strptime(stamp, VERSION_STAMP_FMT).date()
+
+
+def version_sort_key(version_date: date) -> datetime:
+    """Key for ordering a mix of daily and timestamped versions.
+
+    (A daily version sorts as though taken at midnight.)
+    """
+    if isinstance(version_date, datetime):
+        return version_date
+    return datetime.combine(version_date, datetime.min.time())
+
+
 class Cal:
     """Cal (or entity) with a schedule specified via .ics format."""
 
@@ -50,11 +145,17 @@ class Cal:
         feed_url: Optional[str] = None,
         ics_dir: Optional[str] = DEF_ICS_DIR,
         timezone=None,
+        event_store: Optional[EventStore] = None,
+        manifest: Optional[Manifest] = None,
+        layout: str = FLAT_LAYOUT,
     ):
         self.cal_id = cal_id
         self.name = name
         self.ics_dir = ics_dir
         self.timezone = timezone
+        self.event_store = event_store
+        self.manifest = manifest
+        self.layout = layout  # (one of LAYOUTS)
         if feed_url is not None:
             self.schedule_feed: Optional[ScheduleFeed] = ScheduleFeed(
                 cal=self, url=feed_url
@@ -62,15 +163,162 @@ class Cal:
         else:
             self.schedule_feed = None
         self._schedule_history = None
-
-    def download_latest_schedule_version(self):
+        # Feed URL shared with other Cals, whose parsed versions are kept
+        # in schedule_cache by digest of the .ics data (see share_feeds)
+        self.shared_feed: Optional[str] = None
+        # Occurrences of recurring series, reused across versions (None
+        # to expand every version afresh)
+        self.recurrence_cache: Optional[RecurrenceCache] = {}
+
+    def download_latest_schedule_version(self, archive_cfg=None):
         assert self.ics_dir is not None, f"No ics_dir specified for {self}."
         assert self.schedule_feed is not None, f"No schedule_feed for {self}."
-        self.schedule_feed.download_latest_schedule_version(ics_dir=self.ics_dir)
-        # TODO: for performance, probably no need to get a whole new
-        #       ScheduleHistory (Can instead just add the newly downloaded
-        #       schedule to existing schedule history, if available)
-        self._schedule_history = None  # clear cache to force new load
+        with span("download", self.cal_id):
+            feed = self.schedule_feed
+            saved = feed.download_latest_schedule_version(
+                ics_dir=self.ics_dir, archive_cfg=archive_cfg
+            )
+        if saved is None:  # (not modified since the last download)
+            return None
+        version_date = self.record_downloaded_version(*saved)
+        if self.manifest is not None:
+            self.manifest.save()
+        return version_date
+
+    def record_downloaded_version(self, version_date: date, source: IcsSource) -> date:
+        """Add a version just saved by this Cal's ScheduleFeed to its history.
+
+        If the Cal has a manifest, a new loose file is listed in it (but
+        the manifest is left for the caller to save).
+        """
+        if self.manifest is not None and isinstance(source, Path):
+            self.manifest.add_file(
+                self.cal_id, version_stamp(version_date), self.relative_path(source)
+            )
+        if self._schedule_history is not None:
+            self._schedule_history.add_version(version_date, source)
+        if self.event_store is not None:  # (re)record the new version
+            self.schedule_history.ingest(version_date)
+        return version_date
+
+    def relative_path(self, path: Path) -> str:
+        """Path of a file in ics_dir, relative to ics_dir."""
+        return os.path.relpath(path, self.ics_dir)
+
+    def remove_loose_file(self, path: Path) -> None:
+        """Delete a loose .ics file (and unlist it from the manifest)."""
+        path.unlink()
+        if self.manifest is not None:
+            self.manifest.remove_file(self.relative_path(path))
+
+    def reindex_schedule_versions(self) -> int:
+        """Record every available version of this Cal in its event store.
+
+        Returns the number of versions recorded.
+        """
+        assert self.event_store is not None, f"No event_store for {self}."
+        hx = self.schedule_history
+        for vers_date in hx.version_dates:
+            hx.ingest(vers_date)
+        return len(hx.version_dates)
+
+    def pack_schedule_versions(
+        self,
+        codec: Optional[str] = None,
+        keyframe_interval: Optional[int] = DEF_KEYFRAME_INTERVAL,
+    ) -> int:
+        """Move this Cal's loose .ics files into its pack file.
+
+        Versions are stored as deltas against the preceding version,
+        with a full keyframe every keyframe_interval versions.  Each
+        file is removed only once its packed copy has been read back
+        and verified.  Returns the number of files packed.
+        """
+        assert self.ics_dir is not None, f"No ics_dir specified for {self}."
+        pack = IcsPack(self.ics_dir, self.cal_id)
+        packed = pack.entries_by_version()
+        loose_files = ScheduleHistory.from_files_for_cal(
+            cal=self, ics_dir=self.ics_dir
+        ).version_sources
+        num_packed = 0
+        for vers_date, source in loose_files.items():
+            if not isinstance(source, Path):
+                continue
+            stamp = version_stamp(vers_date)
+            data = source.read_bytes()
+            if stamp not in packed or packed[stamp].read() != data:
+                packed[stamp] = pack.append(stamp, data, codec, keyframe_interval)
+                if packed[stamp].read() != data:
+                    raise IOError(f"Could not verify packed copy of {source}.")
+            self.remove_loose_file(source)
+            num_packed += 1
+        self._schedule_history = None
+        return num_packed
+
+    def compact_schedule_versions(
+        self,
+        policy: Optional[RetentionPolicy] = None,
+        today: Optional[date] = None,
+        fmt_cfg=None,
+        codec: Optional[str] = None,
+        keyframe_interval: Optional[int] = DEF_KEYFRAME_INTERVAL,
+    ) -> int:
+        """Thin this Cal's versions according to a retention policy.
+
+        Pruned versions are first dropped from the pack file (which is
+        rewritten).  Once that has succeeded, the changes that
+        compacting would otherwise lose (those of each pruned version,
+        and of each kept version that followed one) are appended to
+        <cal_id>.compacted_changes.txt in ics_dir, before pruned loose
+        files and event store records are deleted.  Returns the number
+        pruned.
+        """
+        assert self.ics_dir is not None, f"No ics_dir specified for {self}."
+        policy = RetentionPolicy() if policy is None else policy
+        hx = self.schedule_history
+        version_dates = hx.version_dates
+        keep = policy.versions_to_keep(version_dates, today=today)
+        pruned = [d for d in version_dates if d not in keep]
+        if not pruned:
+            return 0
+
+        lost_changes = {
+            d: hx.get_changes_for_date(d)
+            for i, d in enumerate(version_dates)
+            if i > 0 and (d not in keep or version_dates[i - 1] not in keep)
+        }
+        report = ScheduleHistory.change_report(
+            lost_changes, cals=[self], fmt_cfg=fmt_cfg
+        )
+
+        pack = IcsPack(self.ics_dir, self.cal_id)
+        packed = sorted(
+            pack.entries_by_version().values(),
+            key=lambda e: version_sort_key(version_from_stamp(e.version)),
+        )
+        if any(version_from_stamp(e.version) not in keep for e in packed):
+            kept = [
+                (e.version, e.read())
+                for e in packed
+                if version_from_stamp(e.version) in keep
+            ]
+            pack.rewrite(kept, codec, keyframe_interval)
+
+        log_path = Path(self.ics_dir) / f"{self.cal_id}{COMPACTED_CHANGELOG_SUFFIX}"
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(
+                f"\nCompacted on {today or date.today()}: pruned {len(pruned)} "
+                f"version(s) dated {pruned[0]} to {pruned[-1]}.\n"
+            )
+            f.write(report)
+        for vers_date in pruned:
+            source = hx.version_sources[vers_date]
+            if isinstance(source, Path):
+                self.remove_loose_file(source)
+            if self.event_store is not None:
+                self.event_store.remove_version(self.cal_id, version_stamp(vers_date))
+        self._schedule_history = None
+        return len(pruned)
 
     @property
     def schedule_history(self):
@@ -83,7 +331,14 @@ class Cal:
         return self._schedule_history
 
     @classmethod
-    def from_tuple(cls, cal_tuple, ics_dir=DEF_ICS_DIR):
+    def from_tuple(
+        cls,
+        cal_tuple,
+        ics_dir=DEF_ICS_DIR,
+        event_store=None,
+        manifest=None,
+        layout=FLAT_LAYOUT,
+    ):
         id_, name, url, timezone = cal_tuple
         timezone = None if timezone == "" else timezone
         return cls(
@@ -92,11 +347,15 @@ class Cal:
             feed_url=url,
             ics_dir=ics_dir,
             timezone=timezone,
+            event_store=event_store,
+            manifest=manifest,
+            layout=layout,
         )
 
     def current_schedule_and_version_date(self) -> Tuple["Schedule", date]:
+        """Return the most recent Schedule (parsed once, then cached)."""
         try:
-            d, ical = self.schedule_history.most_recent_version_date_and_ical()
+            d, schedule = self.schedule_history.most_recent_version_date_and_schedule()
         except IndexError:
             print(
                 dedent(
@@ -110,7 +369,6 @@ class Cal:
                 )
             )
             sys.exit(1)
-        schedule = Schedule.from_icalendar(ical, self)
         return schedule, d
 
     @property
@@ -208,6 +466,10 @@ class MonitoredEventData:
                 if ranges_list == "default":
                     default_group = cat
                     break
+                if not ranges_list:
+                    # No time ranges (e.g., "All-Day": False in the default
+                    # rules, used when there's no [event_classifications])
+                    continue
                 for _range in ranges_list:
                     if not self.local_time:
                         break
@@ -230,43 +492,186 @@ class MonitoredEventData:
         return start_time_cats
 
     def display(self, fmt_cfg=None, classification_rules=None):
-        if fmt_cfg is None:
-            fmt_cfg = {}
-        date_fmt = sub_cfg(fmt_cfg, "date_fmt", DEF_DATE_FMT)
-        time_fmt = sub_cfg(fmt_cfg, "time_fmt", DEF_TIME_FMT)
-        time_replacements = sub_cfg(fmt_cfg, "time_replacements", None)
-        schedule_summary_line = sub_cfg(fmt_cfg, "event_summary", None)
-        grouping_field = sub_cfg(fmt_cfg, "time_group", None)
-        shift_str_template = sub_cfg(fmt_cfg, "time_group_fmt", None)
-        start_time_cat_dict = sub_cfg(
-            classification_rules, "by_start_time", DEF_START_TIME_CAT_DICT
-        )
+        formatter = EventFormatter(fmt_cfg, classification_rules, self.cal.timezone)
+        return formatter.format(self)
 
-        if schedule_summary_line is None:
-            schedule_summary_line = DEF_SUMMARY_LINE
+    def __str__(self):
+        return self.display()
 
-        date_str = self.forced_date.strftime(date_fmt)
-        time_str = self.local_time.strftime(time_fmt) if self.local_time else ""
 
-        if time_replacements is not None:
-            for pre, post in time_replacements.items():
-                time_str = time_str.replace(pre, post)
+class EventFormatter:
+    """Format MonitoredEventData lines for a schedule view.
 
-        if shift_str_template is None:
-            shift_str_template = DEF_TIME_GROUP_FMT
-        shift_str = shift_str_template.format(
-            self.start_time_cats(start_time_cat_dict)[grouping_field]
+    The [formatting.schedule_view] options and start time
+    classification rules are read once, and date, time and time
+    group strings are memoized, since many events share them.
+    """
+
+    def __init__(self, fmt_cfg=None, classification_rules=None, timezone=None):
+        self.date_fmt = sub_cfg(fmt_cfg, "date_fmt", DEF_DATE_FMT)
+        self.time_fmt = sub_cfg(fmt_cfg, "time_fmt", DEF_TIME_FMT)
+        self.time_replacements = sub_cfg(fmt_cfg, "time_replacements", None)
+        self.summary_line = sub_cfg(fmt_cfg, "event_summary", None)
+        if self.summary_line is None:
+            self.summary_line = DEF_SUMMARY_LINE
+        self.grouping_field = sub_cfg(fmt_cfg, "time_group", None)
+        self.shift_str_template = sub_cfg(fmt_cfg, "time_group_fmt", None)
+        if self.shift_str_template is None:
+            self.shift_str_template = DEF_TIME_GROUP_FMT
+        self.start_time_cat_dict = sub_cfg(
+            classification_rules, "by_start_time", DEF_START_TIME_CAT_DICT
+        )
+        self.tz = pytz.timezone(timezone)
+        self._date_strs: Dict[date, str] = {}
+        self._time_strs: Dict[Optional[time], str] = {}
+        self._shift_strs: Dict[Optional[time], str] = {}
+
+    def local_time(self, event: MonitoredEventData) -> Optional[time]:
+        if isinstance(event.date_or_datetime, datetime):
+            return event.date_or_datetime.astimezone(self.tz).time()
+        return None
+
+    def date_str(self, d: date) -> str:
+        if d not in self._date_strs:
+            self._date_strs[d] = d.strftime(self.date_fmt)
+        return self._date_strs[d]
+
+    def time_str(self, local_time: Optional[time]) -> str:
+        if local_time not in self._time_strs:
+            time_str = local_time.strftime(self.time_fmt) if local_time else ""
+            if self.time_replacements is not None:
+                for pre, post in self.time_replacements.items():
+                    time_str = time_str.replace(pre, post)
+            self._time_strs[local_time] = time_str
+        return self._time_strs[local_time]
+
+    def shift_str(self, event: MonitoredEventData, local_time: Optional[time]) -> str:
+        # An event's start time categories depend only on its local time
+        if local_time not in self._shift_strs:
+            cats = event.start_time_cats(self.start_time_cat_dict)
+            self._shift_strs[local_time] = self.shift_str_template.format(
+                cats[self.grouping_field]
+            )
+        return self._shift_strs[local_time]
+
+    def format(self, event: MonitoredEventData) -> str:
+        local_time = self.local_time(event)
+        return self.summary_line.format(
+            self.date_str(event.forced_date),
+            self.time_str(local_time),
+            self.shift_str(event, local_time),
+            event.summary,
         )
 
-        return schedule_summary_line.format(
-            date_str,
-            time_str,
-            shift_str,
-            self.summary,
+    def format_lines(self, events: Iterable[MonitoredEventData]) -> str:
+        """Format events, one per line."""
+        return "\n".join([self.format(event) for event in events])
+
+
+# Occurrences of a series of recurring events, by (digest of the
+# series' ics text, start of window, end of window); see expand_recurrences
+RecurrenceCache = Dict[Tuple[str, date, date], List[EventRecord]]
+# DTSTAMP (rewritten in every version by many feeds) doesn't affect
+# occurrences, so it is left out of series digests
+DTSTAMP_LINE_RE = re.compile(rb"^DTSTAMP[:;][^\r\n]*\r?\n", re.MULTILINE)
+
+
+def _calendar_with(
+    icalCal: icalendar.cal.Calendar, components: Iterable[icalendar.cal.Component]
+) -> icalendar.cal.Calendar:
+    """Return a calendar with icalCal's properties and the given components."""
+    new_cal = icalendar.Calendar()
+    for name, value in icalCal.items():
+        new_cal[name] = value
+    for component in components:
+        new_cal.add_component(component)
+    return new_cal
+
+
+def _occurrence_records(
+    icalCal: icalendar.cal.Calendar, start: date, end: date
+) -> List[EventRecord]:
+    return [
+        (ical_event["DTSTART"].dt, ical_event["SUMMARY"])
+        for ical_event in recurring_ical_events.of(icalCal).between(
+            (start.year, start.month, start.day), (end.year, end.month, end.day)
         )
+    ]
 
-    def __str__(self):
-        return self.display()
+
+def expand_recurrences(
+    icalCal: icalendar.cal.Calendar,
+    start: date,
+    end: date,
+    cache: Optional[RecurrenceCache] = None,
+    component_texts: Optional[Dict[int, bytes]] = None,
+) -> List[EventRecord]:
+    """Look up the occurrences of icalCal's events between start and end.
+
+    If a cache is given, each series of recurring events (a recurring
+    VEVENT with its RECURRENCE-ID overrides, which share a UID) is
+    looked up on its own, and its occurrences are cached by a digest of
+    the series' text (less DTSTAMPs, and with the calendar's properties
+    and timezones) and the window.  A series left unchanged in a later
+    version is then not expanded again.  Other events are looked up
+    together, uncached.
+
+    component_texts may map id(component) to the component's text as
+    read from the .ics file, which is digested instead of serializing
+    the component again.
+
+    The cache is left holding only the series of this lookup, since
+    versions are mostly parsed in date order.
+    """
+    if cache is None:
+        return _occurrence_records(icalCal, start, end)
+    timezones: List[icalendar.cal.Component] = []
+    events_by_uid: Dict[str, List[icalendar.cal.Component]] = {}
+    recurring_uids: Set[str] = set()
+    other_events: List[icalendar.cal.Component] = []
+    for component in icalCal.subcomponents:
+        if component.name == "VTIMEZONE":
+            timezones.append(component)
+        elif component.name != "VEVENT":
+            continue
+        elif "UID" not in component:
+            other_events.append(component)
+        else:
+            uid = str(component["UID"])
+            events_by_uid.setdefault(uid, []).append(component)
+            if any(p in component for p in RECURRENCE_PROPERTIES):
+                recurring_uids.add(uid)
+    if not recurring_uids:
+        cache.clear()
+        return _occurrence_records(icalCal, start, end)
+
+    if component_texts is None:
+        component_texts = {}
+    context = _calendar_with(icalCal, timezones).to_ical()
+    records: List[EventRecord] = []
+    used_keys = set()
+    for uid, series in events_by_uid.items():
+        if uid not in recurring_uids:
+            other_events.extend(series)
+            continue
+        digest = hashlib.sha1(context)
+        for component in series:
+            text = component_texts.get(id(component))
+            if text is None:
+                text = component.to_ical()
+            digest.update(DTSTAMP_LINE_RE.sub(b"", text))
+        key = (digest.hexdigest(), start, end)
+        if key not in cache:
+            series_cal = _calendar_with(icalCal, timezones + series)
+            cache[key] = _occurrence_records(series_cal, start, end)
+        used_keys.add(key)
+        records.extend(cache[key])
+    for key in set(cache) - used_keys:
+        del cache[key]
+    if other_events:
+        other_cal = _calendar_with(icalCal, timezones + other_events)
+        records.extend(_occurrence_records(other_cal, start, end))
+    return records
 
 
 class Schedule:
@@ -277,6 +682,7 @@ class Schedule:
         self.cal: Cal = cal
 
     @classmethod
+    @spanned("parse", "cal")
     def from_icalendar(
         cls,
         icalCal: icalendar.cal.Calendar,
@@ -294,11 +700,83 @@ class Schedule:
         and combine the two sets.
         """
 
+        return cls.from_components(
+            components=icalCal.subcomponents,
+            cal=cal,
+            expansion_cal=icalCal,
+            extra_timedelta_days_for_repeating_events=(
+                extra_timedelta_days_for_repeating_events
+            ),
+        )
+
+    @classmethod
+    @spanned("parse", "cal")
+    def from_ics_file(
+        cls,
+        filepathname,
+        cal: Cal,
+        extra_timedelta_days_for_repeating_events: int = 1,
+    ) -> "Schedule":
+        """Initialize a schedule by streaming components from an .ics file.
+
+        Unlike from_icalendar, no icalendar.Calendar tree is built for
+        the whole file.  Components are parsed one at a time, and only
+        the ones that recurrence expansion needs (recurring events,
+        their overrides and timezones) are retained until the
+        recurring_ical_events lookup has run.
+        """
+        expansion_cal = icalendar.Calendar()
+        retained: List[icalendar.cal.Component] = []
+        retained_texts: Dict[int, bytes] = {}  # by id(component)
+
+        def stream_components():
+            nonlocal expansion_cal
+            for name, text in iter_ics_blocks(filepathname):
+                component = icalendar.Calendar.from_ical(text)
+                if name == "VCALENDAR":
+                    expansion_cal = component
+                    continue
+                # A calendar-wide X-WR-TIMEZONE may alter the
+                # recurring_ical_events view of *any* event, so keep all.
+                if (
+                    name == "VTIMEZONE"
+                    or "X-WR-TIMEZONE" in expansion_cal
+                    or any(p in component for p in RECURRENCE_PROPERTIES)
+                ):
+                    retained.append(component)
+                    retained_texts[id(component)] = text.encode("utf-8")
+                yield component
+
+        new_instance = cls.from_components(stream_components(), cal)
+        if not any(c.name == "VEVENT" for c in retained):
+            return new_instance
+        for component in retained:
+            expansion_cal.add_component(component)
+        return new_instance.with_recurrences_from(
+            expansion_cal,
+            extra_timedelta_days_for_repeating_events,
+            component_texts=retained_texts,
+        )
+
+    @classmethod
+    def from_components(
+        cls,
+        components: Iterable[icalendar.cal.Component],
+        cal: Cal,
+        expansion_cal: Optional[icalendar.cal.Calendar] = None,
+        extra_timedelta_days_for_repeating_events: int = 1,
+    ) -> "Schedule":
+        """Initialize a schedule from top-level ics components.
+
+        If expansion_cal is provided, recurrent events found in it
+        are added via with_recurrences_from.
+        """
+
         new_instance: Schedule = cls(cal=cal)
 
         kerr_count = 0
         events_by_icalendar_lookup: Set[MonitoredEventData] = set()
-        for ical_event in icalCal.subcomponents:
+        for ical_event in components:
             try:
                 med: MonitoredEventData = MonitoredEventData(
                     event_date_or_datetime=ical_event["DTSTART"].dt,
@@ -322,22 +800,42 @@ class Schedule:
             )
             sys.stderr.write(msg)
 
+        new_instance.events = events_by_icalendar_lookup
+        if expansion_cal is None:
+            return new_instance
+        return new_instance.with_recurrences_from(
+            expansion_cal, extra_timedelta_days_for_repeating_events
+        )
+
+    @spanned("expand_recurrences", "self.cal")
+    def with_recurrences_from(
+        self,
+        icalCal: icalendar.cal.Calendar,
+        extra_timedelta_days_for_repeating_events: int = 1,
+        component_texts: Optional[Dict[int, bytes]] = None,
+    ) -> "Schedule":
+        """Add occurrences of recurrent events found in icalCal.
+
+        Occurrences are looked up using the recurring_ics_events package,
+        between the earliest and latest dates already in this schedule
+        (see expand_recurrences, which reuses those of unchanged series).
+        """
+
         # Get the earliest and laetst dates that are explicitly specified in
         # the ics file (ie, not specified by recurrence).
         # These will be used when querying for recurrent events.
         min_date = min(
-            [x.forced_date for x in events_by_icalendar_lookup],
+            [x.forced_date for x in self.events],
             default=None,
         )
         max_date = max(
-            [x.forced_date for x in events_by_icalendar_lookup],
+            [x.forced_date for x in self.events],
             default=None,
         )
         # Search for recurrent events that occur a specified # of days
         # beyond the latest explicitly-stated event date.
         if min_date is None and max_date is None:
-            new_instance.events = events_by_icalendar_lookup
-            return new_instance
+            return self
 
         if min_date is None or max_date is None:
             raise ValueError(f"Problem: min_date={min_date}, max_date={max_date}")
@@ -346,22 +844,40 @@ class Schedule:
 
         events_by_RIE_lookup: Set[MonitoredEventData] = {
             MonitoredEventData(
-                event_date_or_datetime=ical_event["DTSTART"].dt,
-                summary=ical_event["SUMMARY"],
-                cal=new_instance.cal,
+                event_date_or_datetime=start, summary=summary, cal=self.cal
             )
-            for ical_event in recurring_ical_events.of(icalCal).between(
-                (min_date.year, min_date.month, min_date.day),
-                (max_date.year, max_date.month, max_date.day),
+            for start, summary in expand_recurrences(
+                icalCal,
+                min_date,
+                max_date,
+                cache=self.cal.recurrence_cache,
+                component_texts=component_texts,
             )
         }
 
-        merged_events: Set[MonitoredEventData] = (
-            events_by_RIE_lookup | events_by_icalendar_lookup
-        )
-        new_instance.events = merged_events
+        self.events = events_by_RIE_lookup | self.events
+        return self
+
+    @classmethod
+    def from_records(cls, records: Iterable[EventRecord], cal: Cal) -> "Schedule":
+        """Initialize a schedule from (start, summary) event records."""
+        new_instance: Schedule = cls(cal=cal)
+        new_instance.events = {
+            MonitoredEventData(event_date_or_datetime=start, summary=summary, cal=cal)
+            for start, summary in records
+        }
         return new_instance
 
+    def records(self) -> List[EventRecord]:
+        return [(e.date_or_datetime, e.summary) for e in self.events]
+
+    def estimated_size(self) -> int:
+        """Estimate the memory held by this schedule's events, in bytes."""
+        return SCHEDULE_BYTES + sum(
+            EVENT_BYTES + sys.getsizeof(e.summary) + sys.getsizeof(e.date_or_datetime)
+            for e in self.events
+        )
+
     def filtered_events(
         self,
         earliest_date: date = None,
@@ -404,22 +920,56 @@ class Schedule:
         if version_date:
             header += f" [version {version_date}]:"
         header += "\n\n"
-        body = "\n".join(
-            [
-                event.display(fmt_cfg, classification_rules)
-                for event in self.filtered_events(
+        with span("render", self.cal.cal_id):
+            formatter = EventFormatter(fmt_cfg, classification_rules, self.cal.timezone)
+            body = formatter.format_lines(
+                self.filtered_events(
                     earliest_date=earliest_date,
                     latest_date=latest_date,
                     summary_filters=summary_filters,
                 )
-            ]
-        )
+            )
         return header + body
 
     def __str__(self):
         return self.display()
 
 
+# Parsed schedules, shared by every ScheduleHistory in the process
+# (see ionical.cache and ScheduleHistory.schedule_for_date)
+schedule_cache = LRUCache(sizeof=Schedule.estimated_size)
+
+
+def configure_schedule_cache(cache_cfg=None) -> None:
+    """Set the schedule cache's budgets from the [cache] config section."""
+    max_mb = sub_cfg(cache_cfg, "max_mb", DEF_MAX_MB)
+    schedule_cache.configure(
+        max_entries=sub_cfg(cache_cfg, "max_schedules", None),
+        max_bytes=None if max_mb is None else int(max_mb * MIB),
+    )
+
+
+def record_schedule_cache_counters(start_counters: Dict[str, int], cal_id=None):
+    """Record schedule_cache hits, etc., since start_counters (if instrumented)."""
+    for name, n in schedule_cache.counters().items():
+        instrumentation.count(
+            f"schedule_cache_{name}", n - start_counters[name], cal_id
+        )
+
+
+def schedule_cache_report() -> str:
+    """Summarize the schedule_cache counters recorded for a run."""
+    totals: DefaultDict[str, float] = defaultdict(float)
+    for (name, _), value in instrumentation.values.items():
+        if name.startswith("schedule_cache_"):
+            totals[name[len("schedule_cache_") :]] += value
+    return (
+        f"\nSchedule cache: {totals['hits']:.0f} hit(s), {totals['misses']:.0f}"
+        f" miss(es), {totals['evictions']:.0f} eviction(s); {len(schedule_cache)}"
+        f" schedule(s) held, about {schedule_cache.total_bytes / MIB:.1f} MiB\n"
+    )
+
+
 class ScheduleFeed:
     """Holder for a Cal's .ics URL."""
 
@@ -432,6 +982,29 @@ class ScheduleFeed:
         (?P<month>[0-9]{2})        # 2 digit month
         (?P<day>[0-9]{2})          # 2 digit day of month
         )                          # end capturing of <ymd>
+        (?:T                       # optionally, for sub-daily versions, T
+        (?P<hour>[0-9]{2})         # followed by 2 digit hour,
+        (?P<minute>[0-9]{2})       # 2 digit minute
+        (?P<second>[0-9]{2})       # and 2 digit second
+        )?
+        \.ics                      # suffix
+    """,
+        re.VERBOSE,
+    )
+
+    # File names within ics_dir/<cal_id>/<YYYY>/, in the sharded layout
+    sharded_ics_filename_pattern = re.compile(
+        r"""
+        ^(?P<ymd>                  # to capture concatenated year/month/day
+        (?P<year>[0-9]{4})         # 4 digit year
+        (?P<month>[0-9]{2})        # 2 digit month
+        (?P<day>[0-9]{2})          # 2 digit day of month
+        )                          # end capturing of <ymd>
+        (?:T                       # optionally, for sub-daily versions, T
+        (?P<hour>[0-9]{2})         # followed by 2 digit hour,
+        (?P<minute>[0-9]{2})       # 2 digit minute
+        (?P<second>[0-9]{2})       # and 2 digit second
+        )?
         \.ics                      # suffix
     """,
         re.VERBOSE,
@@ -440,31 +1013,209 @@ class ScheduleFeed:
     def __init__(self, cal: Cal, url: str):
         self.cal = cal
         self.url = url
+        # Validators (ETag, Last-Modified) of the last download, so that
+        # later polls can be made as conditional requests
+        self._validators: Dict[str, str] = {}
 
     def ics_filename_for_today(self):
-        f = f"{self.cal.cal_id}__{date.today().strftime('%Y%m%d')}.ics"
+        return self.ics_filename_for_version(date.today())
+
+    def ics_filename_for_version(self, version_date: date):
+        f = f"{self.cal.cal_id}__{version_stamp(version_date)}.ics"
         return f
 
-    def download_latest_schedule_version(self, ics_dir) -> None:
-        """Save the current .ics file version of the Cal's schedule."""
+    def ics_path_for_version(self, version_date: date) -> Path:
+        """Path of a version's loose .ics file, relative to ics_dir."""
+        return ics_relative_path(
+            self.cal.cal_id, version_stamp(version_date), self.cal.layout
+        )
+
+    @staticmethod
+    def version_for_now(timestamped: bool = False) -> date:
+        """Version for a download made now: today, or (if timestamped) now."""
+        if timestamped:
+            return datetime.now().replace(microsecond=0)
+        return date.today()
+
+    def fetch_ics_bytes(self) -> Optional[bytes]:
+        """Get the feed's current .ics data.
+
+        Responses may be gzip-compressed.  Once a download has
+        succeeded, later requests are conditional (If-None-Match,
+        If-Modified-Since), and a 304 Not Modified response is
+        answered with None, the data being unchanged since then.
+        """
+        headers = {"User-Agent": "Mozilla/5.0", "Accept-Encoding": "gzip"}
+        headers.update(self._validators)
+        req = urllib_request.Request(self.url, headers=headers)
+        cal_id, start = self.cal.cal_id, monotonic()
+        try:
+            with urllib_request.urlopen(req) as ics_http_response:
+                body = ics_http_response.read()
+                response_headers = ics_http_response.headers
+                status = getattr(ics_http_response, "status", None)
+        except urllib.error.HTTPError as e:
+            instrumentation.record("http_status", e.code, cal_id)
+            instrumentation.record("download_seconds", monotonic() - start, cal_id)
+            if e.code == 304 and self._validators:
+                return None
+            raise
+        except Exception:
+            instrumentation.record("http_status", 0, cal_id)
+            raise
+        instrumentation.record("download_seconds", monotonic() - start, cal_id)
+        if status is not None:  # (as for file: URLs)
+            instrumentation.record("http_status", status, cal_id)
+        if response_headers.get("Content-Encoding", "").lower() == "gzip":
+            body = gzip.decompress(body)
+        instrumentation.record("download_bytes", len(body), cal_id)
+        validators = {}
+        if response_headers.get("ETag"):
+            validators["If-None-Match"] = response_headers["ETag"]
+        if response_headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = response_headers["Last-Modified"]
+        self._validators = validators
+        return body
+
+    def download_latest_schedule_version(
+        self, ics_dir, archive_cfg=None
+    ) -> Optional[Tuple[date, IcsSource]]:
+        """Save the current .ics file version of the Cal's schedule.
+
+        The version is dated today, or timestamped with the current
+        time if archive_cfg has timestamped_versions enabled (so that
+        more than one version per day is kept).  If archive_cfg has
+        write_packs enabled, the version is appended to the Cal's pack
+        file (as a delta, when possible) rather than being written as a
+        loose .ics file.  Returns the version and where it was saved, or
+        None (saving nothing) if the feed's data is not modified since
+        the last download.
+        """
+        ics_text = self.fetch_ics_text()
+        if ics_text is None:
+            return None
+        return self.save_version(ics_text, ics_dir, archive_cfg)
 
+    def fetch_ics_text(self) -> Optional[str]:
         try:
-            req=urllib.request.Request(self.url, headers={'User-Agent': 'Mozilla/5.0'})
-            with urllib.request.urlopen(req) as ics_http_response:
-                ics_text = ics_http_response.read().decode()
+            ics_bytes = self.fetch_ics_bytes()
+            return None if ics_bytes is None else ics_bytes.decode()
         except urllib.error.HTTPError as e:
             raise Exception(f"Got an HTTP error: url={self.url}. e={e}")
         except Exception as e:
             print(f"Excepted url={self.url}  e={e}")
             raise e
 
+    def save_version(
+        self, ics_text: str, ics_dir, archive_cfg=None
+    ) -> Tuple[date, IcsSource]:
+        """Save downloaded .ics data as the current version of the Cal."""
+        version_date = self.version_for_now(
+            sub_cfg(archive_cfg, "timestamped_versions", False)
+        )
+        if sub_cfg(archive_cfg, "write_packs", False):
+            return version_date, IcsPack(ics_dir, str(self.cal.cal_id)).append(
+                version=version_stamp(version_date),
+                data=ics_text.encode("utf-8"),
+                codec=sub_cfg(archive_cfg, "codec", None),
+                keyframe_interval=sub_cfg(
+                    archive_cfg, "keyframe_interval", DEF_KEYFRAME_INTERVAL
+                ),
+            )
+
+        ics_path = Path(ics_dir) / self.ics_path_for_version(version_date)
+        if self.cal.layout == SHARDED_LAYOUT:
+            ics_path.parent.mkdir(parents=True, exist_ok=True)
         with open(
-            file=Path(ics_dir) / self.ics_filename_for_today(),
+            file=ics_path,
             mode="w",
             encoding="utf-8",
             newline="",
         ) as ics_file:
             ics_file.write(ics_text)
+        return version_date, ics_path
+
+
+def ics_relative_path(cal_id, stamp: str, layout: str = FLAT_LAYOUT) -> Path:
+    """Path of a loose .ics file (relative to ics_dir) in a layout."""
+    if layout == SHARDED_LAYOUT:
+        return Path(str(cal_id), stamp[:4], f"{stamp}.ics")
+    return Path(f"{cal_id}__{stamp}.ics")
+
+
+def _stamp_from_match(m: re.Match) -> str:
+    stamp = m.group("ymd")
+    if m.group("hour") is not None:
+        stamp += "T" + m.group("hour") + m.group("minute") + m.group("second")
+    return stamp
+
+
+def scan_ics_dir(
+    ics_dir, file_pat=None, layout: str = FLAT_LAYOUT, cal_id=None
+) -> Iterator[FoundFile]:
+    """Find downloaded .ics files in ics_dir, by listing it.
+
+    Yields (cal_id, version stamp, path relative to ics_dir).  In the
+    sharded layout, only the given cal_id's directory (if any) is
+    listed; file_pat applies to the flat layout only.
+    """
+    d = Path(ics_dir)
+    if layout == SHARDED_LAYOUT:
+        file_pat = ScheduleFeed.sharded_ics_filename_pattern
+        if cal_id is not None:
+            cal_dirs = [d / str(cal_id)] if (d / str(cal_id)).is_dir() else []
+        else:
+            cal_dirs = [f for f in d.iterdir() if f.is_dir()]
+        for cal_dir in cal_dirs:
+            for year_dir in cal_dir.iterdir():
+                if not year_dir.is_dir():
+                    continue
+                for f in year_dir.iterdir():
+                    m = file_pat.match(f.name)
+                    if m and m.group("year") == year_dir.name:
+                        path = f"{cal_dir.name}/{year_dir.name}/{f.name}"
+                        yield cal_dir.name, _stamp_from_match(m), path
+        return
+    if file_pat is None:
+        file_pat = ScheduleFeed.downloaded_ics_default_filename_pattern
+    for f in d.iterdir():
+        m = file_pat.match(f.name)
+        if m and (cal_id is None or m.group("cal_id") == str(cal_id)):
+            yield m.group("cal_id"), _stamp_from_match(m), f.name
+
+
+def migrate_layout(ics_dir, layout: str, manifest: Optional[Manifest] = None) -> int:
+    """Move loose .ics files in ics_dir into a layout; return how many.
+
+    A file whose new path is already taken (by a different file) is
+    left where it is.  Directories emptied by moving files out of the
+    sharded layout are removed.  A manifest is updated and saved.
+    """
+    d = Path(ics_dir)
+    old_layout = FLAT_LAYOUT if layout == SHARDED_LAYOUT else SHARDED_LAYOUT
+    num_moved = 0
+    for cal_id, stamp, path in list(scan_ics_dir(d, layout=old_layout)):
+        source, new_path = d / path, ics_relative_path(cal_id, stamp, layout)
+        target = d / new_path
+        if target.exists():
+            if target.read_bytes() != source.read_bytes():
+                sys.stderr.write(f"Not moving {source}: {target} already exists.\n")
+                continue
+            source.unlink()
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source, target)
+        if manifest is not None:
+            manifest.remove_file(path)
+            manifest.add_file(cal_id, stamp, new_path)
+        num_moved += 1
+        if old_layout == SHARDED_LAYOUT:
+            for empty_dir in (source.parent, source.parent.parent):
+                if not any(empty_dir.iterdir()):
+                    empty_dir.rmdir()
+    if manifest is not None:
+        manifest.save()
+    return num_moved
 
 
 # TODO: consider making SC full class
@@ -487,38 +1238,224 @@ class ScheduleHistory:
 
     def __init__(self, cal):
         self.cal: Cal = cal
-        self.sched_versions_by_date: OrderedDict[
-            date, icalendar.cal.Calendar
-        ] = OrderedDict([])
+        self.version_sources: OrderedDict[date, IcsSource] = OrderedDict([])
+        # Keys of versions this history has put in schedule_cache
+        self._cache_keys: Dict[date, Tuple] = {}
+        # Version list and each version's position in it, built on demand,
+        # so that lookups stay cheap for histories with many versions
+        self._version_dates: Optional[List[date]] = None
+        self._version_index: Optional[Dict[date, int]] = None
+        # (Reference, comparison) version pairs whose changes have been
+        # counted, so that versions compared again aren't counted twice
+        self._counted_changes: Set[Tuple[date, date]] = set()
 
     @classmethod
+    @spanned("scan_dir", "cal")
     def from_files_for_cal(cls, cal: Cal, ics_dir, file_pat=None) -> "ScheduleHistory":
-        """Instantiate by reading in .ics files for a Cal.
+        """Instantiate by locating .ics files for a Cal.
 
         Determination of which ics files correspond to
         Cal is made by matching Cal.cal_id to
         the id embedded in the filenames, as specified
-        by the regex found in ScheduleFeed class.
+        by the regex found in ScheduleFeed class.  Versions
+        archived in the Cal's pack file (see ionical.archive)
+        are included too; a loose file wins over a packed copy
+        of the same version.
+
+        Files are not read here; each version is parsed (and
+        reduced to a Schedule) the first time it is needed.  If the
+        Cal has a manifest (and no file_pat is given), loose files
+        are looked up in it, rather than by listing ics_dir; until the
+        manifest has been saved, ics_dir is listed instead.
         """
 
-        if file_pat is None:
-            file_pat = ScheduleFeed.downloaded_ics_default_filename_pattern
         new_hx = cls(cal)
+        sources: Dict[date, IcsSource] = {
+            version_from_stamp(e.version): e
+            for e in IcsPack(ics_dir, str(cal.cal_id)).entries()
+        }
         d = Path(ics_dir)
-        files_matches = [
-            (f, file_pat.match(f.name))
-            for f in d.iterdir()
-            if (
-                file_pat.match(f.name)
-                and file_pat.match(f.name).group("cal_id") == str(cal.cal_id)
-            )
-        ]
-        for f, m in sorted(files_matches, key=lambda x: (x[1].group("ymd"))):
-            yr, mo, day = m.group("year"), m.group("month"), m.group("day")
-            vers_date = date(int(yr), int(mo), int(day))
-            new_hx.sched_versions_by_date[vers_date] = cls.get_icalendar_cal(f)
+        if cal.manifest is not None and file_pat is None and cal.manifest.exists():
+            for entry in cal.manifest.entries_for(str(cal.cal_id)):
+                sources[version_from_stamp(entry.version)] = d / entry.path
+        else:
+            for _, stamp, path in scan_ics_dir(
+                d, file_pat, layout=cal.layout, cal_id=cal.cal_id
+            ):
+                sources[version_from_stamp(stamp)] = d / path
+        for vers_date in sorted(sources, key=version_sort_key):
+            new_hx.version_sources[vers_date] = sources[vers_date]
+        instrumentation.record("versions", len(sources), cal.cal_id)
         return new_hx
 
+    @property
+    def version_dates(self) -> List[date]:
+        if self._version_dates is None:
+            self._version_dates = list(self.version_sources.keys())
+        return self._version_dates
+
+    def version_position(self, version_date) -> int:
+        """Return the index of version_date within version_dates."""
+        if self._version_index is None:
+            self._version_index = {d: i for i, d in enumerate(self.version_dates)}
+        return self._version_index[version_date]
+
+    def parse_version(self, version_date) -> "Schedule":
+        """Parse a version's .ics data into a Schedule.
+
+        If the Cal shares its feed with other Cals (see share_feeds),
+        data already parsed for any of them (and still in schedule_cache)
+        is not parsed again; the Schedule is instead built from their
+        event records.  Loose files are hashed a chunk at a time, so
+        that large feeds are still only streamed.
+        """
+        source = self.version_sources[version_date]
+        if self.cal.shared_feed is None:
+            return Schedule.from_ics_file(source, self.cal)
+        if isinstance(source, PackedVersion):
+            digest = hashlib.sha1(source.read()).hexdigest()
+        else:
+            digest = file_sha1(source)
+        key = ("shared_feed", self.cal.shared_feed, digest)
+        shared = schedule_cache.get(key)
+        if shared is not None:
+            return Schedule.from_records(shared.records(), self.cal)
+        schedule = Schedule.from_ics_file(source, self.cal)
+        schedule_cache.put(key, schedule)
+        return schedule
+
+    def cache_key(self, version_date) -> Tuple:
+        """Key of a version's Schedule in schedule_cache.
+
+        Parsed versions are keyed by their file (or pack entry) and its
+        size and modification time, so that any Cal with the same
+        cal_id and timezone may reuse them, and a rewritten file is
+        parsed again.  Versions read from an event store are keyed by
+        the store, version stamp and when the version was recorded, so
+        that a version re-recorded (e.g., by '--reindex' in another
+        process) is read again.
+        """
+        cal = self.cal
+        if cal.event_store is not None:
+            stamp = version_stamp(version_date)
+            return (
+                str(cal.cal_id),
+                cal.timezone,
+                os.path.abspath(cal.event_store.path),
+                stamp,
+                cal.event_store.ingested(str(cal.cal_id), stamp),
+            )
+        source = self.version_sources[version_date]
+        if isinstance(source, PackedVersion):
+            path, member = source.pack_path, (source.version, source.offset)
+        else:
+            path, member = source, None
+        stat = os.stat(path)
+        return (
+            str(cal.cal_id),
+            cal.timezone,
+            os.path.abspath(path),
+            member,
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    def _cache_schedule(self, version_date, schedule: "Schedule") -> None:
+        key = self.cache_key(version_date)
+        self._cache_keys[version_date] = key
+        schedule_cache.put(key, schedule)
+
+    def schedule_for_date(self, version_date) -> "Schedule":
+        """Get the Schedule for a version date, streaming it in if needed.
+
+        Schedules are kept in the process-wide schedule_cache.  If the
+        Cal has an event store, the version's events are read from the
+        store (after being recorded there, if they weren't).
+        """
+        stamp = self._stored_version(version_date)  # (may ingest & cache it)
+        schedule = schedule_cache.get(self.cache_key(version_date))
+        if schedule is not None and schedule.cal is not self.cal:
+            # Cached for an equivalent Cal; rebuild it for this one
+            schedule = Schedule.from_records(schedule.records(), self.cal)
+            self._cache_schedule(version_date, schedule)
+        elif schedule is None:
+            if stamp is None:
+                schedule = self.parse_version(version_date)
+            else:
+                records = self.cal.event_store.events(str(self.cal.cal_id), stamp)
+                schedule = Schedule.from_records(records, self.cal)
+            self._cache_schedule(version_date, schedule)
+            if version_date == self.version_dates[-1]:
+                instrumentation.record("events", len(schedule.events), self.cal.cal_id)
+        return schedule
+
+    def add_version(self, version_date, source: IcsSource) -> None:
+        """Add (or replace) a version, e.g. one that was just downloaded."""
+        if version_date in self._cache_keys:
+            schedule_cache.discard(self._cache_keys.pop(version_date))
+        latest = next(reversed(self.version_sources), None)
+        self.version_sources[version_date] = source
+        if latest is not None and version_sort_key(latest) > version_sort_key(
+            version_date
+        ):
+            for vers_date in sorted(self.version_sources, key=version_sort_key):
+                self.version_sources.move_to_end(vers_date)
+        self._version_dates, self._version_index = None, None
+
+    def refresh(self) -> List[date]:
+        """Pick up versions saved to ics_dir since the history was loaded.
+
+        New (or relocated, e.g. newly packed) versions are added, and
+        versions no longer found (e.g., pruned by '--compact' in another
+        process) are dropped; schedules already parsed for the others are
+        kept.  Returns the dates of the versions added.
+        """
+        cal = self.cal
+        if cal.manifest is not None:
+            cal.manifest.reload()
+        found = ScheduleHistory.from_files_for_cal(
+            cal=cal, ics_dir=cal.ics_dir
+        ).version_sources
+        for version_date in [d for d in self.version_sources if d not in found]:
+            if version_date in self._cache_keys:
+                schedule_cache.discard(self._cache_keys.pop(version_date))
+            del self.version_sources[version_date]
+            self._version_dates, self._version_index = None, None
+        added = [d for d, s in found.items() if self.version_sources.get(d) != s]
+        for version_date in added:
+            self.add_version(version_date, found[version_date])
+        return added
+
+    def drop_cached_schedules(self, except_for=()) -> None:
+        """Drop schedules (other than those for except_for dates) from the cache."""
+        for version_date in list(self._cache_keys):
+            if version_date not in except_for:
+                schedule_cache.discard(self._cache_keys.pop(version_date))
+
+    def ingest(self, version_date) -> "Schedule":
+        """Parse a version and (re)record its events in the event store."""
+        schedule = self.parse_version(version_date)
+        if self.cal.event_store is not None:
+            self.cal.event_store.add_version(
+                str(self.cal.cal_id), version_stamp(version_date), schedule.records()
+            )
+        self._cache_schedule(version_date, schedule)
+        return schedule
+
+    def _stored_version(self, version_date) -> Optional[str]:
+        """Ensure a version is in the event store; return its stamp there.
+
+        Returns None if the Cal has no event store.
+        """
+        store = self.cal.event_store
+        if store is None:
+            return None
+        stamp = version_stamp(version_date)
+        if not store.has_version(str(self.cal.cal_id), stamp):
+            self.ingest(version_date)
+        return stamp
+
+    @spanned("diff", "self.cal")
     def get_changes_for_date(self, version_date) -> List[ScheduleChange]:
         """Get a cal's schedule changes for a given date.
 
@@ -529,19 +1466,39 @@ class ScheduleHistory:
         for that cal.
         """
 
-        i = list(self.sched_versions_by_date.keys()).index(version_date)
-        ref_date, ref_vers = list(self.sched_versions_by_date.items())[i]
-        comp_date, comp_vers = list(self.sched_versions_by_date.items())[i - 1]
+        version_dates = self.version_dates
+        i = self.version_position(version_date)
+        ref_date, comp_date = version_dates[i], version_dates[i - 1]
+
+        ref_stamp = self._stored_version(ref_date)
+        comp_stamp = self._stored_version(comp_date)
+        if ref_stamp is None or comp_stamp is None:
+            return self.changes_between(
+                ref_date,
+                self.schedule_for_date(ref_date),
+                comp_date,
+                self.schedule_for_date(comp_date),
+            )
 
-        reference_schedule = Schedule.from_icalendar(
-            icalCal=ref_vers,
-            cal=self.cal,
+        added, removed = self.cal.event_store.changes(
+            str(self.cal.cal_id), ref_stamp, comp_stamp
         )
-        comparison_schedule = Schedule.from_icalendar(
-            icalCal=comp_vers,
-            cal=self.cal,
+        return self.changes_between(
+            ref_date,
+            Schedule.from_records(added, self.cal),
+            comp_date,
+            Schedule.from_records(removed, self.cal),
         )
 
+    def changes_between(
+        self,
+        ref_date,
+        reference_schedule: "Schedule",
+        comp_date,
+        comparison_schedule: "Schedule",
+    ) -> List[ScheduleChange]:
+        """Get the ScheduleChanges from one schedule to another."""
+
         additions = reference_schedule.events - comparison_schedule.events
         removals = comparison_schedule.events - reference_schedule.events
 
@@ -554,32 +1511,52 @@ class ScheduleHistory:
             ScheduleChange(ref_date, comp_date, pid, x.summary, x.forced_datetime, "r")
             for x in removals
         ]
+        if (ref_date, comp_date) not in self._counted_changes:
+            self._counted_changes.add((ref_date, comp_date))
+            instrumentation.count("changes", len(a) + len(r), pid)
         return a + r
 
     # TODO: consider directly referencing Cal object from ScheduleChange?
     #   (rather than indirect lookup via Cal.cal_id)
-    def change_log(self, num_changelogs=None) -> Dict[date, List[ScheduleChange]]:
+    def change_log(
+        self, num_changelogs=None, since: Optional[date] = None
+    ) -> Dict[date, List[ScheduleChange]]:
         """Get a list of ScheduleChanges from multiple version dates.
 
         Compare each schedule version with the immediately preceding
         version (except for the very oldest version, for which there
         will be nothing available for comparison.)  For each schedule
         version date, provide a list of the changes.
+
+        Only the most recent num_changelogs versions are compared, and
+        (if since is given) only versions dated at or after since.
         """
-        length = len(list(self.sched_versions_by_date))
+        length = len(self.version_sources)
         if num_changelogs is None:
             change_slice = slice(1, length)
         else:
             change_slice = slice(max(1, length - num_changelogs), length)
+        if since is not None:
+            since_key = version_sort_key(since)
+            first = next(
+                (
+                    i
+                    for i, d in enumerate(self.version_dates)
+                    if version_sort_key(d) >= since_key
+                ),
+                length,
+            )
+            change_slice = slice(max(change_slice.start, first), length)
         return {
             date_: self.get_changes_for_date(date_)
-            for date_ in list(self.sched_versions_by_date.keys())[change_slice]
+            for date_ in self.version_dates[change_slice]
         }
 
     # TODO implement user option for which versions to analyze?
     # TODO allow user to specify sorting/grouping
     # TODO consider putting in its own class
     @classmethod
+    @spanned("changelog_report")
     def change_log_report_for_cals(
         cls,
         cals: List[Cal],
@@ -589,6 +1566,8 @@ class ScheduleHistory:
         num_changelogs=None,
         changelog_action_dict=None,
         fmt_cfg=None,
+        since: Optional[date] = None,
+        change_logs: Optional[List[Dict[date, List[ScheduleChange]]]] = None,
     ) -> str:
         """Return a filtered/sorted list of changes.
 
@@ -600,7 +1579,68 @@ class ScheduleHistory:
 
         If no filters are provided, then
         no search filter is applied.
+
+        If given, change_logs holds each Cal's change_log()
+        (e.g., as found by worker processes), in the order of cals.
         """
+        changes_by_ver_date: DefaultDict[date, List[ScheduleChange]] = defaultdict(list)
+
+        if change_logs is None:
+            change_logs = [
+                p.schedule_history.change_log(
+                    num_changelogs=num_changelogs,
+                    since=since,
+                )
+                for p in cals
+            ]
+        for change_log in change_logs:
+            for date_, changes in change_log.items():
+                changes_by_ver_date[date_] = changes_by_ver_date[date_] + changes
+
+        return cls.change_report(
+            changes_by_ver_date=changes_by_ver_date,
+            cals=cals,
+            earliest_date=earliest_date,
+            latest_date=latest_date,
+            summary_filters=summary_filters,
+            changelog_action_dict=changelog_action_dict,
+            fmt_cfg=fmt_cfg,
+        )
+
+    @classmethod
+    def filter_changes(
+        cls,
+        changes: List[ScheduleChange],
+        earliest_date: Optional[date] = None,
+        latest_date: Optional[date] = None,
+        summary_filters: Optional[List[str]] = None,
+    ) -> List[ScheduleChange]:
+        """Keep changes to events matching the summary and date filters."""
+
+        def meets_filter_criteria(c: ScheduleChange) -> bool:
+            return not any(
+                (
+                    summary_filters
+                    and not any(f in c.event_summary for f in summary_filters),
+                    earliest_date and c.event_start.date() < earliest_date,
+                    latest_date and c.event_start.date() > latest_date,
+                )
+            )
+
+        return [c for c in changes if meets_filter_criteria(c)]
+
+    @classmethod
+    def change_report(
+        cls,
+        changes_by_ver_date: Dict[date, List[ScheduleChange]],
+        cals: List[Cal],
+        earliest_date: Optional[date] = None,
+        latest_date: Optional[date] = None,
+        summary_filters: Optional[List[str]] = None,
+        changelog_action_dict=None,
+        fmt_cfg=None,
+    ) -> str:
+        """Format (filtered) changes, grouped by schedule version date."""
         # fmt_cfg = {} if fmt_cfg is None else fmt_cfg
         date_fmt = sub_cfg(fmt_cfg, "date_fmt", CHANGELOG_DEF_DATE_FMT)
         time_fmt = sub_cfg(fmt_cfg, "time_fmt", CHANGELOG_DEF_TIME_FMT)
@@ -617,16 +1657,6 @@ class ScheduleHistory:
                     return p
             raise KeyError(f"Did not find id {cal_id}.")
 
-        def meets_filter_criteria(c: ScheduleChange) -> bool:
-            return not any(
-                (
-                    summary_filters
-                    and not any(f in c.event_summary for f in summary_filters),
-                    earliest_date and c.event_start.date() < earliest_date,
-                    latest_date and c.event_start.date() > latest_date,
-                )
-            )
-
         def local_format_dt(
             datetime_: datetime,
             cal: Cal,
@@ -648,24 +1678,21 @@ class ScheduleHistory:
 
             return date_str + time_str
 
-        if summary_filters is None:
-            summary_filters = []
         if changelog_action_dict is None:
             changelog_action_dict = {"a": "ADD:", "r": "REMOVE:"}
 
-        changes_by_ver_date: DefaultDict[date, List[ScheduleChange]] = defaultdict(list)
-
-        for p in cals:
-            for date_, changes in p.schedule_history.change_log(
-                num_changelogs=num_changelogs,
-            ).items():
-                changes_by_ver_date[date_] = changes_by_ver_date[date_] + (
-                    [c for c in changes if meets_filter_criteria(c)]
-                )
         report = "\n"  # ""
 
-        cbvd = sorted(changes_by_ver_date.items(), key=lambda x: x[0])
-        for version_date, changes in cbvd:
+        cbvd = sorted(
+            changes_by_ver_date.items(), key=lambda x: version_sort_key(x[0])
+        )
+        for version_date, unfiltered_changes in cbvd:
+            changes = cls.filter_changes(
+                unfiltered_changes,
+                earliest_date=earliest_date,
+                latest_date=latest_date,
+                summary_filters=summary_filters,
+            )
             report += f"\n\nUpdates for sched vers dated {str(version_date)}:"
             if len(changes) == 0:
                 report += " NO CHANGES"
@@ -703,16 +1730,97 @@ class ScheduleHistory:
         self,
     ) -> Tuple[date, icalendar.cal.Calendar]:
         """Return most recent available schedule version/version date."""
-        last_version_index = len(self.sched_versions_by_date) - 1
-        return list(self.sched_versions_by_date.items())[last_version_index]
+        version_date = self.version_dates[-1]
+        source = self.version_sources[version_date]
+        with span("read_ics", self.cal.cal_id):
+            return version_date, self.get_icalendar_cal(source)
+
+    def most_recent_version_date_and_schedule(self) -> Tuple[date, "Schedule"]:
+        """Return most recent available Schedule and its version date."""
+        version_date = self.version_dates[-1]
+        return version_date, self.schedule_for_date(version_date)
 
     @classmethod
     def get_icalendar_cal(cls, filepathname) -> icalendar.cal.Calendar:
+        if isinstance(filepathname, PackedVersion):
+            return icalendar.Calendar.from_ical(_decode_ics(filepathname.read()))
         with open(filepathname, "r", encoding="utf-8") as file_:
             c = icalendar.Calendar.from_ical(file_.read())
         return c
 
 
+# Matches BEGIN/END content lines, which delimit ics components.
+# (Any mix of CR and LF is accepted as a line break, as when reading
+# ics files in text mode with universal newlines.)
+ics_component_delimiter_pattern = re.compile(
+    rb"""
+    (?:\A|(?<=[\r\n]))          # start of a line
+    (?P<marker>BEGIN|END):       # BEGIN or END property
+    (?P<name>[^\r\n]*?)          # component name
+    [ \t]*(?=[\r\n]|\Z)          # end of the line
+    """,
+    re.VERBOSE,
+)
+
+
+def iter_ics_blocks(filepathname) -> Iterator[Tuple[str, str]]:
+    """Yield (component name, text) for each top-level ics component.
+
+    The file is memory-mapped and scanned for BEGIN/END lines, so
+    only the text of the component currently being yielded is
+    copied out of the file.  Before the first component of each
+    VCALENDAR, a ("VCALENDAR", text) pair is yielded whose text
+    holds the calendar's own properties (without its components).
+
+    filepathname may also be a PackedVersion, in which case the
+    (decompressed) version is scanned in memory instead.
+    """
+    if isinstance(filepathname, PackedVersion):
+        yield from _iter_ics_blocks_in(filepathname.read())
+        return
+    with open(filepathname, "rb") as file_:
+        try:
+            buf = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can't be mapped
+            return
+        with buf:
+            yield from _iter_ics_blocks_in(buf)
+
+
+def _iter_ics_blocks_in(buf) -> Iterator[Tuple[str, str]]:
+    depth, start, name = 0, 0, ""
+    # Start of the VCALENDAR's own properties, until they've been yielded
+    cal_start: Optional[int] = 0
+    for m in ics_component_delimiter_pattern.finditer(buf):
+        if m.group("marker") == b"BEGIN":
+            depth += 1
+            if depth == 1:
+                cal_start = m.start()
+            elif depth == 2:
+                if cal_start is not None:
+                    header = buf[cal_start : m.start()] + b"END:VCALENDAR\n"
+                    yield "VCALENDAR", _decode_ics(header)
+                    cal_start = None
+                start = m.start()
+                name = m.group("name").decode("utf-8").upper()
+        else:
+            if depth == 2:
+                yield name, _decode_ics(buf[start : m.end()])
+            depth = max(depth - 1, 0)
+
+
+def _decode_ics(raw: bytes) -> str:
+    """Decode ics bytes, translating newlines as text-mode reading would."""
+    return raw.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def iter_vevents(filepathname) -> Iterator[icalendar.cal.Event]:
+    """Yield the VEVENT components of an .ics file one at a time."""
+    for name, text in iter_ics_blocks(filepathname):
+        if name == "VEVENT":
+            yield icalendar.Calendar.from_ical(text)
+
+
 class ScheduleWriter:
     def __init__(
         self,
@@ -720,18 +1828,21 @@ class ScheduleWriter:
         earliest_date: Optional[date] = None,
         latest_date: Optional[date] = None,
         summary_filters: Optional[List[str]] = None,
+        events_by_cal_id: Optional[Dict[str, List[MonitoredEventData]]] = None,
     ):
         self.summary_filters = summary_filters
         self.cals = cals
 
-        self.events_by_cal_id: Dict[str, List[MonitoredEventData]] = {
-            cal.cal_id: cal.current_schedule.filtered_events(
-                earliest_date=earliest_date,
-                latest_date=latest_date,
-                summary_filters=summary_filters,
-            )
-            for cal in cals
-        }
+        if events_by_cal_id is None:  # (else, already filtered, e.g. by workers)
+            events_by_cal_id = {
+                cal.cal_id: cal.current_schedule.filtered_events(
+                    earliest_date=earliest_date,
+                    latest_date=latest_date,
+                    summary_filters=summary_filters,
+                )
+                for cal in cals
+            }
+        self.events_by_cal_id: Dict[str, List[MonitoredEventData]] = events_by_cal_id
 
         event_dates = [
             event.forced_date
@@ -742,6 +1853,7 @@ class ScheduleWriter:
         self.earliest_date = earliest_date if earliest_date else min(event_dates)
         self.latest_date = latest_date if latest_date else max(event_dates)
 
+    @spanned("csv_write")
     def csv_write(
         self,
         csv_file,
@@ -809,11 +1921,13 @@ class ScheduleWriter:
                 text = (
                     csv_exp_str.format(
                         *[
-                            convert_if_lookup_found(
-                                event_date_groups[c].summary  # type: ignore
+                            (
+                                convert_if_lookup_found(
+                                    event_date_groups[c].summary  # type: ignore
+                                )
+                                if event_date_groups[c]
+                                else not_found_str
                             )
-                            if event_date_groups[c]
-                            else not_found_str
                             for c in shown_options
                         ]
                     )
@@ -821,7 +1935,8 @@ class ScheduleWriter:
                     else ""
                 )
 
-                # below hack addresses scenario when all-day events need to fill in other shifts
+                # below hack addresses scenario when all-day events need
+                # to fill in other shifts
                 all_day_spec_case = sub_cfg(
                     csv_cfg, "all_day_behavior_workaround", False
                 )
@@ -834,8 +1949,9 @@ class ScheduleWriter:
                         all_day_spec_case = False
                 if all_day_spec_case and event_date_groups[all_day_field_name]:
                     if not any([event_date_groups[c] for c in shown_options]):
+                        all_day_event = event_date_groups[all_day_field_name]
                         special_event = convert_if_lookup_found(
-                            event_date_groups[all_day_field_name].summary  # type: ignore
+                            all_day_event.summary  # type: ignore
                         )
                         text = csv_exp_str.format(
                             *([special_event] * len(shown_options))
@@ -843,14 +1959,16 @@ class ScheduleWriter:
                     else:
                         text = csv_exp_str.format(
                             *[
-                                convert_if_lookup_found(
-                                    event_date_groups[c].summary  # type: ignore
-                                )
-                                if event_date_groups[c]
-                                else convert_if_lookup_found(
-                                    event_date_groups[  # type: ignore
-                                        all_day_field_name
-                                    ].summary
+                                (
+                                    convert_if_lookup_found(
+                                        event_date_groups[c].summary  # type: ignore
+                                    )
+                                    if event_date_groups[c]
+                                    else convert_if_lookup_found(
+                                        event_date_groups[  # type: ignore
+                                            all_day_field_name
+                                        ].summary
+                                    )
                                 )
                                 for c in shown_options
                             ]
@@ -868,6 +1986,182 @@ class ScheduleWriter:
                 writer.writerow([date_] + plist)
 
 
+def _local_start(start: date, tz) -> str:
+    """ISO text of an event start in a Cal's timezone (if it has a time zone)."""
+    if isinstance(start, datetime) and start.tzinfo is not None:
+        return start.astimezone(tz).isoformat()
+    return start.isoformat()
+
+
+def event_jsonl_records(
+    cal: Cal,
+    earliest_date: Optional[date] = None,
+    latest_date: Optional[date] = None,
+    summary_filters: Optional[List[str]] = None,
+    classification_rules=None,
+) -> Iterator[Dict]:
+    """Yield a record for each event in a Cal's most recent version."""
+    schedule, version_date = cal.current_schedule_and_version_date()
+    tz = pytz.timezone(cal.timezone)
+    start_time_cat_dict = sub_cfg(
+        classification_rules, "by_start_time", DEF_START_TIME_CAT_DICT
+    )
+    for event in schedule.filtered_events(
+        earliest_date=earliest_date,
+        latest_date=latest_date,
+        summary_filters=summary_filters,
+    ):
+        yield {
+            "record": "event",
+            "cal_id": str(cal.cal_id),
+            "version": version_stamp(version_date),
+            "start": event.date_or_datetime.isoformat(),
+            "local_start": _local_start(event.date_or_datetime, tz),
+            "categories": event.start_time_cats(start_time_cat_dict),
+            "summary": str(event.summary),
+        }
+
+
+def change_jsonl_records(
+    cal: Cal,
+    earliest_date: Optional[date] = None,
+    latest_date: Optional[date] = None,
+    summary_filters: Optional[List[str]] = None,
+    num_versions: Optional[int] = None,
+) -> Iterator[Dict]:
+    """Yield a record for each change between a Cal's versions.
+
+    Versions are compared one at a time, oldest first, so that records
+    can be written as they are found.  If num_versions is given, only
+    the changes in that many of the most recent versions are included.
+    """
+    hx = cal.schedule_history
+    tz = pytz.timezone(cal.timezone)
+    first = 1
+    if num_versions is not None:
+        first = max(1, len(hx.version_dates) - num_versions)
+    for version_date in hx.version_dates[first:]:
+        changes = ScheduleHistory.filter_changes(
+            hx.get_changes_for_date(version_date),
+            earliest_date,
+            latest_date,
+            summary_filters,
+        )
+        changes.sort(  # (by date; starts may mix naive and aware datetimes)
+            key=lambda c: (
+                c.event_start.date(),
+                c.event_summary,
+                c.change_type,
+                c.event_start.isoformat(),
+            )
+        )
+        for change in changes:
+            yield {
+                "record": "change",
+                "cal_id": str(cal.cal_id),
+                "version": version_stamp(change.reference_date),
+                "prior_version": version_stamp(change.comparison_date),
+                "change": "added" if change.change_type == "a" else "removed",
+                "start": change.event_start.isoformat(),
+                "local_start": _local_start(change.event_start, tz),
+                "summary": str(change.event_summary),
+            }
+
+
+def write_cal_jsonl(
+    f,
+    cal: Cal,
+    earliest_date: Optional[date] = None,
+    latest_date: Optional[date] = None,
+    summary_filters: Optional[List[str]] = None,
+    classification_rules=None,
+) -> int:
+    """Write a Cal's event and change records to f, one per line.
+
+    Returns the number of records written.
+    """
+    num_records = 0
+    with span("jsonl_write", cal.cal_id):
+        records = itertools.chain(
+            event_jsonl_records(
+                cal, earliest_date, latest_date, summary_filters, classification_rules
+            ),
+            change_jsonl_records(cal, earliest_date, latest_date, summary_filters),
+        )
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            num_records += 1
+    return num_records
+
+
+def jsonl_part_file(jsonl_file, n: int) -> str:
+    """Name of a worker's part of a JSON Lines export."""
+    path = Path(jsonl_file)
+    return str(path.with_name(f".{path.name}.{n}.part"))
+
+
+def write_jsonl(
+    jsonl_file,
+    cals: List[Cal],
+    earliest_date: Optional[date] = None,
+    latest_date: Optional[date] = None,
+    summary_filters: Optional[List[str]] = None,
+    classification_rules=None,
+    part_files: Optional[List[str]] = None,
+) -> None:
+    """Export cals' events and changes as JSON Lines.
+
+    Records are streamed to the file as they are found, and the file
+    is then replaced atomically.  If part_files are given (as written
+    by workers, one per Cal), they are concatenated instead.
+    """
+    path = Path(jsonl_file)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        if part_files is not None:
+            for part_file in part_files:
+                with open(part_file, "r", encoding="utf-8", newline="\n") as part:
+                    shutil.copyfileobj(part, f)
+                os.remove(part_file)
+        else:
+            for cal in cals:
+                write_cal_jsonl(
+                    f,
+                    cal,
+                    earliest_date,
+                    latest_date,
+                    summary_filters,
+                    classification_rules,
+                )
+    os.replace(tmp_path, path)
+
+
+def export_parquet(cal: Cal, parquet_dir) -> int:
+    """Write every event of every version of a Cal as Parquet rows.
+
+    (See ionical.columnar.)  Returns the number of rows written.
+    """
+    hx = cal.schedule_history
+    tz = pytz.timezone(cal.timezone)
+    with span("parquet_write", cal.cal_id), columnar.HistoryParquetWriter(
+        parquet_dir, str(cal.cal_id)
+    ) as writer:
+        for version_date in hx.version_dates:
+            stamp = version_stamp(version_date)
+            month = f"{version_date:%Y-%m}"
+            for event in hx.schedule_for_date(version_date).filtered_events():
+                start = event.date_or_datetime
+                all_day = not isinstance(start, datetime)
+                if all_day:
+                    start = tz.localize(datetime.combine(start, time()))
+                elif start.tzinfo is None:  # (floating time)
+                    start = tz.localize(start)
+                writer.add(
+                    stamp, month, start, event.forced_date, all_day, str(event.summary)
+                )
+    return writer.num_rows
+
+
 def sub_cfg(
     cfg: Optional[Dict],
     sub_key: str,
@@ -894,7 +2188,346 @@ def sub_cfg(
             return default_val
 
 
-def main(
+def cals_by_feed_url(cals: List[Cal]) -> Dict[str, List[Cal]]:
+    """Group Cals (that have feeds) by feed URL, in the order of cals."""
+    cals_by_url: Dict[str, List[Cal]] = {}
+    for cal in cals:
+        if cal.schedule_feed is not None:
+            cals_by_url.setdefault(cal.schedule_feed.url, []).append(cal)
+    return cals_by_url
+
+
+def share_feeds(cals: List[Cal]) -> None:
+    """Share parsing between Cals with the same feed URL.
+
+    Such Cals (e.g., different people's views of a single department
+    feed) are marked as sharing it, so that each version of the feed's
+    data is parsed only once (while it stays in schedule_cache).
+    """
+    for url, group in cals_by_feed_url(cals).items():
+        if len(group) > 1:
+            for cal in group:
+                cal.shared_feed = url
+
+
+def download_cals(cals: List[Cal], archive_cfg=None) -> None:
+    """Download the current version of each Cal's feed.
+
+    A URL shared by several Cals is fetched only once, and the data
+    is then saved as the current version of each of them.
+    """
+    for group in cals_by_feed_url(cals).values():
+        with span("download", group[0].cal_id):
+            try:
+                ics_text = group[0].schedule_feed.fetch_ics_text()  # type: ignore
+            finally:  # (the one download's values apply to each Cal in the group)
+                for cal in group[1:]:
+                    instrumentation.copy_values(
+                        DOWNLOAD_VALUES, group[0].cal_id, cal.cal_id
+                    )
+            if ics_text is None:  # (not modified since the last download)
+                continue
+            saved = [
+                cal.schedule_feed.save_version(  # type: ignore
+                    ics_text, ics_dir=cal.ics_dir, archive_cfg=archive_cfg
+                )
+                for cal in group
+            ]
+        for cal, (version_date, source) in zip(group, saved):
+            cal.record_downloaded_version(version_date, source)
+    save_manifests(cals)
+
+
+def save_manifests(cals: List[Cal]) -> None:
+    """Save the manifest(s) of cals, if changed."""
+    manifests = {id(c.manifest): c.manifest for c in cals if c.manifest is not None}
+    for manifest in manifests.values():
+        manifest.save()
+
+
+# Maintenance actions, in the order main() runs them
+MAINTENANCE_ACTIONS = ("pack", "compact", "reindex")
+
+
+def maintain_cal(cal: Cal, action: str, cfg=None) -> str:
+    """Run a maintenance action (one of MAINTENANCE_ACTIONS) for a Cal.
+
+    Returns a message saying what was done, for verbose output.
+    """
+    archive_cfg = sub_cfg(cfg, "archive")
+    codec = sub_cfg(archive_cfg, "codec", None)
+    keyframe_interval = sub_cfg(archive_cfg, "keyframe_interval", DEF_KEYFRAME_INTERVAL)
+    if action == "pack":
+        num_packed = cal.pack_schedule_versions(
+            codec=codec, keyframe_interval=keyframe_interval
+        )
+        return f"\nPacked {num_packed} .ics file(s) for {cal}."
+    if action == "compact":
+        num_pruned = cal.compact_schedule_versions(
+            policy=RetentionPolicy.from_cfg(sub_cfg(cfg, "retention")),
+            fmt_cfg=sub_cfg(sub_cfg(cfg, "formatting"), "changelog"),
+            codec=codec,
+            keyframe_interval=keyframe_interval,
+        )
+        return f"\nPruned {num_pruned} version(s) of {cal}."
+    if action == "reindex":
+        num_recorded = cal.reindex_schedule_versions()
+        return f"\nRecorded {num_recorded} version(s) of {cal} in event store."
+    raise ValueError(f"Unknown maintenance action: {action}")
+
+
+def schedule_view(
+    cal: Cal,
+    earliest_date: Optional[date] = None,
+    latest_date: Optional[date] = None,
+    summary_filters: Optional[List[str]] = None,
+    cfg=None,
+) -> str:
+    """Display a Cal's most recent Schedule, as for '-s'."""
+    schedule, version_date = cal.current_schedule_and_version_date()
+    return schedule.display(
+        earliest_date=earliest_date,
+        latest_date=latest_date,
+        summary_filters=summary_filters,
+        version_date=version_date,
+        fmt_cfg=sub_cfg(sub_cfg(cfg, "formatting"), "schedule_view"),
+        classification_rules=sub_cfg(cfg, "event_classifications"),
+    )
+
+
+class CalJob(NamedTuple):
+    """A calendar's share of a run, for run_cal_pipeline()."""
+
+    cal_tuple: Tuple[str, str, str, str]
+    ics_dir: str
+    store_path: Optional[str]
+    manifest: bool
+    cfg: Optional[Dict]
+    download: bool
+    maintenance: Tuple[str, ...]  # (MAINTENANCE_ACTIONS to run, in order)
+    show_changelog: bool
+    num_changelogs: Optional[int]
+    show_schedule: bool
+    export_events: bool  # (for CSV export)
+    jsonl_part: Optional[str]  # (file for the Cal's JSON Lines records)
+    parquet_dir: Optional[str]
+    earliest_date: Optional[date]
+    latest_date: Optional[date]
+    summary_filters: Optional[List[str]]
+    instrumented: bool
+
+
+class CalResult(NamedTuple):
+    """What run_cal_pipeline() found, in a compact, picklable form."""
+
+    messages: Dict[str, str]  # {maintenance action: message}
+    change_log: Optional[Dict[date, List[ScheduleChange]]]
+    schedule_view: Optional[str]
+    events: Optional[List[EventRecord]]  # (filtered, for CSV export)
+    instrumentation_state: Optional[Dict]
+    manifest_entries: Optional[List[ManifestEntry]]  # (the Cal's, if changed)
+    parquet_rows: Optional[int]  # (number exported, if any)
+
+
+def run_cal_pipeline(job: CalJob) -> CalResult:
+    """Do one calendar's share of a run (e.g., in a worker process)."""
+    if job.instrumented:
+        instrumentation.enable()
+    configure_schedule_cache(sub_cfg(job.cfg, "cache"))
+    cache_counters = schedule_cache.counters()
+    event_store = None if job.store_path is None else EventStore(job.store_path)
+    manifest = Manifest(job.ics_dir) if job.manifest else None
+    cal = Cal.from_tuple(
+        job.cal_tuple,
+        ics_dir=job.ics_dir,
+        event_store=event_store,
+        manifest=manifest,
+        layout=sub_cfg(sub_cfg(job.cfg, "archive"), "layout", FLAT_LAYOUT),
+    )
+    if job.download:
+        cal.download_latest_schedule_version(archive_cfg=sub_cfg(job.cfg, "archive"))
+    messages = {
+        action: maintain_cal(cal, action, job.cfg) for action in job.maintenance
+    }
+    change_log, view, events = None, None, None
+    if job.show_changelog:
+        change_log = cal.schedule_history.change_log(num_changelogs=job.num_changelogs)
+    if job.show_schedule:
+        view = schedule_view(
+            cal, job.earliest_date, job.latest_date, job.summary_filters, job.cfg
+        )
+    if job.export_events:
+        events = [
+            (event.date_or_datetime, event.summary)
+            for event in cal.current_schedule.filtered_events(
+                earliest_date=job.earliest_date,
+                latest_date=job.latest_date,
+                summary_filters=job.summary_filters,
+            )
+        ]
+    if job.jsonl_part is not None:
+        with open(job.jsonl_part, "w", encoding="utf-8", newline="\n") as f:
+            write_cal_jsonl(
+                f,
+                cal,
+                job.earliest_date,
+                job.latest_date,
+                job.summary_filters,
+                sub_cfg(job.cfg, "event_classifications"),
+            )
+    parquet_rows = None
+    if job.parquet_dir is not None:
+        parquet_rows = export_parquet(cal, job.parquet_dir)
+    if event_store is not None:
+        event_store.close()
+    state = None
+    if job.instrumented:
+        record_schedule_cache_counters(cache_counters, cal.cal_id)
+        instrumentation.disable()
+        state = instrumentation.state()
+    manifest_entries = None
+    if manifest is not None and manifest.dirty:  # (saved by the main process)
+        manifest_entries = manifest.entries_for(str(cal.cal_id))
+    return CalResult(
+        messages, change_log, view, events, state, manifest_entries, parquet_rows
+    )
+
+
+def plain_cfg(cfg):
+    """Copy config data as plain dicts and lists, which can be pickled.
+
+    (toml returns inline tables as instances of a local class.)
+    """
+    if isinstance(cfg, dict):
+        return {key: plain_cfg(value) for key, value in cfg.items()}
+    if isinstance(cfg, list):
+        return [plain_cfg(value) for value in cfg]
+    return cfg
+
+
+def run_cal_pipelines(jobs: List[CalJob], workers: int) -> List[CalResult]:
+    """Run calendars' pipelines in a pool of worker processes.
+
+    Results are returned in the order of jobs, whatever order the
+    workers finish them in.
+    """
+    sys.stdout.flush()  # (so that workers don't inherit pending output)
+    with concurrent_futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_cal_pipeline, jobs))
+
+
+def watch(
+    cals: List[Cal],
+    interval: float,
+    archive_cfg=None,
+    earliest_date: Optional[date] = None,
+    latest_date: Optional[date] = None,
+    summary_filters: Optional[List[str]] = None,
+    fmt_cfg=None,
+    max_polls: Optional[int] = None,
+    poll_intervals: Optional[Dict[str, float]] = None,
+    polling_cfg=None,
+) -> None:
+    """Poll cals' feeds, printing changes as soon as they are found.
+
+    Each feed is polled every interval seconds, unless poll_intervals
+    gives it its own interval; failed polls are retried with backoff,
+    and requests are limited per host (see ionical.scheduler).  A URL
+    shared by several Cals is polled only once, and each download is
+    then saved as a new version of each of them (as in download_cals).
+
+    Schedule histories stay in memory between polls.  Each newly
+    downloaded version is appended to its Cal's history and compared
+    only with the version held just before it (which, for a version
+    downloaded earlier the same day, is that earlier download).
+    """
+    poll_intervals = {} if poll_intervals is None else poll_intervals
+    groups = cals_by_feed_url(cals)
+    feeds = []
+    for url, group in groups.items():
+        # A feed shared by Cals is polled as often as any of them asks
+        intervals = [
+            poll_intervals[str(c.cal_id)]
+            for c in group
+            if str(c.cal_id) in poll_intervals
+        ]
+        feeds.append((url, url, min(intervals, default=None)))
+    scheduler = PollScheduler.from_cfg(
+        feeds=feeds, polling_cfg=polling_cfg, default_interval=interval
+    )
+
+    def fetch(url: str) -> Optional[List[Tuple[date, IcsSource]]]:
+        group = groups[url]
+        try:
+            ics_text = group[0].schedule_feed.fetch_ics_text()  # type: ignore
+        finally:  # (the one download's values apply to each Cal in the group)
+            for cal in group[1:]:
+                instrumentation.copy_values(
+                    DOWNLOAD_VALUES, group[0].cal_id, cal.cal_id
+                )
+        if ics_text is None:  # (not modified since the last poll)
+            return None
+        return [
+            cal.schedule_feed.save_version(  # type: ignore
+                ics_text, ics_dir=cal.ics_dir, archive_cfg=archive_cfg
+            )
+            for cal in group
+        ]
+
+    num_polls = 0
+    while max_polls is None or num_polls < max_polls:
+        due = scheduler.due()
+        priors = {}
+        for cal in (c for url in due for c in groups[url]):
+            hx = cal.schedule_history
+            prior_date = hx.version_dates[-1] if hx.version_dates else None
+            if prior_date is not None:
+                priors[cal.cal_id] = (prior_date, hx.schedule_for_date(prior_date))
+
+        downloaded = scheduler.poll_due(fetch, keys=due)
+
+        for url in due:
+            if url not in downloaded:
+                state = scheduler.states[url]
+                for cal in groups[url]:
+                    sys.stderr.write(
+                        f"Could not download {cal}: {state.last_error}"
+                        f"  (retrying in {state.next_due - monotonic():.0f}s)\n"
+                    )
+                continue
+            if downloaded[url] is None:
+                continue
+            for cal, saved in zip(groups[url], downloaded[url]):
+                hx = cal.schedule_history
+                version_date = cal.record_downloaded_version(*saved)
+                if cal.cal_id in priors:
+                    prior_date, prior = priors[cal.cal_id]
+                    changes = hx.changes_between(
+                        version_date,
+                        hx.schedule_for_date(version_date),
+                        prior_date,
+                        prior,
+                    )
+                    if ScheduleHistory.filter_changes(
+                        changes, earliest_date, latest_date, summary_filters
+                    ):
+                        report = ScheduleHistory.change_report(
+                            changes_by_ver_date={version_date: changes},
+                            cals=cals,
+                            earliest_date=earliest_date,
+                            latest_date=latest_date,
+                            summary_filters=summary_filters,
+                            fmt_cfg=fmt_cfg,
+                        )
+                        print(report, end="", flush=True)
+                hx.drop_cached_schedules(except_for=[version_date])
+        save_manifests(cals)
+        num_polls += 1
+        if max_polls is None or num_polls < max_polls:
+            sleep(scheduler.seconds_until_next_due())
+
+
+def run_actions(
     cals_data: List[Tuple[str, str, str, str]],
     cals_filter: Optional[List[str]] = None,
     ics_dir=DEF_ICS_DIR,
@@ -908,15 +2541,91 @@ def main(
     num_changelogs=None,  # (for changelogs)
     cfg=None,
     verbose=0,
+    pack_option: bool = False,
+    reindex_option: bool = False,
+    compact_option: bool = False,
+    watch_interval: Optional[float] = None,
+    workers: int = 1,
+    rebuild_manifest_option: bool = False,
+    verify_manifest_option: bool = False,
+    migrate_layout_option: bool = False,
+    jsonl_export_file: Optional[str] = None,
+    parquet_dir: Optional[str] = None,
+    serve_port: Optional[int] = None,
 ) -> None:
-
+    """Run the actions chosen for main(), apart from its instrumentation."""
     output = ""
 
     classification_rules = sub_cfg(cfg, "event_classifications")
     fmt_cfg = sub_cfg(cfg, "formatting")
 
+    store_cfg = sub_cfg(cfg, "store")
+    event_store = None
+    if reindex_option or sub_cfg(store_cfg, "enabled", False):
+        store_path = Path(sub_cfg(store_cfg, "path", DEF_STORE_FN))
+        if not store_path.is_absolute():
+            store_path = Path(ics_dir) / store_path
+        event_store = EventStore(store_path)
+
+    archive_cfg = sub_cfg(cfg, "archive")
+    layout = sub_cfg(archive_cfg, "layout", FLAT_LAYOUT)
+    if layout not in LAYOUTS:
+        print(f"Quitting- unknown layout '{layout}' in [archive] config.\n")
+        sys.exit(1)
+    if parquet_dir and columnar.pyarrow is None:
+        print(
+            "Quitting- '--parquet' requires pyarrow "
+            "(pip install ionical[parquet]).\n"
+        )
+        sys.exit(1)
+    if serve_port and watch_interval:
+        print(
+            "Quitting- '--serve' can't be combined with '--watch' (run "
+            "'--watch' in another process; new versions are picked up).\n"
+        )
+        sys.exit(1)
+    use_manifest = sub_cfg(archive_cfg, "manifest", False)
+    manifest = None
+    if use_manifest or rebuild_manifest_option or verify_manifest_option:
+        manifest = Manifest(ics_dir)
+    if migrate_layout_option:
+        listed_in = None  # (a manifest not yet saved is created below)
+        if use_manifest and manifest is not None and manifest.exists():
+            listed_in = manifest
+        num_moved = migrate_layout(ics_dir, layout, listed_in)
+        if verbose:
+            print(f"\nMoved {num_moved} .ics file(s) into the {layout} layout.")
+    if rebuild_manifest_option:
+        num_listed = manifest.rebuild(  # type: ignore
+            scan_ics_dir(ics_dir, layout=layout)
+        )
+        if verbose:
+            print(f"\nRebuilt {manifest.path}: {num_listed} file(s) listed.")
+    if verify_manifest_option:
+        problems = manifest.verify(scan_ics_dir(ics_dir, layout=layout))  # type: ignore
+        if problems:
+            print(f"\n{manifest.path} is out of sync ({len(problems)} problem(s)):")
+            print("\n".join(f"  {problem}" for problem in problems))
+        else:
+            print(f"\n{manifest.path} lists {len(manifest.entries)} file(s), in sync.")
+    if use_manifest and manifest is not None and not manifest.exists():
+        # (e.g., the manifest was just enabled for an existing ics_dir)
+        num_listed = manifest.rebuild(scan_ics_dir(ics_dir, layout=layout))
+        if verbose:
+            print(f"\nCreated {manifest.path}: {num_listed} file(s) listed.")
+
+    # The Cals (and their ScheduleHistory objects) last for the run,
+    # so each version is parsed at most once, whether it's needed for
+    # the changelog, the schedule view, the CSV export or all three
     all_cals = [
-        Cal.from_tuple(cal_tuple=cal_tuple, ics_dir=ics_dir) for cal_tuple in cals_data
+        Cal.from_tuple(
+            cal_tuple=cal_tuple,
+            ics_dir=ics_dir,
+            event_store=event_store,
+            manifest=manifest if use_manifest else None,
+            layout=layout,
+        )
+        for cal_tuple in cals_data
     ]
 
     if cals_filter:
@@ -924,9 +2633,82 @@ def main(
     else:
         chosen_cals = all_cals
 
-    if download_option:
-        for p in chosen_cals:
-            p.download_latest_schedule_version()
+    share_feeds(chosen_cals)
+
+    maintenance = tuple(
+        action
+        for action, option in zip(
+            MAINTENANCE_ACTIONS, (pack_option, compact_option, reindex_option)
+        )
+        if option
+    )
+
+    # With workers, each calendar's whole pipeline runs in a worker
+    # process; results are then merged below, in calendar order, so
+    # that output is the same as for a serial run.
+    results: Optional[List[CalResult]] = None
+    jsonl_parts: Optional[List[str]] = None
+    if workers > 1 and chosen_cals:
+        # Feeds shared by several calendars are downloaded here, once
+        shared_feed_cals = [
+            cal
+            for group in cals_by_feed_url(chosen_cals).values()
+            if len(group) > 1
+            for cal in group
+        ]
+        if download_option:
+            download_cals(shared_feed_cals, archive_cfg)
+        job_cfg = plain_cfg(cfg)
+        jobs = [
+            CalJob(
+                cal_tuple=cal_tuple,
+                ics_dir=str(ics_dir),
+                store_path=None if event_store is None else str(event_store.path),
+                manifest=bool(use_manifest),
+                cfg=job_cfg,
+                download=download_option and cal not in shared_feed_cals,
+                maintenance=maintenance,
+                show_changelog=show_changelog,
+                num_changelogs=num_changelogs,
+                show_schedule=show_schedule,
+                export_events=bool(csv_export_file),
+                jsonl_part=(
+                    jsonl_part_file(jsonl_export_file, i) if jsonl_export_file else None
+                ),
+                parquet_dir=None if parquet_dir is None else str(parquet_dir),
+                earliest_date=earliest_date,
+                latest_date=latest_date,
+                summary_filters=summary_filters,
+                instrumented=instrumentation.enabled,
+            )
+            for i, (cal_tuple, cal) in enumerate(zip(cals_data, all_cals))
+            if cal in chosen_cals
+        ]
+        if jsonl_export_file:
+            jsonl_parts = [job.jsonl_part for job in jobs]  # type: ignore
+        results = run_cal_pipelines(jobs, workers)
+        for cal, result in zip(chosen_cals, results):
+            if result.instrumentation_state is not None:
+                instrumentation.merge(result.instrumentation_state)
+            if result.manifest_entries is not None:
+                cal.manifest.set_entries_for(  # type: ignore
+                    str(cal.cal_id), result.manifest_entries
+                )
+        save_manifests(chosen_cals)
+
+    if download_option and results is None:
+        download_cals(chosen_cals, archive_cfg)
+
+    for action in maintenance:
+        for i, p in enumerate(chosen_cals):
+            message = (
+                maintain_cal(p, action, cfg)
+                if results is None
+                else results[i].messages[action]
+            )
+            if verbose:
+                print(message)
+    save_manifests(chosen_cals)
 
     if show_changelog:
         report = ScheduleHistory.change_log_report_for_cals(
@@ -936,30 +2718,37 @@ def main(
             summary_filters=summary_filters,
             num_changelogs=num_changelogs,
             fmt_cfg=sub_cfg(fmt_cfg, "changelog"),
+            change_logs=None if results is None else [r.change_log for r in results],
         )
         output += report
 
     if show_schedule:
-        for cal in chosen_cals:
-            schedule, version_date = cal.current_schedule_and_version_date()
-            schedule_display = schedule.display(
-                earliest_date=earliest_date,
-                latest_date=latest_date,
-                summary_filters=summary_filters,
-                version_date=version_date,
-                fmt_cfg=sub_cfg(fmt_cfg, "schedule_view"),
-                classification_rules=classification_rules,
-            )
-            output += schedule_display
+        for i, cal in enumerate(chosen_cals):
+            if results is None:
+                output += schedule_view(
+                    cal, earliest_date, latest_date, summary_filters, cfg
+                )
+            else:
+                output += results[i].schedule_view
 
     if csv_export_file:
         csv_cfg = sub_cfg(cfg, "csv")
         csv_substitutions = sub_cfg(csv_cfg, "substitutions", {})
+        events_by_cal_id = None
+        if results is not None:
+            events_by_cal_id = {
+                cal.cal_id: [
+                    MonitoredEventData(start, summary, cal)
+                    for start, summary in r.events
+                ]
+                for cal, r in zip(chosen_cals, results)
+            }
         writer = ScheduleWriter(
             cals=chosen_cals,
             earliest_date=earliest_date,
             latest_date=latest_date,
             summary_filters=summary_filters,
+            events_by_cal_id=events_by_cal_id,
         )
         empty = sub_cfg(csv_cfg, "include_empty_dates", verbose, False)
         writer.csv_write(
@@ -970,4 +2759,156 @@ def main(
             csv_cfg=csv_cfg,
         )
 
+    if jsonl_export_file:
+        write_jsonl(
+            jsonl_export_file,
+            cals=chosen_cals,
+            earliest_date=earliest_date,
+            latest_date=latest_date,
+            summary_filters=summary_filters,
+            classification_rules=classification_rules,
+            part_files=jsonl_parts,
+        )
+
+    if parquet_dir:
+        for i, cal in enumerate(chosen_cals):
+            num_rows = (
+                export_parquet(cal, parquet_dir)
+                if results is None
+                else results[i].parquet_rows
+            )
+            if verbose:
+                print(f"\nExported {num_rows} Parquet row(s) for {cal.cal_id}.")
+
     print(output, end="")
+
+    if watch_interval:
+        if not any(c.schedule_feed is not None for c in chosen_cals):
+            print("Quitting- none of the chosen calendars has a feed to '--watch'.\n")
+            sys.exit(1)
+        try:
+            calendars_cfg = sub_cfg(cfg, "calendars", {})
+            poll_intervals = {
+                str(cal_id): parse_duration(cal_cfg["poll_interval"])
+                for cal_id, cal_cfg in calendars_cfg.items()
+                if "poll_interval" in cal_cfg
+            }
+            watch(
+                cals=chosen_cals,
+                interval=watch_interval,
+                poll_intervals=poll_intervals,
+                polling_cfg=sub_cfg(cfg, "polling"),
+                archive_cfg=archive_cfg,
+                earliest_date=earliest_date,
+                latest_date=latest_date,
+                summary_filters=summary_filters,
+                fmt_cfg=sub_cfg(fmt_cfg, "changelog"),
+            )
+        except KeyboardInterrupt:
+            pass
+
+    if serve_port:
+        try:
+            server.serve(
+                cals=chosen_cals,
+                port=serve_port,
+                serve_cfg=sub_cfg(cfg, "serve"),
+                earliest_date=earliest_date,
+                latest_date=latest_date,
+                summary_filters=summary_filters,
+                classification_rules=classification_rules,
+                verbose=verbose,
+            )
+        except KeyboardInterrupt:
+            pass
+
+    if event_store is not None:
+        event_store.close()
+
+
+def main(
+    cals_data: List[Tuple[str, str, str, str]],
+    cals_filter: Optional[List[str]] = None,
+    ics_dir=DEF_ICS_DIR,
+    download_option: bool = False,
+    show_schedule: bool = False,
+    show_changelog: bool = False,
+    csv_export_file: str = None,
+    earliest_date: Optional[date] = None,
+    latest_date: Optional[date] = None,
+    summary_filters: Optional[List[str]] = None,
+    num_changelogs=None,  # (for changelogs)
+    cfg=None,
+    verbose=0,
+    pack_option: bool = False,
+    reindex_option: bool = False,
+    compact_option: bool = False,
+    watch_interval: Optional[float] = None,
+    profile_option: bool = False,
+    profile_stats_file: Optional[str] = None,
+    metrics_file: Optional[str] = None,
+    memory_report_option: bool = False,
+    workers: int = 1,
+    rebuild_manifest_option: bool = False,
+    verify_manifest_option: bool = False,
+    migrate_layout_option: bool = False,
+    jsonl_export_file: Optional[str] = None,
+    parquet_dir: Optional[str] = None,
+    serve_port: Optional[int] = None,
+) -> None:
+
+    run_start = monotonic()
+    instrumented = profile_option or metrics_file or memory_report_option
+    if instrumented:
+        instrumentation.enable(
+            profile_cals=profile_stats_file is not None,
+            trace_memory=memory_report_option,
+        )
+
+    configure_schedule_cache(sub_cfg(cfg, "cache"))
+    cache_counters = schedule_cache.counters()
+
+    try:
+        run_actions(
+            cals_data=cals_data,
+            cals_filter=cals_filter,
+            ics_dir=ics_dir,
+            download_option=download_option,
+            show_schedule=show_schedule,
+            show_changelog=show_changelog,
+            csv_export_file=csv_export_file,
+            earliest_date=earliest_date,
+            latest_date=latest_date,
+            summary_filters=summary_filters,
+            num_changelogs=num_changelogs,
+            cfg=cfg,
+            verbose=verbose,
+            pack_option=pack_option,
+            reindex_option=reindex_option,
+            compact_option=compact_option,
+            watch_interval=watch_interval,
+            workers=workers,
+            rebuild_manifest_option=rebuild_manifest_option,
+            verify_manifest_option=verify_manifest_option,
+            migrate_layout_option=migrate_layout_option,
+            jsonl_export_file=jsonl_export_file,
+            parquet_dir=parquet_dir,
+            serve_port=serve_port,
+        )
+    finally:  # (so that a failed run, e.g. a download, is reported too)
+        if memory_report_option:  # (before tracing stops)
+            sys.stderr.write(instrumentation.memory_report())
+        if instrumented:
+            record_schedule_cache_counters(cache_counters)
+            instrumentation.disable()
+        if metrics_file:
+            write_metrics(metrics_file, instrumentation, monotonic() - run_start)
+        if profile_option:
+            sys.stderr.write(instrumentation.report())
+            sys.stderr.write(schedule_cache_report())
+            if profile_stats_file is not None:
+                cal_id = instrumentation.dump_slowest_profile(profile_stats_file)
+                if cal_id is not None:
+                    sys.stderr.write(
+                        f"cProfile stats for {cal_id} saved to {profile_stats_file}\n"
+                    )
@@ -0,0 +1,30 @@
+"""Deferred imports, to keep CLI startup fast.
+
+Heavy dependencies (icalendar, recurring_ical_events, pytz and
+urllib.request) are only needed once ics files are actually downloaded
+or parsed, and others (e.g., sqlite3 or cProfile) only by some options.
+lazy_import() returns a module whose code runs on first
+attribute access, so that paths like 'ionical -V', 'ionical -h' or an
+exit due to a config error never pay to load them.
+"""
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Return module name, to be loaded when first used."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent_name, _, child_name = name.rpartition(".")
+    if parent_name:  # bind it as an attribute, as an import statement would
+        setattr(sys.modules[parent_name], child_name, module)
+    return module
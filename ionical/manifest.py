@@ -0,0 +1,213 @@
+"""Optional manifest of the .ics files in an ics_dir.
+
+Listing a directory of many thousands of downloaded versions (and
+matching every name against the .ics filename pattern) is slow,
+especially on network filesystems.  When the manifest is enabled,
+ionical instead keeps a list of its loose .ics files, one JSON object
+per line:
+
+    {"cal_id": "112", "version": "20200527", "path": "112__20200527.ics",
+     "size": 60514, "sha1": "..."}
+
+Paths are relative to ics_dir.  Versions stored in pack files are not
+listed, since each pack has its own index (see ionical.archive).
+
+Changes are made in memory, then saved by rewriting the manifest
+atomically, so a reader never sees a partially written manifest.  Each
+save rereads the manifest (under a lock, where the platform supports
+one) and applies just this process's changes to it, so that processes
+saving at once (e.g., '-g' from cron while '--watch' runs) don't drop
+each other's entries.  The manifest can be checked against (or rebuilt
+from) the files on disk with '--verify-manifest' and
+'--rebuild-manifest'.
+"""
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # (e.g., on Windows, where saves aren't locked)
+    fcntl = None  # type: ignore
+
+DEF_MANIFEST_FN = "ionical_manifest.jsonl"
+HASH_CHUNK_SIZE = 1024 * 1024  # bytes
+
+# (cal_id, version stamp, path relative to ics_dir) of a file found on disk
+FoundFile = Tuple[str, str, str]
+
+
+class ManifestEntry(NamedTuple):
+    cal_id: str
+    version: str  # version stamp, e.g. 20200527 or 20200527T143000
+    path: str  # relative to ics_dir
+    size: int
+    sha1: str
+
+
+def file_sha1(path) -> str:
+    """SHA-1 of a file's contents, read a chunk at a time."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class Manifest:
+    """The loose .ics files of an ics_dir, by path."""
+
+    def __init__(self, ics_dir, filename: str = DEF_MANIFEST_FN):
+        self.ics_dir = Path(ics_dir)
+        self.path = self.ics_dir / filename
+        self.lock_path = self.ics_dir / f".{filename}.lock"
+        self._entries: Optional[Dict[str, ManifestEntry]] = None
+        self._paths_by_cal_id: Optional[Dict[str, List[str]]] = None
+        # Unsaved changes, by path (None for a removed entry)
+        self._changes: Dict[str, Optional[ManifestEntry]] = {}
+        self.dirty = False
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def _read(self) -> Dict[str, ManifestEntry]:
+        entries = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = ManifestEntry(**json.loads(line))
+                        entries[entry.path] = entry
+        return entries
+
+    def _write(self, entries: Dict[str, ManifestEntry]) -> None:
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+            for path in sorted(entries):
+                f.write(json.dumps(entries[path]._asdict()) + "\n")
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the manifest's lock (if the platform supports one)."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def entries(self) -> Dict[str, ManifestEntry]:
+        if self._entries is None:
+            self._entries = self._with_changes(self._read())
+        return self._entries
+
+    def _with_changes(
+        self, entries: Dict[str, ManifestEntry]
+    ) -> Dict[str, ManifestEntry]:
+        """Apply unsaved changes to entries (e.g., as reread from disk)."""
+        for path, entry in self._changes.items():
+            if entry is None:
+                entries.pop(path, None)
+            else:
+                entries[path] = entry
+        return entries
+
+    def _change(self, path: str, entry: Optional[ManifestEntry]) -> None:
+        if entry is None:
+            self.entries.pop(path, None)
+        else:
+            self.entries[path] = entry
+        self._changes[path] = entry
+        self._paths_by_cal_id = None
+        self.dirty = True
+
+    def entries_for(self, cal_id: str) -> List[ManifestEntry]:
+        if self._paths_by_cal_id is None:
+            self._paths_by_cal_id = {}
+            for entry in self.entries.values():
+                self._paths_by_cal_id.setdefault(entry.cal_id, []).append(entry.path)
+        return [self.entries[p] for p in self._paths_by_cal_id.get(cal_id, [])]
+
+    def reload(self) -> None:
+        """Reread the manifest when next needed (keeping unsaved changes)."""
+        self._entries, self._paths_by_cal_id = None, None
+
+    def add_file(self, cal_id: str, version: str, path) -> ManifestEntry:
+        """List (or relist) a file in ics_dir, as of its current contents."""
+        full_path = self.ics_dir / path
+        entry = ManifestEntry(
+            cal_id=str(cal_id),
+            version=version,
+            path=Path(path).as_posix(),
+            size=full_path.stat().st_size,
+            sha1=file_sha1(full_path),
+        )
+        self._change(entry.path, entry)
+        return entry
+
+    def set_entries_for(self, cal_id: str, entries: Iterable[ManifestEntry]) -> None:
+        """Replace a calendar's entries (e.g., with those from a worker)."""
+        for entry in self.entries_for(cal_id):
+            self._change(entry.path, None)
+        for entry in entries:
+            self._change(entry.path, entry)
+
+    def remove_file(self, path) -> None:
+        path = Path(path).as_posix()
+        if path in self.entries:
+            self._change(path, None)
+
+    def save(self) -> None:
+        """Apply unsaved changes to the manifest as saved (if any).
+
+        The manifest is reread, so that entries saved meanwhile by other
+        processes are kept, then rewritten atomically.
+        """
+        if not self.dirty:
+            return
+        with self._locked():
+            entries = self._with_changes(self._read())
+            self._write(entries)
+        self._entries, self._paths_by_cal_id = entries, None
+        self._changes = {}
+        self.dirty = False
+
+    def rebuild(self, found_files: Iterable[FoundFile]) -> int:
+        """Relist exactly the files found on disk; return how many."""
+        self._entries, self._paths_by_cal_id, self._changes = {}, None, {}
+        for cal_id, version, path in found_files:
+            self.add_file(cal_id, version, path)
+        with self._locked():
+            self._write(self.entries)
+        self._changes = {}
+        self.dirty = False
+        return len(self.entries)
+
+    def verify(self, found_files: Iterable[FoundFile]) -> List[str]:
+        """Compare the manifest with the files found on disk.
+
+        Returns a description of each discrepancy (none if in sync).
+        """
+        problems = []
+        found = {Path(path).as_posix(): (c, v) for c, v, path in found_files}
+        for path, entry in sorted(self.entries.items()):
+            if path not in found:
+                problems.append(f"Missing from disk: {path}")
+            elif found[path] != (entry.cal_id, entry.version):
+                problems.append(f"Listed under the wrong calendar/version: {path}")
+            elif (self.ics_dir / path).stat().st_size != entry.size:
+                problems.append(f"Size differs: {path}")
+            elif file_sha1(self.ics_dir / path) != entry.sha1:
+                problems.append(f"Contents differ: {path}")
+        for path in sorted(found):
+            if path not in self.entries:
+                problems.append(f"Not in manifest: {path}")
+        return problems
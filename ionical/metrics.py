@@ -0,0 +1,124 @@
+"""Machine-readable metrics for a run (see '--metrics').
+
+After a run (even one that fails, e.g. on a download), the values and
+stage times gathered by ionical.instrument are written to a file,
+either as JSON or (if the file name ends with .prom) in the Prometheus
+text format, as read by node_exporter's textfile collector.  The file
+is replaced atomically, so a collector never sees a partially written
+file.
+
+Per-calendar metrics:
+
+    download_bytes    size of the downloaded .ics data (after gunzipping)
+    download_seconds  time taken by the HTTP request
+    http_status       status of the last download (304 if not modified;
+                      0 if the request failed without an HTTP status)
+    parse_seconds     time spent parsing .ics versions
+    events            events in the calendar's most recent version
+    versions          versions found in ICS_DIR
+    changes           changes detected, over all versions compared (each
+                      pair of versions is counted once, however often it
+                      is compared)
+    schedule_cache_hits, schedule_cache_misses, schedule_cache_evictions
+                      lookups of parsed schedules (see ionical.cache); for a
+                      run without '--workers', these are reported for "*"
+
+Calendars that share a feed URL each get the download values of the
+feed's single download.
+"""
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict
+
+from ionical.instrument import ALL_CALS, Instrumentation
+
+PROMETHEUS_SUFFIX = ".prom"
+METRIC_PREFIX = "ionical_"
+
+# Stage whose span times are also reported as a per-calendar metric
+STAGE_METRICS = {"parse": "parse_seconds"}
+
+METRIC_HELP = {
+    "download_bytes": "Size of the downloaded ics data, in bytes.",
+    "download_seconds": "Time taken to download the ics data.",
+    "http_status": "HTTP status of the last download (0 if none).",
+    "parse_seconds": "Time spent parsing ics versions.",
+    "events": "Events in the most recent version.",
+    "versions": "Versions found in the ics directory.",
+    "changes": "Schedule changes detected.",
+    "schedule_cache_hits": "Parsed schedules found in the schedule cache.",
+    "schedule_cache_misses": "Schedules not found in the schedule cache.",
+    "schedule_cache_evictions": "Schedules evicted from the schedule cache.",
+}
+
+
+def run_metrics(instrumentation: Instrumentation, wall_seconds: float) -> Dict:
+    """Collect a run's metrics into a JSON-ready dict."""
+    calendars: Dict[str, Dict[str, float]] = {}
+    for (name, cal_id), value in instrumentation.values.items():
+        calendars.setdefault(cal_id, {})[name] = value
+    stages: Dict[str, Dict[str, float]] = {}
+    for (stage, cal_id), seconds in instrumentation.totals.items():
+        stages.setdefault(stage, {})[cal_id] = round(seconds, 6)
+        if stage in STAGE_METRICS and cal_id != ALL_CALS:
+            calendars.setdefault(cal_id, {})[STAGE_METRICS[stage]] = round(
+                seconds, 6
+            )
+    return {
+        "timestamp": round(time.time(), 3),
+        "wall_seconds": round(wall_seconds, 6),
+        "calendars": calendars,
+        "stages": stages,
+    }
+
+
+def _label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def prometheus_text(metrics: Dict) -> str:
+    """Format run_metrics output in the Prometheus text format."""
+    lines = [
+        f"# HELP {METRIC_PREFIX}run_timestamp_seconds When the run finished.",
+        f"# TYPE {METRIC_PREFIX}run_timestamp_seconds gauge",
+        f"{METRIC_PREFIX}run_timestamp_seconds {metrics['timestamp']}",
+        f"# HELP {METRIC_PREFIX}run_duration_seconds Wall time of the run.",
+        f"# TYPE {METRIC_PREFIX}run_duration_seconds gauge",
+        f"{METRIC_PREFIX}run_duration_seconds {metrics['wall_seconds']}",
+    ]
+    names = sorted({n for values in metrics["calendars"].values() for n in values})
+    for name in names:
+        metric = METRIC_PREFIX + name
+        lines.append(f"# HELP {metric} {METRIC_HELP.get(name, name)}")
+        lines.append(f"# TYPE {metric} gauge")
+        for cal_id, values in sorted(metrics["calendars"].items()):
+            if name in values:
+                lines.append(
+                    f'{metric}{{cal_id="{_label_value(cal_id)}"}} {values[name]}'
+                )
+    metric = METRIC_PREFIX + "stage_seconds"
+    lines.append(f"# HELP {metric} Time spent in each stage (stages may nest).")
+    lines.append(f"# TYPE {metric} gauge")
+    for stage, by_cal in metrics["stages"].items():
+        for cal_id, seconds in sorted(by_cal.items()):
+            labels = f'stage="{stage}",cal_id="{_label_value(cal_id)}"'
+            lines.append(f"{metric}{{{labels}}} {seconds}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(
+    metrics_file, instrumentation: Instrumentation, wall_seconds: float
+) -> None:
+    """Write a run's metrics as JSON or (for *.prom files) Prometheus text."""
+    path = Path(metrics_file)
+    metrics = run_metrics(instrumentation, wall_seconds)
+    if path.suffix == PROMETHEUS_SUFFIX:
+        text = prometheus_text(metrics)
+    else:
+        text = json.dumps(metrics, indent=2, sort_keys=True) + "\n"
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,103 @@
+"""Retention policy for archived schedule versions.
+
+Versions are thinned with age: every version is kept for a while, then
+only the last version of each day, then of each ISO week, then of each
+month.  With the default policy:
+
+    all      0 days     (every version, including sub-daily ones)
+    daily    90 days    (the last version of each day)
+    weekly   730 days   (the last version of each week)
+    monthly  no limit   (the last version of each month)
+
+Versions older than the monthly window (if one is set) are dropped
+entirely.  The most recent version is always kept.
+"""
+from datetime import date, datetime
+from typing import Hashable, Iterable, List, Optional, Set
+
+from ionical.scheduler import parse_duration
+
+DEF_KEEP_ALL_DAYS = 0
+DEF_DAILY_DAYS = 90
+DEF_WEEKLY_DAYS = 730
+DEF_MONTHLY_DAYS = None  # keep monthly versions forever
+
+SECONDS_PER_DAY = 86400
+
+
+def _days(value) -> Optional[float]:
+    """Convert a config duration (e.g., 90, "13w" or "2y") to days."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)  # (a number in a string, e.g. "90", is days too)
+    except ValueError:
+        return parse_duration(value) / SECONDS_PER_DAY
+
+
+class RetentionPolicy:
+    """Decide which of a calendar's versions to keep."""
+
+    def __init__(
+        self,
+        keep_all_days: float = DEF_KEEP_ALL_DAYS,
+        daily_days: float = DEF_DAILY_DAYS,
+        weekly_days: float = DEF_WEEKLY_DAYS,
+        monthly_days: Optional[float] = DEF_MONTHLY_DAYS,
+    ):
+        """Each window is a number of days back from today."""
+        self.keep_all_days = keep_all_days
+        self.daily_days = daily_days
+        self.weekly_days = weekly_days
+        self.monthly_days = monthly_days
+
+    @classmethod
+    def from_cfg(cls, retention_cfg=None) -> "RetentionPolicy":
+        """Build a policy from a [retention] config section.
+
+        Plain numbers (even quoted, e.g. "90") are days; strings may
+        use units as for polling intervals (e.g., "90d", "13w", "2y").
+        """
+        retention_cfg = {} if retention_cfg is None else retention_cfg
+        return cls(
+            keep_all_days=_days(retention_cfg.get("all", DEF_KEEP_ALL_DAYS)),
+            daily_days=_days(retention_cfg.get("daily", DEF_DAILY_DAYS)),
+            weekly_days=_days(retention_cfg.get("weekly", DEF_WEEKLY_DAYS)),
+            monthly_days=_days(retention_cfg.get("monthly", DEF_MONTHLY_DAYS)),
+        )
+
+    def bucket(self, version_date: date, today: date) -> Optional[Hashable]:
+        """Versions sharing a bucket are thinned to the last of them.
+
+        Returns None for a version old enough to be dropped entirely.
+        """
+        day = version_date
+        if isinstance(version_date, datetime):
+            day = version_date.date()
+        age = (today - day).days
+        if age < self.keep_all_days:
+            return ("all", version_date)
+        if age < self.daily_days:
+            return ("day", day)
+        if age < self.weekly_days:
+            return ("week", tuple(day.isocalendar()[:2]))
+        if self.monthly_days is None or age < self.monthly_days:
+            return ("month", day.year, day.month)
+        return None
+
+    def versions_to_keep(
+        self, version_dates: Iterable[date], today: Optional[date] = None
+    ) -> Set[date]:
+        """Select the versions to keep from an ordered list of versions."""
+        today = date.today() if today is None else today
+        ordered: List[date] = list(version_dates)
+        keep: Set[date] = set(ordered[-1:])
+        last_in_bucket = {}
+        for version_date in ordered:
+            bucket = self.bucket(version_date, today)
+            if bucket is not None:
+                last_in_bucket[bucket] = version_date
+        keep.update(last_in_bucket.values())
+        return keep
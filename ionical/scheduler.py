@@ -0,0 +1,201 @@
+"""Polling schedule for calendar feeds.
+
+Each feed is polled on its own interval.  A failed poll is retried
+after an exponentially growing, jittered delay (never longer than the
+feed's regular interval), and requests to any one host are limited in
+both concurrency and rate, so that many feeds served from a shared
+vendor host don't all hit it at once.
+"""
+import random
+import threading
+from contextlib import contextmanager
+from time import monotonic, sleep
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+DEF_POLL_INTERVAL = 3600.0  # seconds
+DEF_MAX_PER_HOST = 2  # concurrent requests
+DEF_PER_HOST_PER_MINUTE = 30  # requests
+DEF_BACKOFF_BASE = 60.0  # seconds
+DEF_MAX_BACKOFF = 6 * 3600.0  # seconds
+DEF_JITTER = 0.5  # fraction of each backoff delay that is randomized
+
+DURATION_UNITS = {
+    "s": 1,
+    "m": 60,
+    "h": 3600,
+    "d": 86400,
+    "w": 7 * 86400,
+    "y": 365 * 86400,
+}
+
+
+def parse_duration(value) -> float:
+    """Convert a number of seconds, or a string like "90s", "1h" or "7d"."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = value.strip().lower()
+    if value and value[-1] in DURATION_UNITS:
+        return float(value[:-1]) * DURATION_UNITS[value[-1]]
+    return float(value)
+
+
+class HostLimiter:
+    """Limit concurrency and request rate separately for each host."""
+
+    def __init__(
+        self,
+        max_per_host: int = DEF_MAX_PER_HOST,
+        per_host_per_minute: Optional[float] = DEF_PER_HOST_PER_MINUTE,
+    ):
+        self.max_per_host = max_per_host
+        self.min_spacing = 60.0 / per_host_per_minute if per_host_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._next_start: Dict[str, float] = {}
+
+    @contextmanager
+    def slot(self, url: str) -> Iterator[None]:
+        """Wait for (and hold, while in context) a request slot for url's host."""
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            semaphore = self._semaphores[host]
+            now = monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.min_spacing
+        if start > now:
+            sleep(start - now)
+        with semaphore:
+            yield
+
+
+class FeedPollState:
+    """When a feed is next due, and how its recent polls went."""
+
+    def __init__(self, key: str, url: str, interval: float):
+        self.key = key
+        self.url = url
+        self.interval = interval
+        self.next_due = 0.0  # due immediately
+        self.consecutive_failures = 0
+        self.last_error: Optional[Exception] = None
+
+
+class PollScheduler:
+    """Decide which feeds are due, and poll them within host limits."""
+
+    def __init__(
+        self,
+        feeds: Iterable[Tuple[str, str, Optional[float]]],
+        default_interval: float = DEF_POLL_INTERVAL,
+        backoff_base: float = DEF_BACKOFF_BASE,
+        max_backoff: float = DEF_MAX_BACKOFF,
+        jitter: float = DEF_JITTER,
+        host_limiter: Optional[HostLimiter] = None,
+    ):
+        """feeds holds (key, url, poll interval or None for default)."""
+        self.states: Dict[str, FeedPollState] = {
+            key: FeedPollState(
+                key, url, default_interval if interval is None else interval
+            )
+            for key, url, interval in feeds
+        }
+        self.default_interval = default_interval
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.host_limiter = HostLimiter() if host_limiter is None else host_limiter
+
+    @classmethod
+    def from_cfg(
+        cls,
+        feeds: Iterable[Tuple[str, str, Optional[float]]],
+        polling_cfg=None,
+        default_interval: Optional[float] = None,
+    ) -> "PollScheduler":
+        """Build a scheduler using settings from a [polling] config section."""
+        polling_cfg = {} if polling_cfg is None else polling_cfg
+        if default_interval is None:
+            default_interval = polling_cfg.get("default_interval", DEF_POLL_INTERVAL)
+        return cls(
+            feeds=feeds,
+            default_interval=parse_duration(default_interval),
+            backoff_base=parse_duration(
+                polling_cfg.get("backoff_base", DEF_BACKOFF_BASE)
+            ),
+            max_backoff=parse_duration(polling_cfg.get("max_backoff", DEF_MAX_BACKOFF)),
+            jitter=polling_cfg.get("jitter", DEF_JITTER),
+            host_limiter=HostLimiter(
+                max_per_host=polling_cfg.get("max_per_host", DEF_MAX_PER_HOST),
+                per_host_per_minute=polling_cfg.get(
+                    "per_host_per_minute", DEF_PER_HOST_PER_MINUTE
+                ),
+            ),
+        )
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        now = monotonic() if now is None else now
+        return [key for key, state in self.states.items() if state.next_due <= now]
+
+    def seconds_until_next_due(self, now: Optional[float] = None) -> float:
+        if not self.states:  # (nothing will ever be due)
+            return self.default_interval
+        now = monotonic() if now is None else now
+        next_due = min(s.next_due for s in self.states.values())
+        return max(0.0, next_due - now)
+
+    def record_success(self, key: str, now: Optional[float] = None) -> None:
+        state = self.states[key]
+        state.consecutive_failures, state.last_error = 0, None
+        state.next_due = (monotonic() if now is None else now) + state.interval
+
+    def record_failure(
+        self, key: str, error: Exception, now: Optional[float] = None
+    ) -> float:
+        """Schedule a retry with jittered exponential backoff; return its delay."""
+        state = self.states[key]
+        state.consecutive_failures += 1
+        state.last_error = error
+        delay = min(
+            self.backoff_base * 2 ** (state.consecutive_failures - 1),
+            self.max_backoff,
+            state.interval,
+        )
+        delay -= random.uniform(0, self.jitter * delay)
+        state.next_due = (monotonic() if now is None else now) + delay
+        return delay
+
+    def poll_due(
+        self,
+        poll: Callable[[str], object],
+        keys: Optional[List[str]] = None,
+        max_workers: int = 8,
+    ) -> Dict:
+        """Poll every due feed (concurrently, within host limits).
+
+        If keys is given, it is used as the list of due feeds.  Returns
+        {key: result of poll(key)} for the feeds that succeeded.
+        Exceptions raised by poll are recorded as failures.
+        """
+        due = self.due() if keys is None else keys
+        if not due:
+            return {}
+        from concurrent.futures import ThreadPoolExecutor  # (only for '--watch')
+
+        def limited_poll(key):
+            with self.host_limiter.slot(self.states[key].url):
+                return poll(key)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(due)))) as ex:
+            futures = {key: ex.submit(limited_poll, key) for key in due}
+            for key, future in futures.items():
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    self.record_failure(key, e)
+                else:
+                    self.record_success(key)
+        return results
@@ -0,0 +1,247 @@
+"""Local HTTP service answering JSON queries (see '--serve').
+
+Tools that only need one calendar's schedule or recent changes can ask
+a running service, instead of starting ionical (and parsing .ics files)
+for every query.  The service loads the chosen calendars once, keeps
+their schedule histories in memory (with parsed schedules in
+schedule_cache), and answers:
+
+    GET /calendars
+        each calendar's cal_id, name, number of versions and latest
+        version
+    GET /schedule/<cal_id>?from=YYYY-MM-DD&to=YYYY-MM-DD&q=TEXT
+        events of the calendar's most recent version, as records like
+        those of '--jsonl'
+    GET /changes/<cal_id>?n=N&from=YYYY-MM-DD&to=YYYY-MM-DD&q=TEXT
+        changes found in the calendar's N most recent versions
+
+cal_ids are URL-quoted (e.g., /schedule/Gilliam%2C%20Terry).  q may be
+repeated; an event matches if its summary includes any of them.  A
+parameter left out takes its value from the command line or config
+file filters; one left empty (e.g., "from=") means no limit.
+
+Versions saved to ics_dir while the service runs (e.g., by 'ionical -g'
+from cron, or by '--watch' in another process) are picked up by
+rescanning a calendar's versions when it is queried, at most once every
+rescan_interval seconds.  Only new versions are then added; schedules
+already parsed stay cached.
+
+    [serve]
+        host            = "127.0.0.1"
+        rescan_interval = 5
+
+Requests are answered one at a time, in a single thread.
+"""
+import json
+from datetime import date
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from ionical.ionical import Cal, change_jsonl_records, event_jsonl_records
+from ionical.ionical import sub_cfg, version_stamp
+from ionical.scheduler import parse_duration
+
+DEF_HOST = "127.0.0.1"
+DEF_RESCAN_INTERVAL = 5.0  # seconds
+DEF_NUM_CHANGE_VERSIONS = 2
+
+Filters = Tuple[Optional[date], Optional[date], Optional[List[str]]]
+
+
+class QueryError(Exception):
+    """A query that can't be answered, with the HTTP status for the reply."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ScheduleService:
+    """Answer queries about cals from their schedule histories, kept warm."""
+
+    def __init__(
+        self,
+        cals: List[Cal],
+        rescan_interval: float = DEF_RESCAN_INTERVAL,
+        earliest_date: Optional[date] = None,
+        latest_date: Optional[date] = None,
+        summary_filters: Optional[List[str]] = None,
+        classification_rules=None,
+    ):
+        self.cals_by_id = {str(cal.cal_id): cal for cal in cals}
+        self.rescan_interval = rescan_interval
+        self.default_filters: Filters = (earliest_date, latest_date, summary_filters)
+        self.classification_rules = classification_rules
+        self._scanned: Dict[str, float] = {}  # {cal_id: monotonic() of last scan}
+
+    def warm(self) -> None:
+        """Load each calendar's history, and parse the versions queried by default.
+
+        (That is, its most recent version, and those compared by /changes.)
+        """
+        for cal_id in self.cals_by_id:
+            hx = self._cal(cal_id).schedule_history
+            for version_date in hx.version_dates[-(DEF_NUM_CHANGE_VERSIONS + 1) :]:
+                hx.schedule_for_date(version_date)
+
+    def _cal(self, cal_id: str) -> Cal:
+        """Look up a Cal, rescanning its versions if they may be stale."""
+        cal = self.cals_by_id.get(cal_id)
+        if cal is None:
+            raise QueryError(404, f"Unknown calendar: {cal_id}")
+        now = monotonic()
+        last_scan = self._scanned.get(cal_id)
+        if last_scan is None or now - last_scan >= self.rescan_interval:
+            if last_scan is not None:
+                cal.schedule_history.refresh()
+            self._scanned[cal_id] = now
+        return cal
+
+    def _latest_version(self, cal: Cal) -> date:
+        version_dates = cal.schedule_history.version_dates
+        if not version_dates:
+            raise QueryError(404, f"No ics versions found for calendar: {cal.cal_id}")
+        return version_dates[-1]
+
+    @staticmethod
+    def _date_param(params: Dict[str, List[str]], name: str, default):
+        if name not in params:
+            return default
+        value = params[name][-1]
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise QueryError(400, f"Not a valid date for '{name}': '{value}'.")
+
+    def _filters(self, params: Dict[str, List[str]]) -> Filters:
+        earliest_date, latest_date, summary_filters = self.default_filters
+        if "q" in params:
+            summary_filters = [q for q in params["q"] if q] or None
+        return (
+            self._date_param(params, "from", earliest_date),
+            self._date_param(params, "to", latest_date),
+            summary_filters,
+        )
+
+    def calendars(self) -> Dict:
+        listing = []
+        for cal_id, cal in self.cals_by_id.items():
+            version_dates = self._cal(cal_id).schedule_history.version_dates
+            listing.append(
+                {
+                    "cal_id": cal_id,
+                    "name": cal.name,
+                    "versions": len(version_dates),
+                    "latest_version": (
+                        version_stamp(version_dates[-1]) if version_dates else None
+                    ),
+                }
+            )
+        return {"calendars": listing}
+
+    def schedule(self, cal_id: str, params: Dict[str, List[str]]) -> Dict:
+        cal = self._cal(cal_id)
+        version_date = self._latest_version(cal)
+        events = event_jsonl_records(
+            cal, *self._filters(params), self.classification_rules
+        )
+        return {
+            "cal_id": cal_id,
+            "version": version_stamp(version_date),
+            "events": list(events),
+        }
+
+    def changes(self, cal_id: str, params: Dict[str, List[str]]) -> Dict:
+        cal = self._cal(cal_id)
+        version_date = self._latest_version(cal)
+        n = params.get("n", [str(DEF_NUM_CHANGE_VERSIONS)])[-1]
+        if not n.isdigit():
+            raise QueryError(400, f"Not a valid number of versions for 'n': '{n}'.")
+        changes = change_jsonl_records(cal, *self._filters(params), int(n))
+        return {
+            "cal_id": cal_id,
+            "version": version_stamp(version_date),
+            "changes": list(changes),
+        }
+
+    def handle(self, target: str) -> Tuple[int, Dict]:
+        """Answer a GET of target (a path and query); return (status, body)."""
+        url = urlsplit(target)
+        params = parse_qs(url.query, keep_blank_values=True)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        try:
+            if parts == ["calendars"]:
+                return 200, self.calendars()
+            if len(parts) == 2 and parts[0] == "schedule":
+                return 200, self.schedule(parts[1], params)
+            if len(parts) == 2 and parts[0] == "changes":
+                return 200, self.changes(parts[1], params)
+            raise QueryError(404, f"Not found: {url.path}")
+        except QueryError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:  # (keep serving other queries)
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    server: "ScheduleServer"
+
+    def do_GET(self) -> None:
+        status, body = self.server.service.handle(self.path)
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose > 1:
+            super().log_message(format, *args)
+
+
+class ScheduleServer(HTTPServer):
+    """HTTP server for a ScheduleService (port 0 picks a free port)."""
+
+    def __init__(
+        self, service: ScheduleService, host: str = DEF_HOST, port: int = 0, verbose=0
+    ):
+        self.service = service
+        self.verbose = verbose
+        super().__init__((host, port), _QueryHandler)
+
+
+def serve(
+    cals: List[Cal],
+    port: int,
+    serve_cfg=None,
+    earliest_date: Optional[date] = None,
+    latest_date: Optional[date] = None,
+    summary_filters: Optional[List[str]] = None,
+    classification_rules=None,
+    verbose=0,
+) -> None:
+    """Answer queries about cals until interrupted (e.g., by Ctrl-C)."""
+    service = ScheduleService(
+        cals,
+        rescan_interval=parse_duration(
+            sub_cfg(serve_cfg, "rescan_interval", DEF_RESCAN_INTERVAL)
+        ),
+        earliest_date=earliest_date,
+        latest_date=latest_date,
+        summary_filters=summary_filters,
+        classification_rules=classification_rules,
+    )
+    service.warm()
+    host = sub_cfg(serve_cfg, "host", DEF_HOST)
+    with ScheduleServer(service, host=host, port=port, verbose=verbose) as server:
+        print(
+            f"\nServing {len(cals)} calendar(s) at "
+            f"http://{host}:{server.server_address[1]}/  (Ctrl-C to stop)",
+            flush=True,
+        )
+        server.serve_forever()
@@ -0,0 +1,214 @@
+"""Optional SQLite store of event history.
+
+Events are recorded per (cal_id, version) as versions are ingested, so
+that schedules and changelogs can be answered by indexed queries rather
+than by re-parsing .ics files.  Only what ionical monitors is stored:
+each event's start and summary.
+
+Event starts are stored as ISO strings, alongside a comparison key in
+which timezone-aware datetimes are normalized to UTC.  Two events
+compare equal in SQL exactly when the corresponding MonitoredEventData
+objects would.
+"""
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union, TYPE_CHECKING
+
+from ionical.lazy import lazy_import
+
+if TYPE_CHECKING:
+    import sqlite3
+else:  # only needed once a store is opened
+    sqlite3 = lazy_import("sqlite3")
+
+DEF_STORE_FN = "ionical_history.sqlite"
+# Seconds to wait for another connection's write (e.g., a worker's) to finish
+BUSY_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    cal_id      TEXT NOT NULL,
+    version     TEXT NOT NULL,  -- version stamp, e.g. 20200527
+    num_events  INTEGER NOT NULL,
+    ingested    INTEGER NOT NULL DEFAULT 0,  -- time.time_ns() when (re)recorded
+    PRIMARY KEY (cal_id, version)
+);
+CREATE TABLE IF NOT EXISTS events (
+    cal_id      TEXT NOT NULL,
+    version     TEXT NOT NULL,
+    start       TEXT NOT NULL,  -- ISO date or datetime, as found in the ics
+    start_key   TEXT NOT NULL,  -- start, with aware datetimes put in UTC
+    start_date  TEXT NOT NULL,  -- YYYY-MM-DD, as in MonitoredEventData.forced_date
+    summary     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_version
+    ON events (cal_id, version, start_key, summary);
+CREATE INDEX IF NOT EXISTS events_by_start_date ON events (start_date, cal_id);
+CREATE INDEX IF NOT EXISTS events_by_summary ON events (summary, cal_id);
+"""
+
+DateOrDatetime = Union[date, datetime]
+
+# (start, summary) pairs, as returned by queries
+EventRecord = Tuple[DateOrDatetime, str]
+
+
+def encode_start(value: DateOrDatetime) -> Tuple[str, str, str]:
+    """Return (start, start_key, start_date) strings for an event start."""
+    start = value.isoformat()
+    start_key = start
+    if isinstance(value, datetime):
+        if value.utcoffset() is not None:
+            start_key = value.astimezone(timezone.utc).isoformat()
+        start_date = value.date().isoformat()
+    else:
+        start_date = start
+    return start, start_key, start_date
+
+
+def decode_start(start: str) -> DateOrDatetime:
+    if "T" in start:
+        return datetime.fromisoformat(start)
+    return date.fromisoformat(start)
+
+
+class EventStore:
+    """Per-version event records for many calendars, in one SQLite file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.connection = sqlite3.connect(str(self.path), timeout=BUSY_TIMEOUT)
+        # Write-ahead logging lets workers write while others read
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(versions)")
+        ]
+        if "ingested" not in columns:  # (a store made before it was recorded)
+            with self.connection:
+                self.connection.execute(
+                    "ALTER TABLE versions"
+                    " ADD COLUMN ingested INTEGER NOT NULL DEFAULT 0"
+                )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def versions(self, cal_id: str) -> List[str]:
+        rows = self.connection.execute(
+            "SELECT version FROM versions WHERE cal_id = ? ORDER BY version",
+            (cal_id,),
+        )
+        return [version for (version,) in rows]
+
+    def has_version(self, cal_id: str, version: str) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM versions WHERE cal_id = ? AND version = ?",
+            (cal_id, version),
+        ).fetchone()
+        return row is not None
+
+    def ingested(self, cal_id: str, version: str) -> Optional[int]:
+        """When a version was last (re)recorded, in time.time_ns() units."""
+        row = self.connection.execute(
+            "SELECT ingested FROM versions WHERE cal_id = ? AND version = ?",
+            (cal_id, version),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def add_version(
+        self, cal_id: str, version: str, events: Iterable[EventRecord]
+    ) -> None:
+        """Record (or re-record) the events of one calendar version."""
+        rows = [
+            (cal_id, version, *encode_start(start), str(summary))
+            for start, summary in events
+        ]
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM events WHERE cal_id = ? AND version = ?",
+                (cal_id, version),
+            )
+            self.connection.executemany(
+                "INSERT INTO events (cal_id, version, start, start_key,"
+                " start_date, summary) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO versions (cal_id, version, num_events,"
+                " ingested) VALUES (?, ?, ?, ?)",
+                (cal_id, version, len(rows), time.time_ns()),
+            )
+
+    def remove_version(self, cal_id: str, version: str) -> None:
+        with self.connection:
+            for table in ("events", "versions"):
+                self.connection.execute(
+                    f"DELETE FROM {table} WHERE cal_id = ? AND version = ?",
+                    (cal_id, version),
+                )
+
+    def events(
+        self,
+        cal_id: str,
+        version: str,
+        earliest_date: Optional[date] = None,
+        latest_date: Optional[date] = None,
+        summary_filters: Optional[List[str]] = None,
+    ) -> List[EventRecord]:
+        """Get a version's events, optionally filtered as in Schedule."""
+        sql = "SELECT start, summary FROM events WHERE cal_id = ? AND version = ?"
+        params: list = [cal_id, version]
+        if earliest_date:
+            sql += " AND start_date >= ?"
+            params.append(earliest_date.isoformat())
+        if latest_date:
+            sql += " AND start_date <= ?"
+            params.append(latest_date.isoformat())
+        if summary_filters:
+            matches = ["instr(summary, ?) > 0"] * len(summary_filters)
+            sql += " AND (" + " OR ".join(matches) + ")"
+            params.extend(summary_filters)
+        rows = self.connection.execute(sql, params)
+        return [(decode_start(start), summary) for start, summary in rows]
+
+    def changes(
+        self, cal_id: str, version: str, comparison_version: str
+    ) -> Tuple[List[EventRecord], List[EventRecord]]:
+        """Return (additions, removals) between two versions of a calendar."""
+        sql = """
+            SELECT start, summary FROM events AS e
+            WHERE e.cal_id = ? AND e.version = ? AND NOT EXISTS (
+                SELECT 1 FROM events AS o
+                WHERE o.cal_id = e.cal_id AND o.version = ?
+                  AND o.start_key = e.start_key AND o.summary = e.summary
+            )
+        """
+
+        def difference(version_a, version_b) -> List[EventRecord]:
+            rows = self.connection.execute(sql, (cal_id, version_a, version_b))
+            return [(decode_start(start), summary) for start, summary in rows]
+
+        return (
+            difference(version, comparison_version),
+            difference(comparison_version, version),
+        )
+
+    def versions_with_event(
+        self,
+        summary: str,
+        cal_id: Optional[str] = None,
+        start: Optional[DateOrDatetime] = None,
+    ) -> List[Tuple[str, str]]:
+        """List (cal_id, version) pairs in which a given event existed."""
+        sql = "SELECT DISTINCT cal_id, version FROM events WHERE summary = ?"
+        params: list = [summary]
+        if cal_id is not None:
+            sql += " AND cal_id = ?"
+            params.append(cal_id)
+        if start is not None:
+            sql += " AND start_key = ?"
+            params.append(encode_start(start)[1])
+        sql += " ORDER BY cal_id, version"
+        return list(self.connection.execute(sql, params))
@@ -24,7 +24,7 @@ with open("requirements-test.txt") as test_requirements_file:
     test_requirements = test_requirements_file.read().splitlines()
     dev_requirements.extend(test_requirements)
 
-found_packages = find_packages()
+found_packages = find_packages(exclude=["benchmarks", "tests"])
 print(f"FINDPACKAGES: {found_packages}")
 
 setup(
@@ -42,13 +42,21 @@ setup(
     license="MIT",
     zip_safe=False,
     keywords="icalendar, ics, schedule, changelog, amion, gcal, google, calendar",
+    python_requires=">=3.9",
     classifiers=[
         "Natural Language :: English",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
     ],
     extras_require={
         "dev": dev_requirements,
         "test": test_requirements,
+        "zstd": ["zstandard"],
+        "parquet": ["pyarrow"],
     },
     entry_points={
         "console_scripts": ["ionical=ionical.__main__:cli"],
@@ -0,0 +1 @@
+"""Tests for ionical, with fixtures its benchmarks share (run from the repo root)."""
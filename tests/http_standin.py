@@ -0,0 +1,155 @@
+"""Local HTTP stand-in for calendar feed servers.
+
+Serves ics bodies from memory, at http://127.0.0.1:<port>/<name>.ics,
+with configurable behaviour:
+
+    latency       seconds to wait before responding
+    bandwidth     bytes per second (None for no limit)
+    gzip          compress responses when the client accepts gzip
+    etag          send ETags, and answer matching If-None-Match with 304
+    failure_rate  fraction of requests answered with a 503 or dropped
+
+Bodies may be replaced while the server runs (see StandInServer.set_body),
+which changes their ETags.
+"""
+import gzip
+import hashlib
+import random
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from typing import Dict, Optional
+
+CHUNK_SIZE = 16 * 1024  # bytes written at a time when limiting bandwidth
+
+
+class StandInServer:
+    """A threaded feed server; use as a context manager."""
+
+    def __init__(
+        self,
+        bodies: Optional[Dict[str, bytes]] = None,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        gzip: bool = False,
+        etag: bool = False,
+        failure_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.bodies: Dict[str, bytes] = {}
+        self._compressed: Dict[str, bytes] = {}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.gzip = gzip
+        self.etag = etag
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.not_modified = 0
+        self.failures = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        for name, body in (bodies or {}).items():
+            self.set_body(name, body)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _handler_for(self))
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    def set_body(self, name: str, body: bytes) -> None:
+        with self._lock:
+            self.bodies[name] = body
+            self._compressed.pop(name, None)
+
+    def url_for(self, name: str) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{name}.ics"
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _count(self, **increments: int) -> None:
+        with self._lock:
+            for counter, n in increments.items():
+                setattr(self, counter, getattr(self, counter) + n)
+
+    def _response_for(self, name: str, accepts_gzip: bool):
+        """Return (body, etag, encoding) for a feed, or None if unknown."""
+        with self._lock:
+            body = self.bodies.get(name)
+            if body is None:
+                return None
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if not (self.gzip and accepts_gzip):
+                return body, etag, None
+            if name not in self._compressed:
+                self._compressed[name] = gzip.compress(body)
+            return self._compressed[name], etag, "gzip"
+
+
+def _handler_for(server: StandInServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):  # keep benchmark output quiet
+            pass
+
+        def do_GET(self):
+            server._count(requests=1)
+            if server.latency:
+                sleep(server.latency)
+            if server.failure_rate and server.random.random() < server.failure_rate:
+                server._count(failures=1)
+                if server.random.random() < 0.5:
+                    self.send_error(503, "Injected failure")
+                else:  # drop the connection without a response
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    self.close_connection = True
+                return
+            name = self.path.lstrip("/").rsplit(".ics", 1)[0]
+            accepts_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+            response = server._response_for(name, accepts_gzip)
+            if response is None:
+                self.send_error(404)
+                return
+            body, etag, encoding = response
+            if server.etag and self.headers.get("If-None-Match") == etag:
+                server._count(not_modified=1)
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/calendar; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            if server.etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self._write_limited(body)
+            server._count(bytes_sent=len(body))
+
+        def _write_limited(self, body: bytes) -> None:
+            if not server.bandwidth:
+                self.wfile.write(body)
+                return
+            for i in range(0, len(body), CHUNK_SIZE):
+                chunk = body[i : i + CHUNK_SIZE]
+                self.wfile.write(chunk)
+                sleep(len(chunk) / server.bandwidth)
+
+    return Handler
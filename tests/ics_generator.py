@@ -0,0 +1,165 @@
+"""Synthetic ics workloads for benchmarking.
+
+Generated calendars look like the amion feeds ionical is mostly used
+with: mostly single events, some repeating (RRULE) ones, and a
+DTSTAMP that changes in every event with every version.  Successive
+versions of a calendar differ by a configurable churn rate (the
+fraction of events removed and replaced by new ones).
+"""
+import random
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from ionical.ionical import version_stamp
+
+SUMMARIES = [
+    "AM: IHS Continuity Clinic",
+    "PM: IHS Continuity Clinic",
+    "MICU VA",
+    "MK Support",
+    "Night Float",
+    "Wards Gold",
+    "Wards Purple",
+    "Consults",
+    "Jeopardy",
+    "Admin Time",
+]
+START_HOURS = [7, 8, 13, 17, 19]
+DEF_FIRST_DATE = date(2020, 1, 6)
+
+
+class Workload(NamedTuple):
+    """Parameters of a synthetic workload."""
+
+    num_cals: int = 5
+    events_per_cal: int = 150
+    num_versions: int = 5
+    rrule_density: float = 0.1  # fraction of events that repeat
+    timezones: Sequence[str] = ("US/Mountain", "US/Eastern")
+    churn_rate: float = 0.05  # fraction of events replaced per version
+    seed: int = 0
+
+
+class SyntheticEvent(NamedTuple):
+    uid: str
+    start: date  # a date (all day event) or datetime (in UTC)
+    summary: str
+    rrule: Optional[str] = None
+
+
+def random_event(rng: random.Random, uid: str, rrule_density: float) -> SyntheticEvent:
+    day = DEF_FIRST_DATE + timedelta(days=rng.randrange(365))
+    start: date = day
+    if rng.random() < 0.7:  # timed, rather than all day
+        start = datetime.combine(day, datetime.min.time()).replace(
+            hour=rng.choice(START_HOURS)
+        )
+    rrule = None
+    if rng.random() < rrule_density:
+        count, interval = rng.randint(2, 28), rng.choice([1, 7])
+        rrule = f"FREQ=DAILY;COUNT={count};INTERVAL={interval}"
+    return SyntheticEvent(uid, start, rng.choice(SUMMARIES), rrule)
+
+
+def initial_events(
+    rng: random.Random, cal_num: int, num_events: int, rrule_density: float
+) -> List[SyntheticEvent]:
+    return [
+        random_event(rng, f"{cal_num}++{i}@synthetic.test", rrule_density)
+        for i in range(num_events)
+    ]
+
+
+def churned(
+    rng: random.Random,
+    events: List[SyntheticEvent],
+    churn_rate: float,
+    rrule_density: float,
+    next_uid: int,
+) -> Tuple[List[SyntheticEvent], int]:
+    """Replace churn_rate of the events with new ones.
+
+    Returns the new event list and the next unused uid number.
+    """
+    events = list(events)
+    for i in rng.sample(range(len(events)), int(round(len(events) * churn_rate))):
+        prefix = events[i].uid.split("++")[0]
+        events[i] = random_event(
+            rng, f"{prefix}++{next_uid}@synthetic.test", rrule_density
+        )
+        next_uid += 1
+    return events, next_uid
+
+
+def ics_text(events: List[SyntheticEvent], stamp: datetime, timezone: str) -> str:
+    """Format events as ics text (with CRLF line endings)."""
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//ionical//Synthetic Workload//EN",
+        f"X-WR-TIMEZONE:{timezone}",
+    ]
+    for event in events:
+        lines.append("BEGIN:VEVENT")
+        if isinstance(event.start, datetime):
+            end = event.start + timedelta(hours=4)
+            lines.append(f"DTSTART:{event.start:%Y%m%dT%H%M%S}Z")
+            lines.append(f"DTEND:{end:%Y%m%dT%H%M%S}Z")
+        else:
+            lines.append(f"DTSTART;VALUE=DATE:{event.start:%Y%m%d}")
+            lines.append(f"DTEND;VALUE=DATE:{event.start:%Y%m%d}")
+        if event.rrule:
+            lines.append(f"RRULE:{event.rrule}")
+        lines.append(f"UID:{event.uid}")
+        lines.append("TRANSP:TRANSPARENT")
+        lines.append(f"DTSTAMP:{stamp:%Y%m%dT%H%M%S}Z")
+        lines.append(f"SUMMARY:{event.summary}")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def calendar_versions(workload: Workload, cal_num: int) -> List[Tuple[date, str]]:
+    """Return (version date, ics text) for each version of one calendar."""
+    rng = random.Random(f"{workload.seed}-{cal_num}")
+    timezone = workload.timezones[cal_num % len(workload.timezones)]
+    events = initial_events(
+        rng, cal_num, workload.events_per_cal, workload.rrule_density
+    )
+    next_uid = workload.events_per_cal
+    versions = []
+    for v in range(workload.num_versions):
+        version_date = DEF_FIRST_DATE + timedelta(days=v)
+        stamp = datetime.combine(version_date, datetime.min.time())
+        if v > 0:
+            events, next_uid = churned(
+                rng, events, workload.churn_rate, workload.rrule_density, next_uid
+            )
+        versions.append((version_date, ics_text(events, stamp, timezone)))
+    return versions
+
+
+def cal_tuples(workload: Workload) -> List[Tuple[str, str, str, str]]:
+    """(cal_id, name, url, timezone) for each calendar, as used by main()."""
+    return [
+        (
+            f"synth{n}",
+            f"Synthetic Calendar {n}",
+            f"http://localhost/synth{n}.ics",
+            workload.timezones[n % len(workload.timezones)],
+        )
+        for n in range(workload.num_cals)
+    ]
+
+
+def write_workload(workload: Workload, ics_dir) -> List[Tuple[str, str, str, str]]:
+    """Write every version of every calendar to ics_dir; return cal tuples."""
+    ics_dir = Path(ics_dir)
+    ics_dir.mkdir(parents=True, exist_ok=True)
+    tuples = cal_tuples(workload)
+    for n, (cal_id, _, _, _) in enumerate(tuples):
+        for version_date, text in calendar_versions(workload, n):
+            path = ics_dir / f"{cal_id}__{version_stamp(version_date)}.ics"
+            path.write_bytes(text.encode("utf-8"))
+    return tuples
@@ -1,7 +1,33 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import tracemalloc
+import urllib.request
+from datetime import date, datetime, time
+
+import pytest
+import pytz
 import toml
 from pathlib import Path
 
-from ionical.ionical import main, sub_cfg, Cal
+import ionical.ionical
+from ionical.ionical import main, sub_cfg, watch, Cal, Schedule, ScheduleHistory
+from ionical.ionical import EventFormatter, configure_schedule_cache, schedule_cache
+from ionical.ionical import event_jsonl_records, version_stamp
+from ionical.archive import IcsPack, clear_reconstruction_cache
+from ionical.instrument import instrumentation
+from ionical.manifest import Manifest
+from ionical.retention import RetentionPolicy
+from ionical.scheduler import PollScheduler
+from ionical.server import ScheduleServer, ScheduleService
+from ionical.store import EventStore
+
+from tests.http_standin import StandInServer
+from tests.ics_generator import Workload, write_workload
 
 base_dir = "./"
 test_dir = base_dir + "tests/"
@@ -25,6 +51,31 @@ with open(Path(test_cfg_fn_path), "r", encoding="utf-8") as f:
     csv_conversion_dict = toml.loads(f.read())["csv"]["substitutions"]
 
 
+# Import time budget for ionical's own modules, when importing the CLI
+CLI_IMPORT_BUDGET_SECONDS = 0.25
+# Modules that importing the CLI must not load
+DEFERRED_IMPORTS = [
+    "icalendar",
+    "recurring_ical_events",
+    "pytz",
+    "urllib.request",
+    "pyarrow",
+    "http.server",
+    "concurrent.futures",
+    "sqlite3",
+    "cProfile",
+    "tracemalloc",
+]
+
+
+@pytest.fixture(autouse=True)
+def empty_schedule_cache():
+    """Start each test with no schedules cached (and the default budget)."""
+    schedule_cache.clear()
+    schedule_cache.reset_counters()
+    configure_schedule_cache()
+
+
 def test_1984_not_here_yet():
     assert 2 + 2 != 5
 
@@ -66,3 +117,780 @@ def test_generate_csv(tmpdir):
     )
     csv = (Path(tmpdir) / "tmpcsv.csv").read_text()
     assert csv == Path(exp_output_dir + "full_monty.csv").read_text()
+
+
+def test_streamed_schedule_matches_icalendar_schedule():
+    cal = Cal.from_tuple(cal_tuples[0], ics_dir=test_sched_dir)
+    for f in sorted(Path(test_sched_dir).glob("*.ics")):
+        icalCal = ScheduleHistory.get_icalendar_cal(f)
+        expected = Schedule.from_icalendar(icalCal, cal).events
+        assert Schedule.from_ics_file(f, cal).events == expected
+
+
+def recurring_ics(dtstamp: str, series_b_summary: str) -> str:
+    events = [
+        ("plain-1", "20210101T090000Z", "Plain start", None),
+        ("plain-2", "20210301T090000Z", "Plain end", None),
+        ("series-a", "20210104T140000Z", "Series A", "FREQ=WEEKLY;COUNT=8"),
+        ("series-b", "20210105T140000Z", series_b_summary, "FREQ=WEEKLY;COUNT=8"),
+    ]
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//test//EN"]
+    for uid, start, summary, rrule in events:
+        lines += ["BEGIN:VEVENT", f"UID:{uid}", f"DTSTAMP:{dtstamp}"]
+        lines += [f"DTSTART:{start}", f"SUMMARY:{summary}"]
+        lines += [f"RRULE:{rrule}"] if rrule else []
+        lines += ["END:VEVENT"]
+    return "\r\n".join(lines + ["END:VCALENDAR", ""])
+
+
+def test_recurrence_expansion_reuses_unchanged_series(tmpdir, monkeypatch):
+    cal = Cal.from_tuple(cal_tuples[0], ics_dir=test_sched_dir)
+    uncached_cal = Cal.from_tuple(cal_tuples[0], ics_dir=test_sched_dir)
+    uncached_cal.recurrence_cache = None
+    for f in sorted(Path(test_sched_dir).glob("110__*.ics")):
+        expected = Schedule.from_ics_file(f, uncached_cal).events
+        assert Schedule.from_ics_file(f, cal).events == expected
+
+    # A later version, with series B edited (and every DTSTAMP rewritten)
+    versions = [Path(tmpdir) / "v1.ics", Path(tmpdir) / "v2.ics"]
+    versions[0].write_text(recurring_ics("20210101T000000Z", "Series B"))
+    versions[1].write_text(recurring_ics("20210102T000000Z", "Series B, moved"))
+    cal = Cal("rec", "Recurring", ics_dir=tmpdir, timezone="UTC")
+    Schedule.from_ics_file(versions[0], cal)
+
+    expanded_series = []
+    original_of = ionical.ionical.recurring_ical_events.of
+
+    def recording_of(ical_cal, *args, **kwargs):
+        for event in ical_cal.walk("VEVENT"):
+            if "RRULE" in event:
+                expanded_series.append(str(event["UID"]))
+        return original_of(ical_cal, *args, **kwargs)
+
+    monkeypatch.setattr(ionical.ionical.recurring_ical_events, "of", recording_of)
+    schedule = Schedule.from_ics_file(versions[1], cal)
+    assert expanded_series == ["series-b"]
+    uncached_cal = Cal("rec", "Recurring", ics_dir=tmpdir, timezone="UTC")
+    uncached_cal.recurrence_cache = None
+    assert schedule.events == Schedule.from_ics_file(versions[1], uncached_cal).events
+    assert sum("moved" in str(e.summary) for e in schedule.events) == 8
+
+
+def test_packed_history_matches_loose_files(tmpdir, capsys):
+    packed_dir = Path(tmpdir) / "ics"
+    shutil.copytree(test_sched_dir, packed_dir)
+    main(cals_data=cal_tuples, ics_dir=packed_dir, pack_option=True, cfg=cfg)
+    assert not list(packed_dir.glob("Gilliam, Terry__*.ics"))
+    assert (packed_dir / "Gilliam, Terry.icspack").exists()
+    capsys.readouterr()
+    main(
+        cals_data=cal_tuples,
+        ics_dir=packed_dir,
+        show_changelog=True,
+        summary_filters=["IHS"],
+        cfg=cfg,
+    )
+    out, err = capsys.readouterr()
+    assert out == Path(exp_output_dir + "changelog_1.txt").read_text()
+
+
+def test_long_delta_chain_and_replaced_pack_are_read_back(tmpdir):
+    ics = b"BEGIN:VCALENDAR\nX-VERSION:%d\nEND:VCALENDAR\n"
+    pack = IcsPack(Path(tmpdir), "cal")
+    for i in range(1500):  # (deeper than the recursion limit)
+        last = pack.append(str(i), ics % i, keyframe_interval=2000)
+    assert last.chain_length == 1499
+    clear_reconstruction_cache()
+    assert last.read() == ics % 1499
+    other_dir = Path(tmpdir) / "other"
+    other_dir.mkdir()
+    other = IcsPack(other_dir, "cal")
+    other.append("0", ics % -1)
+    assert pack.entries()[0].read() == ics % 0
+    os.replace(other.path, pack.path)
+    os.replace(other.index_path, pack.index_path)
+    assert pack.entries()[0].read() == ics % -1
+
+
+def test_event_store_matches_ics_files(tmpdir, capsys):
+    store_cfg = dict(cfg, store={"enabled": True, "path": str(tmpdir / "h.sqlite")})
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        reindex_option=True,
+        cfg=store_cfg,
+    )
+    capsys.readouterr()
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        show_changelog=True,
+        summary_filters=["IHS"],
+        cfg=store_cfg,
+    )
+    out, err = capsys.readouterr()
+    assert out == Path(exp_output_dir + "changelog_1.txt").read_text()
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        show_schedule=True,
+        cals_filter=["Gilliam, Terry"],
+        summary_filters=["IHS"],
+        cfg=store_cfg,
+    )
+    out, err = capsys.readouterr()
+    assert out == Path(exp_output_dir + "gilliam_schedule_1.txt").read_text()
+
+
+def test_event_store_version_rerecorded_elsewhere_is_read_again(tmpdir):
+    store_path = Path(tmpdir) / "h.sqlite"
+    cal = Cal.from_tuple(cal_tuples[2], ics_dir=test_sched_dir)
+    cal.event_store = EventStore(store_path)
+    hx = cal.schedule_history
+    version_date = hx.version_dates[-1]
+    events = hx.schedule_for_date(version_date).events
+    assert events
+
+    # Another process (e.g., '--reindex') records the version again
+    other_store = EventStore(store_path)
+    other_store.add_version(str(cal.cal_id), version_stamp(version_date), [])
+    other_store.close()
+    cal = Cal.from_tuple(cal_tuples[2], ics_dir=test_sched_dir)
+    cal.event_store = EventStore(store_path)
+    assert not cal.schedule_history.schedule_for_date(version_date).events
+
+
+def test_watch_reports_changes_in_new_download(tmpdir, capsys):
+    shutil.copy(Path(test_sched_dir) / "Gilliam, Terry__20200526.ics", tmpdir)
+    feed_path = Path(test_sched_dir) / "Gilliam, Terry__20200527.ics"
+    cal = Cal(
+        cal_id="Gilliam, Terry",
+        name="Terry Gilliam",
+        feed_url=feed_path.resolve().as_uri(),
+        ics_dir=tmpdir,
+        timezone="US/Mountain",
+    )
+    watch(
+        cals=[cal],
+        interval=0,
+        summary_filters=["IHS"],
+        fmt_cfg=fmt_options["changelog"],
+        max_polls=1,
+    )
+    out, err = capsys.readouterr()
+    assert "REMOVE:   Terry Gilliam     Mar 27, 2020 8am" in out
+    assert "ADD:      Terry Gilliam     May 21, 2021 2pm" in out
+    assert "[compare ver: 2020-05-26]" in out
+
+
+def test_watch_saves_no_version_when_feed_not_modified(tmpdir, capsys):
+    body = Path(test_sched_dir, "Gilliam, Terry__20200527.ics").read_bytes()
+    with StandInServer({"terry": body}, etag=True) as server:
+        cal = Cal("terry", "Terry", feed_url=server.url_for("terry"), ics_dir=tmpdir)
+        watch(
+            cals=[cal],
+            interval=0,
+            archive_cfg={"write_packs": True},
+            fmt_cfg=fmt_options["changelog"],
+            max_polls=2,
+        )
+    assert server.not_modified == 1
+    assert len(IcsPack(tmpdir, "terry").entries()) == 1
+
+
+def test_watch_polls_shared_feed_once(tmpdir, capsys):
+    body = Path(test_sched_dir, "Gilliam, Terry__20200527.ics").read_bytes()
+    with StandInServer({"dept": body}) as server:
+        cals = [
+            Cal(name, name, feed_url=server.url_for("dept"), ics_dir=tmpdir)
+            for name in ("terry", "michael")
+        ]
+        watch(cals=cals, interval=0, fmt_cfg=fmt_options["changelog"], max_polls=1)
+    assert server.requests == 1
+    for cal in cals:
+        assert len(cal.schedule_history.version_dates) == 1
+
+
+def test_watch_quits_without_feeds(tmpdir, capsys):
+    with pytest.raises(SystemExit):
+        main(
+            cals_data=[("local", "Local only", None, "US/Mountain")],
+            ics_dir=tmpdir,
+            watch_interval=60,
+            cfg=cfg,
+        )
+    assert "Quitting" in capsys.readouterr().out
+
+
+def test_poll_scheduler_backs_off_after_failures():
+    scheduler = PollScheduler(
+        feeds=[("hot", "http://a.example/1.ics", 3600), ("cold", "http://b/2", None)],
+        default_interval=7 * 86400,
+        backoff_base=60,
+        max_backoff=600,
+        jitter=0,
+    )
+    assert scheduler.due(now=0) == ["hot", "cold"]
+    delays = [scheduler.record_failure("hot", IOError(), now=0) for _ in range(6)]
+    assert delays == [60, 120, 240, 480, 600, 600]
+    scheduler.record_success("hot", now=0)
+    scheduler.record_success("cold", now=0)
+    assert scheduler.due(now=3600) == ["hot"]
+    assert scheduler.seconds_until_next_due(now=0) == 3600
+    assert PollScheduler(feeds=[], default_interval=60).seconds_until_next_due() == 60
+
+
+def test_timestamped_versions_are_ordered_within_a_day(tmpdir):
+    src = Path(test_sched_dir)
+    shutil.copy(src / "Gilliam, Terry__20200526.ics", tmpdir)
+    shutil.copy(
+        src / "Gilliam, Terry__20200527.ics",
+        Path(tmpdir) / "Gilliam, Terry__20200527T170000.ics",
+    )
+    shutil.copy(
+        src / "Gilliam, Terry__20200526.ics",
+        Path(tmpdir) / "Gilliam, Terry__20200527T080000.ics",
+    )
+    cal = Cal(cal_id="Gilliam, Terry", name="Terry Gilliam", ics_dir=tmpdir)
+    hx = cal.schedule_history
+    assert hx.version_dates == [
+        date(2020, 5, 26),
+        datetime(2020, 5, 27, 8, 0),
+        datetime(2020, 5, 27, 17, 0),
+    ]
+    log = hx.change_log(since=datetime(2020, 5, 27, 12, 0))
+    assert list(log) == [datetime(2020, 5, 27, 17, 0)]
+    assert log[datetime(2020, 5, 27, 17, 0)]
+    assert hx.change_log()[datetime(2020, 5, 27, 8, 0)] == []
+
+
+def test_retention_policy_thins_versions_with_age():
+    policy = RetentionPolicy.from_cfg({"daily": 10, "weekly": "8w", "monthly": "1y"})
+    today = date(2021, 6, 30)
+    versions = [
+        date(2020, 1, 1),  # too old
+        date(2021, 1, 4),  # monthly
+        date(2021, 1, 20),
+        date(2021, 5, 17),  # weekly
+        date(2021, 5, 19),
+        date(2021, 6, 25),  # daily
+        datetime(2021, 6, 29, 8),
+        datetime(2021, 6, 29, 17),
+    ]
+    assert policy.versions_to_keep(versions, today=today) == {
+        date(2021, 1, 20),
+        date(2021, 5, 19),
+        date(2021, 6, 25),
+        datetime(2021, 6, 29, 17),
+    }
+    assert RetentionPolicy.from_cfg({"daily": "10"}).daily_days == 10
+
+
+def test_compaction_prunes_versions_and_keeps_their_changes(tmpdir):
+    for f in Path(test_sched_dir).glob("Gilliam, Terry__*.ics"):
+        shutil.copy(f, tmpdir)
+    cal = Cal(
+        cal_id="Gilliam, Terry",
+        name="Terry Gilliam",
+        ics_dir=tmpdir,
+        timezone="US/Mountain",
+    )
+    cal.pack_schedule_versions()
+    shutil.copy(Path(test_sched_dir) / "Gilliam, Terry__20200528.ics", tmpdir)
+    policy = RetentionPolicy(daily_days=0, weekly_days=0)
+    num_pruned = cal.compact_schedule_versions(policy, today=date(2020, 6, 1))
+    assert num_pruned == 2
+    assert cal.schedule_history.version_dates == [date(2020, 5, 28)]
+    pack = IcsPack(tmpdir, cal.cal_id)
+    assert [e.version for e in pack.entries()] == ["20200528"]
+    assert pack.path.name == "Gilliam, Terry.1.icspack"
+    assert not (Path(tmpdir) / "Gilliam, Terry.icspack").exists()
+    log = (Path(tmpdir) / "Gilliam, Terry.compacted_changes.txt").read_text()
+    assert "Updates for sched vers dated 2020-05-27" in log
+    assert "Updates for sched vers dated 2020-05-28" in log
+
+
+def test_synthetic_workload_history(tmpdir):
+    workload = Workload(num_cals=2, events_per_cal=20, num_versions=3, churn_rate=0.1)
+    tuples = write_workload(workload, tmpdir)
+    for cal_tuple in tuples:
+        hx = Cal.from_tuple(cal_tuple, ics_dir=tmpdir).schedule_history
+        assert len(hx.version_dates) == 3
+        assert all(hx.change_log().values())
+
+
+def test_event_formatter_matches_event_display():
+    cal = Cal.from_tuple(cal_tuples[0], ics_dir=test_sched_dir)
+    events = cal.current_schedule.filtered_events()
+    view_cfg = sub_cfg(fmt_options, "schedule_view")
+    rules = cfg["event_classifications"]
+    formatter = EventFormatter(view_cfg, rules, cal.timezone)
+    expected = [event.display(view_cfg, rules) for event in events]
+    assert formatter.format_lines(events) == "\n".join(expected)
+    assert len(formatter._time_strs) < len(events)
+
+
+def test_feed_download_uses_gzip_and_conditional_requests(tmpdir):
+    body = Path(test_sched_dir, "Gilliam, Terry__20200527.ics").read_bytes()
+    with StandInServer({"terry": body}, gzip=True, etag=True) as server:
+        cal = Cal("terry", "Terry", feed_url=server.url_for("terry"), ics_dir=tmpdir)
+        feed = cal.schedule_feed
+        version_date, source = feed.download_latest_schedule_version(ics_dir=tmpdir)
+        assert source.read_bytes() == body
+        # Not modified, so nothing is saved
+        assert feed.download_latest_schedule_version(ics_dir=tmpdir) is None
+    assert server.requests == 2
+    assert server.not_modified == 1
+    assert server.bytes_sent < len(body)
+
+
+def test_shared_feed_is_fetched_and_parsed_once(tmpdir, capsys):
+    body = Path(test_sched_dir, "112__20200527.ics").read_bytes()
+    with StandInServer({"dept": body, "other": body}) as server:
+        tuples = [
+            ("jones_mt", "Jones", server.url_for("dept"), "US/Mountain"),
+            ("jones_et", "Jones", server.url_for("dept"), "US/Eastern"),
+            ("other", "Other", server.url_for("other"), "US/Mountain"),
+        ]
+        main(
+            cals_data=tuples,
+            ics_dir=tmpdir,
+            download_option=True,
+            show_schedule=True,
+            cfg=cfg,
+            profile_option=True,
+        )
+    out, err = capsys.readouterr()
+    assert server.requests == 2
+    for cal_id in ["jones_mt", "jones_et", "other"]:
+        [ics_file] = Path(tmpdir).glob(f"{cal_id}__*.ics")
+        assert ics_file.read_bytes() == body
+    parsed = {cal_id for (stage, cal_id) in instrumentation.calls if stage == "parse"}
+    assert parsed == {"jones_mt", "other"}
+    # (The shared version is kept, like any other, in the bounded schedule_cache)
+    assert ("shared_feed", tuples[0][2], hashlib.sha1(body).hexdigest()) in (
+        schedule_cache
+    )
+    mountain, eastern = out.split("Schedule for Jones")[1:]
+    assert "(US/Eastern)" in eastern and mountain != eastern
+
+
+def test_manifest_lists_downloads_and_is_verified(tmpdir, capsys):
+    ics_dir = Path(tmpdir) / "ics"
+    shutil.copytree(test_sched_dir, ics_dir)
+    manifest_cfg = {**cfg, "archive": {"manifest": True}}
+    main(cals_data=cal_tuples, ics_dir=ics_dir, rebuild_manifest_option=True)
+    assert len(Manifest(ics_dir).entries_for("Gilliam, Terry")) == 3
+
+    # Histories come from the manifest, so an unlisted file is not seen
+    unlisted = ics_dir / "Gilliam, Terry__20200529.ics"
+    shutil.copy(ics_dir / "Gilliam, Terry__20200528.ics", unlisted)
+    gilliam = Cal.from_tuple(cal_tuples[2], ics_dir, manifest=Manifest(ics_dir))
+    assert gilliam.schedule_history.version_dates[-1] == date(2020, 5, 28)
+    main(cals_data=cal_tuples, ics_dir=ics_dir, verify_manifest_option=True)
+    out, err = capsys.readouterr()
+    assert "(1 problem(s))" in out and f"Not in manifest: {unlisted.name}" in out
+    unlisted.unlink()
+
+    body = Path(test_sched_dir, "112__20200527.ics").read_bytes()
+    with StandInServer({"dept": body}) as server:
+        tuples = [("dept", "Dept", server.url_for("dept"), "US/Mountain")]
+        main(cals_data=tuples, ics_dir=ics_dir, download_option=True, cfg=manifest_cfg)
+    [entry] = Manifest(ics_dir).entries_for("dept")
+    assert entry.size == len(body)
+    main(cals_data=cal_tuples, ics_dir=ics_dir, verify_manifest_option=True)
+    out, err = capsys.readouterr()
+    assert "in sync" in out
+
+
+def test_manifest_enabled_for_existing_ics_dir(tmpdir, capsys):
+    ics_dir = Path(tmpdir) / "ics"
+    shutil.copytree(test_sched_dir, ics_dir)
+    gilliam = Cal.from_tuple(cal_tuples[2], ics_dir, manifest=Manifest(ics_dir))
+    assert len(gilliam.schedule_history.version_dates) == 3  # (ics_dir listed)
+
+    main(cals_data=cal_tuples, ics_dir=test_sched_dir, show_changelog=True, cfg=cfg)
+    expected, _ = capsys.readouterr()
+    manifest_cfg = {**cfg, "archive": {"manifest": True}}
+    main(cals_data=cal_tuples, ics_dir=ics_dir, show_changelog=True, cfg=manifest_cfg)
+    out, _ = capsys.readouterr()
+    assert out == expected and "Terry Gilliam" in out
+    assert len(Manifest(ics_dir).entries_for("Gilliam, Terry")) == 3
+
+    # Processes saving at once each keep the other's changes
+    first, second = Manifest(ics_dir), Manifest(ics_dir)
+    for manifest, stamp in [(first, "20200529"), (second, "20200530")]:
+        path = ics_dir / f"Gilliam, Terry__{stamp}.ics"
+        shutil.copy(ics_dir / "Gilliam, Terry__20200528.ics", path)
+        manifest.add_file("Gilliam, Terry", stamp, path.name)
+    second.remove_file("Gilliam, Terry__20200526.ics")
+    first.save()
+    second.save()
+    versions = [e.version for e in Manifest(ics_dir).entries_for("Gilliam, Terry")]
+    assert sorted(versions) == ["20200527", "20200528", "20200529", "20200530"]
+
+
+def test_sharded_layout_migration(tmpdir, capsys):
+    ics_dir = Path(tmpdir) / "ics"
+    shutil.copytree(test_sched_dir, ics_dir)
+    sharded_cfg = {**cfg, "archive": {"layout": "sharded", "manifest": True}}
+    main(
+        cals_data=cal_tuples,
+        ics_dir=ics_dir,
+        migrate_layout_option=True,
+        show_changelog=True,
+        summary_filters=["IHS"],
+        cfg=sharded_cfg,
+    )
+    out, err = capsys.readouterr()
+    assert out == Path(exp_output_dir + "changelog_1.txt").read_text()
+    assert (ics_dir / "Gilliam, Terry" / "2020" / "20200527.ics").exists()
+    assert not list(ics_dir.glob("Gilliam, Terry__*.ics"))
+    main(
+        cals_data=cal_tuples,
+        ics_dir=ics_dir,
+        verify_manifest_option=True,
+        cfg=sharded_cfg,
+    )
+    out, err = capsys.readouterr()
+    assert "in sync" in out
+
+    flat_cfg = {**cfg, "archive": {"layout": "flat"}}
+    main(
+        cals_data=cal_tuples, ics_dir=ics_dir, migrate_layout_option=True, cfg=flat_cfg
+    )
+    assert (ics_dir / "Gilliam, Terry__20200527.ics").exists()
+    assert not (ics_dir / "Gilliam, Terry").exists()
+
+
+@pytest.mark.parametrize("actions", ["changelog", "all"])
+def test_combined_actions_parse_each_version_once(tmpdir, capsys, actions):
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        show_changelog=True,
+        show_schedule=actions == "all",
+        csv_export_file=Path(tmpdir) / "x.csv" if actions == "all" else None,
+        earliest_date=date(2019, 1, 1),
+        cfg=cfg,
+        profile_option=True,
+    )
+    parse_calls = {
+        cal_id: n
+        for (stage, cal_id), n in instrumentation.calls.items()
+        if stage == "parse"
+    }
+    capsys.readouterr()
+    # (3 versions per calendar)
+    assert parse_calls == {str(cal_tuple[0]): 3 for cal_tuple in cal_tuples}
+
+
+def test_schedule_cache_is_shared_and_bounded(tmpdir, capsys):
+    main(cals_data=cal_tuples, ics_dir=test_sched_dir, show_changelog=True, cfg=cfg)
+    first_out, _ = capsys.readouterr()
+    assert schedule_cache.misses and not schedule_cache.evictions
+    num_cached = len(schedule_cache)
+
+    # A later run (with new Cals) reuses the parsed schedules
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        show_changelog=True,
+        cfg=cfg,
+        profile_option=True,
+    )
+    out, err = capsys.readouterr()
+    assert out == first_out
+    assert "Schedule cache: " in err and " 0 miss(es)" in err
+    assert not any(stage == "parse" for stage, _ in instrumentation.calls)
+
+    # A smaller budget evicts the least recently used schedules
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        show_changelog=True,
+        cfg={**cfg, "cache": {"max_schedules": 2}},
+    )
+    out, _ = capsys.readouterr()
+    assert out == first_out
+    assert len(schedule_cache) == 2
+    assert schedule_cache.evictions >= num_cached - 2
+    schedule_cache.configure(max_bytes=0)
+    assert len(schedule_cache) == 0
+    configure_schedule_cache()
+    assert schedule_cache.max_entries is None and schedule_cache.max_bytes
+
+
+def test_workers_match_serial_output(tmpdir, capsys):
+    common = dict(cals_data=cal_tuples, ics_dir=test_sched_dir, cfg=cfg, workers=2)
+    main(show_changelog=True, summary_filters=["IHS"], **common)
+    out, err = capsys.readouterr()
+    assert out == Path(exp_output_dir + "changelog_1.txt").read_text()
+    main(
+        show_schedule=True,
+        cals_filter=["Gilliam, Terry"],
+        summary_filters=["IHS"],
+        **common,
+    )
+    out, err = capsys.readouterr()
+    assert out == Path(exp_output_dir + "gilliam_schedule_1.txt").read_text()
+    csv_file = Path(tmpdir) / "tmpcsv.csv"
+    main(csv_export_file=csv_file, summary_filters=["IHS"], **common)
+    assert csv_file.read_text() == Path(exp_output_dir + "full_monty.csv").read_text()
+
+
+def test_jsonl_export_of_events_and_changes(tmpdir):
+    jsonl_files = [Path(tmpdir) / "serial.jsonl", Path(tmpdir) / "workers.jsonl"]
+    for jsonl_file, workers in zip(jsonl_files, [1, 2]):
+        main(
+            cals_data=cal_tuples,
+            ics_dir=test_sched_dir,
+            jsonl_export_file=jsonl_file,
+            earliest_date=date(2019, 1, 1),
+            cfg=cfg,
+            workers=workers,
+        )
+    text = jsonl_files[0].read_text()
+    assert jsonl_files[1].read_text() == text
+    assert sorted(p.name for p in Path(tmpdir).iterdir()) == [
+        "serial.jsonl",
+        "workers.jsonl",
+    ]
+
+    records = [json.loads(line) for line in text.splitlines()]
+    cal = Cal.from_tuple(cal_tuples[0], ics_dir=test_sched_dir)
+    hx = cal.schedule_history
+    events = [r for r in records if r["record"] == "event"]
+    changes = [r for r in records if r["record"] == "change"]
+    cal_events = [r for r in events if r["cal_id"] == str(cal.cal_id)]
+    assert len(cal_events) == len(
+        cal.current_schedule.filtered_events(earliest_date=date(2019, 1, 1))
+    )
+    assert {r["version"] for r in cal_events} == {"20200528"}
+    cal_changes = [r for r in changes if r["cal_id"] == str(cal.cal_id)]
+    num_changes = sum(
+        len(ScheduleHistory.filter_changes(c, earliest_date=date(2019, 1, 1)))
+        for c in hx.change_log().values()
+    )
+    assert len(cal_changes) == num_changes
+    assert {r["change"] for r in changes} == {"added", "removed"}
+    timed = next(r for r in changes if "+" in r["start"])
+    assert timed["local_start"] != timed["start"]  # (in the calendar's timezone)
+
+
+def test_jsonl_export_with_default_classification_rules(tmpdir):
+    jsonl_file = Path(tmpdir) / "default_rules.jsonl"
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        jsonl_export_file=jsonl_file,
+        cfg={k: v for k, v in cfg.items() if k != "event_classifications"},
+    )
+    events = [json.loads(line) for line in jsonl_file.read_text().splitlines()]
+    events = [r for r in events if r["record"] == "event"]
+    timed = [r for r in events if "T" in r["local_start"]]
+    assert timed and len(timed) < len(events)
+    for r in timed:
+        hour = int(r["local_start"].split("T")[1][:2])
+        assert r["categories"] == {"shift": "AM" if hour < 12 else "PM"}
+
+
+def test_parquet_export_of_every_version(tmpdir, capsys):
+    pyarrow_dataset = pytest.importorskip("pyarrow.dataset")
+    parquet_dirs = [Path(tmpdir) / "serial", Path(tmpdir) / "workers"]
+    outputs = []
+    for parquet_dir, workers in zip(parquet_dirs, [1, 2]):
+        for _ in range(2):  # (a second export replaces the first)
+            main(
+                cals_data=cal_tuples,
+                ics_dir=test_sched_dir,
+                parquet_dir=parquet_dir,
+                cfg=cfg,
+                workers=workers,
+                verbose=1,
+            )
+        outputs.append(capsys.readouterr().out)
+    assert outputs[1] == outputs[0]
+    assert outputs[0].count("Parquet row(s) for ") == 2 * len(cal_tuples)
+    tables = [
+        pyarrow_dataset.dataset(d, format="parquet", partitioning="hive").to_table()
+        for d in parquet_dirs
+    ]
+    assert tables[0].sort_by("summary").equals(tables[1].sort_by("summary"))
+
+    cal = Cal.from_tuple(cal_tuples[0], ics_dir=test_sched_dir)
+    hx = cal.schedule_history
+    rows = (
+        tables[0].filter(pyarrow_dataset.field("cal_id") == str(cal.cal_id)).to_pylist()
+    )
+    assert len(rows) == sum(
+        len(hx.schedule_for_date(d).events) for d in hx.version_dates
+    )
+    assert {row["version_month"] for row in rows} == {"2020-05"}
+    assert (parquet_dirs[0] / "cal_id=Gilliam%2C%20Terry").is_dir()
+    all_day = next(row for row in rows if row["all_day"])
+    local_midnight = datetime.combine(all_day["start_date"], time())
+    assert all_day["start"] == pytz.timezone(cal.timezone).localize(local_midnight)
+
+
+def test_service_answers_queries_and_picks_up_new_versions(tmpdir):
+    shutil.copy(Path(test_sched_dir) / "Gilliam, Terry__20200526.ics", tmpdir)
+    gilliam = next(t for t in cal_tuples if t[0] == "Gilliam, Terry")
+    cal = Cal.from_tuple(gilliam, ics_dir=tmpdir)
+    service = ScheduleService([cal], rescan_interval=0)
+    service.warm()
+
+    status, body = service.handle("/schedule/Gilliam%2C%20Terry?from=2019-01-01")
+    assert status == 200
+    assert body["version"] == "20200526"
+    assert body["events"] == list(event_jsonl_records(cal, date(2019, 1, 1)))
+    status, body = service.handle("/schedule/Gilliam%2C%20Terry?q=IHS&to=")
+    assert body["events"]
+    assert all("IHS" in event["summary"] for event in body["events"])
+    assert service.handle("/schedule/Nobody")[0] == 404
+    assert service.handle("/changes/Gilliam%2C%20Terry?n=x")[0] == 400
+    assert service.handle("/schedule/Gilliam%2C%20Terry?from=May")[0] == 400
+
+    hx = cal.schedule_history
+    parsed = hx.schedule_for_date(date(2020, 5, 26))
+    assert service.handle("/changes/Gilliam%2C%20Terry")[1]["changes"] == []
+    shutil.copy(Path(test_sched_dir) / "Gilliam, Terry__20200527.ics", tmpdir)
+    status, body = service.handle("/changes/Gilliam%2C%20Terry?n=1&from=")
+    assert body["version"] == "20200527"
+    assert {c["prior_version"] for c in body["changes"]} == {"20200526"}
+    assert len(body["changes"]) == len(hx.get_changes_for_date(date(2020, 5, 27)))
+    assert hx.schedule_for_date(date(2020, 5, 26)) is parsed  # (not reparsed)
+
+    with ScheduleServer(service) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            port = server.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/calendars") as r:
+                listing = json.loads(r.read())
+        finally:
+            server.shutdown()
+            thread.join()
+    assert listing == {
+        "calendars": [
+            {
+                "cal_id": "Gilliam, Terry",
+                "name": cal.name,
+                "versions": 2,
+                "latest_version": "20200527",
+            }
+        ]
+    }
+
+
+def test_profile_reports_stages_without_changing_output(tmpdir, capsys):
+    stats_file = Path(tmpdir) / "slowest.prof"
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        show_changelog=True,
+        summary_filters=["IHS"],
+        cfg=cfg,
+        profile_option=True,
+        profile_stats_file=str(stats_file),
+    )
+    out, err = capsys.readouterr()
+    assert out == Path(exp_output_dir + "changelog_1.txt").read_text()
+    for stage in ["scan_dir", "parse", "expand_recurrences", "diff"]:
+        assert f"\n  {stage} " in err
+    assert f"Slowest calendar: {instrumentation.slowest_cal()}" in err
+    assert stats_file.exists()
+    assert not instrumentation.enabled
+
+
+def test_metrics_file_after_download_and_changelog(tmpdir, capsys):
+    body = Path(test_sched_dir, "Gilliam, Terry__20200527.ics").read_bytes()
+    shutil.copy(Path(test_sched_dir) / "Gilliam, Terry__20200526.ics", tmpdir)
+    with StandInServer({"terry": body}) as server:
+        cal_tuple = ("Gilliam, Terry", "Terry", server.url_for("terry"), "US/Mountain")
+        for metrics_fn in ["metrics.json", "metrics.prom"]:
+            main(
+                cals_data=[cal_tuple],
+                ics_dir=tmpdir,
+                download_option=True,
+                show_changelog=True,
+                num_changelogs=1,
+                jsonl_export_file=str(Path(tmpdir) / "export.jsonl"),
+                cfg=cfg,
+                metrics_file=str(Path(tmpdir) / metrics_fn),
+            )
+    capsys.readouterr()
+    metrics = json.loads((Path(tmpdir) / "metrics.json").read_text())
+    terry = metrics["calendars"]["Gilliam, Terry"]
+    assert terry["download_bytes"] == len(body)
+    assert terry["http_status"] == 200
+    assert terry["versions"] == 2
+    assert terry["events"] > 0
+    hx = Cal.from_tuple(cal_tuple, ics_dir=tmpdir).schedule_history
+    # (compared for both the changelog and the export, but counted once)
+    assert terry["changes"] == len(hx.get_changes_for_date(hx.version_dates[-1]))
+    assert terry["parse_seconds"] > 0
+    prom = (Path(tmpdir) / "metrics.prom").read_text()
+    assert 'ionical_http_status{cal_id="Gilliam, Terry"} 200' in prom
+    assert "ionical_run_duration_seconds " in prom
+
+
+def test_metrics_file_after_failed_download_of_shared_feed(tmpdir, capsys):
+    metrics_file = Path(tmpdir) / "metrics.json"
+    with StandInServer({}) as server:  # (so that the feed is not found)
+        tuples = [
+            ("jones_mt", "Jones", server.url_for("dept"), "US/Mountain"),
+            ("jones_et", "Jones", server.url_for("dept"), "US/Eastern"),
+        ]
+        with pytest.raises(Exception, match="HTTP error"):
+            main(
+                cals_data=tuples,
+                ics_dir=tmpdir,
+                download_option=True,
+                cfg=cfg,
+                metrics_file=str(metrics_file),
+            )
+    capsys.readouterr()
+    calendars = json.loads(metrics_file.read_text())["calendars"]
+    assert calendars["jones_mt"]["http_status"] == 404
+    assert calendars["jones_et"]["http_status"] == 404
+    assert not instrumentation.enabled
+
+
+def test_memory_report_by_stage(capsys):
+    main(
+        cals_data=cal_tuples,
+        ics_dir=test_sched_dir,
+        show_changelog=True,
+        summary_filters=["IHS"],
+        cals_filter=["Gilliam, Terry"],
+        cfg=cfg,
+        memory_report_option=True,
+    )
+    out, err = capsys.readouterr()
+    assert "Memory by stage" in err
+    assert "\n  parse " in err and "\n  diff " in err
+    assert "Top allocation sites" in err
+    assert not tracemalloc.is_tracing()
+
+
+def test_cli_import_defers_heavy_dependencies():
+    # (A deferred module's code only runs, and is only listed, once used)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import ionical.__main__"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    self_us = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_time, _, name = line[len("import time:") :].split("|")
+            if self_time.strip().isdigit():
+                self_us[name.strip()] = int(self_time)
+    for name in DEFERRED_IMPORTS:
+        assert name not in self_us, f"{name} imported at CLI startup"
+    ionical_us = sum(
+        us for name, us in self_us.items() if name.split(".")[0] == "ionical"
+    )
+    assert ionical_us < CLI_IMPORT_BUDGET_SECONDS * 1e6